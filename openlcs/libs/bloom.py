@@ -0,0 +1,111 @@
+"""
+Bloom filter of SWH IDs, published by hub so that workers check only the
+files possibly scanned before with hub.
+"""
+import hashlib
+import math
+import os
+import re
+import struct
+import tempfile
+
+BLOOM_MAGIC = b'OLBF'
+BLOOM_VERSION = 1
+# magic, version, number of hashes, number of bits
+BLOOM_HEADER = struct.Struct('>4sBBQ')
+DEFAULT_ERROR_RATE = 0.01
+
+
+def get_swhid_filter_name(kind, detector=None):
+    """
+    File name of the filter of all files(kind 'file'), or of files license
+    or copyright scanned by the detector.
+    """
+    name = kind if kind == 'file' else f'{kind}_{detector}'
+    return re.sub(r'[^\w.-]', '_', name) + '.bloom'
+
+
+def get_digest(swhid):
+    """
+    Get the hex digest to derive bit indexes from. The sha1 in a SWH ID is
+    uniformly distributed already, other strings are hashed.
+    """
+    digest = swhid.rsplit(':', 1)[-1]
+    if len(digest) != 40:
+        digest = hashlib.sha1(swhid.encode('utf-8')).hexdigest()
+    return digest
+
+
+class BloomFilter(object):
+    """
+    Bloom filter with bit indexes derived through double hashing.
+    """
+    def __init__(self, num_bits, num_hashes, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else \
+            bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=DEFAULT_ERROR_RATE):
+        """
+        Create a filter with optimal size for the number of items and the
+        false positive rate.
+        """
+        capacity = max(capacity, 1)
+        num_bits = math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, num_hashes)
+
+    def get_indexes(self, swhid):
+        digest = get_digest(swhid)
+        h1 = int(digest[:16], 16)
+        h2 = int(digest[16:32], 16) | 1
+        return [(h1 + i * h2) % self.num_bits
+                for i in range(self.num_hashes)]
+
+    def add(self, swhid):
+        for idx in self.get_indexes(swhid):
+            self.bits[idx >> 3] |= 1 << (idx & 7)
+
+    def update(self, swhids):
+        for swhid in swhids:
+            self.add(swhid)
+
+    def __contains__(self, swhid):
+        return all(self.bits[idx >> 3] & (1 << (idx & 7))
+                   for idx in self.get_indexes(swhid))
+
+    def to_bytes(self):
+        return BLOOM_HEADER.pack(BLOOM_MAGIC, BLOOM_VERSION,
+                                 self.num_hashes, self.num_bits) + \
+            bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, num_hashes, num_bits = BLOOM_HEADER.unpack_from(data)
+        if magic != BLOOM_MAGIC or version != BLOOM_VERSION:
+            raise ValueError('Unknown bloom filter format.')
+        bits = bytearray(data[BLOOM_HEADER.size:])
+        if len(bits) != (num_bits + 7) // 8:
+            raise ValueError('Truncated bloom filter.')
+        return cls(num_bits, num_hashes, bits)
+
+    def dump(self, file_path):
+        """
+        Write the filter atomically, readers never see a partial file.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path))
+        try:
+            with open(fd, 'wb') as f:
+                f.write(self.to_bytes())
+            os.replace(tmp_path, file_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as f:
+            return cls.from_bytes(f.read())
@@ -1,4 +1,5 @@
 import filetype
+import functools
 import glob
 import mimetypes
 import http
@@ -20,8 +21,14 @@ from requests.exceptions import HTTPError
 from bs4 import BeautifulSoup
 
 
+@functools.lru_cache(maxsize=None)
+def get_mime_types():
+    # Building the database reads the system mime.types files.
+    return mimetypes.MimeTypes()
+
+
 def get_mime_type(filepath):
-    mime_type = mimetypes.MimeTypes().guess_type(filepath)[0]
+    mime_type = get_mime_types().guess_type(filepath)[0]
     if not mime_type:
         try:
             mime_type = filetype.guess_mime(filepath)
@@ -189,16 +196,54 @@ def search_content_by_patterns(search_patterns):
     return paths
 
 
-def selection_sort_components(components):
+class ComponentTrie:
     """
-    Sort components by the component name.
+    Trie of component names split by path separator, of all component
+    types. A component is a parent of the components with names under its
+    name, e.g. 'github.com/foo' of 'github.com/foo/bar', whose sources are
+    in the source of the parent.
     """
-    length = len(components)
-    for i in range(length - 1, 0, -1):
-        for j in range(i):
-            if components[j].get('name') in components[i].get('name'):
-                components[j], components[i] = components[i], components[j]
-    return components
+    def __init__(self, components):
+        # Node is a list of child nodes by name part, and the components.
+        self.root = [{}, []]
+        for component in components:
+            node = self.root
+            for part in component.get('name').split(os.sep):
+                node = node[0].setdefault(part, [{}, []])
+            node[1].append(component)
+
+    def sort_components(self):
+        """
+        Sort components with children ahead of their parents of any type,
+        so that sources of children are handled before sources of their
+        parents.
+        """
+        components = []
+        # Post-order traversal
+        stack = [(self.root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if visited:
+                components.extend(node[1])
+                continue
+            stack.append((node, True))
+            stack.extend((child, False)
+                         for child in reversed(node[0].values()))
+        return components
+
+    def has_parent(self, component):
+        """
+        Check if there is a parent component of the same type.
+        """
+        comp_type = component.get('type')
+        node = self.root
+        for part in component.get('name').split(os.sep)[:-1]:
+            node = node[0].get(part)
+            if node is None:
+                return False
+            if any(c.get('type') == comp_type for c in node[1]):
+                return True
+        return False
 
 
 def get_component_flat(data, comp_type):
@@ -217,27 +262,24 @@ def get_component_flat(data, comp_type):
     return component
 
 
-def uncompress_blob_gzip_files(src_file, dest_dir):
-    # Uncompress the blob files that come from source container registry.
-    # Under the directory, most of the files are gzip files that need to
-    # decompress. There are some metadata files that no need to decompress.
-    err_msg_list = []
-    src_dir = os.path.dirname(src_file)
-    blob_files = os.listdir(src_dir)
-    for blob_file in blob_files:
-        blob_file = os.path.join(src_dir, blob_file)
-        file_type = get_mime_type(blob_file)
-        if file_type == "application/gzip":
-            cmd = ['tar', '-xvf', blob_file]
-            try:
-                subprocess.check_call(cmd, cwd=dest_dir)
-            except Exception as e:
-                err_msg = f"Failed to decompress blob files: {e}"
-                err_msg_list.append(err_msg)
-            else:
-                os.remove(blob_file)
-        continue
-    return err_msg_list
+def merge_tree(src_dir, dest_dir):
+    """
+    Move entries of src_dir into dest_dir, directories existing in both are
+    merged recursively, other existing entries are replaced. src_dir is
+    removed afterwards.
+    """
+    for entry in list(os.scandir(src_dir)):
+        dest = os.path.join(dest_dir, entry.name)
+        dest_is_dir = os.path.isdir(dest) and not os.path.islink(dest)
+        if entry.is_dir(follow_symlinks=False) and dest_is_dir:
+            merge_tree(entry.path, dest)
+            continue
+        if dest_is_dir:
+            shutil.rmtree(dest)
+        elif os.path.lexists(dest):
+            os.remove(dest)
+        os.rename(entry.path, dest)
+    os.rmdir(src_dir)
 
 
 def find_srpm_source(sources):
@@ -0,0 +1,243 @@
+"""
+Compact format of package data and scan result posted to hub.
+
+The data is written as gzip compressed json lines. The first line is a
+header with the format version, kind of the data, and all the small fields.
+Paths with swhids are written only once into a path table, which is split
+into chunks in the following lines, detections then reference paths by
+their index in the path table.
+
+A header line looks like:
+    {"format": "openlcs-compact", "version": 1, "kind": "scan_result",
+     "meta": {...}}
+Followed by chunk lines like:
+    {"swhids": ["swh:1:cnt:...", ...]}
+    {"paths": [["a/b.c", 0], ...]}
+    {"licenses": [[0, "MIT", 100.0, 1, 20, true, "mit.LICENSE"], ...]}
+    {"copyrights": [[0, [{"copyright": "...", ...}]], ...]}
+    {"failed_paths": [0, ...]}
+"""
+import gzip
+import json
+
+COMPACT_FORMAT = 'openlcs-compact'
+COMPACT_VERSION = 1
+GZIP_MAGIC = b'\x1f\x8b'
+CHUNK_SIZE = 10000
+
+# Index of paths that are not in the source path table.
+NO_SWHID = -1
+
+
+class PathTable(object):
+    """
+    Path table of the source, paths and swhids are indexed in the order
+    added.
+    """
+    def __init__(self):
+        self.swhids = []
+        self.paths = []
+        self.swhid_index = {}
+        self.path_index = {}
+
+    def add_swhid(self, swhid):
+        if swhid not in self.swhid_index:
+            self.swhid_index[swhid] = len(self.swhids)
+            self.swhids.append(swhid)
+        return self.swhid_index[swhid]
+
+    def add_path(self, path, swhid=None):
+        if path not in self.path_index:
+            swhid_idx = self.add_swhid(swhid) if swhid else NO_SWHID
+            self.path_index[path] = len(self.paths)
+            self.paths.append([path, swhid_idx])
+        return self.path_index[path]
+
+
+def write_chunks(f, key, items, cls=None):
+    for i in range(0, len(items), CHUNK_SIZE):
+        f.write(json.dumps({key: items[i:i + CHUNK_SIZE]}, cls=cls))
+        f.write('\n')
+
+
+def write_table(f, table, cls=None):
+    # Swhids are written ahead of paths referencing them.
+    write_chunks(f, 'swhids', table.swhids, cls)
+    write_chunks(f, 'paths', table.paths, cls)
+
+
+def write_header(f, kind, meta, cls=None):
+    f.write(json.dumps({
+        'format': COMPACT_FORMAT,
+        'version': COMPACT_VERSION,
+        'kind': kind,
+        'meta': meta,
+    }, cls=cls))
+    f.write('\n')
+
+
+def dump_package_data(data, file_path, cls=None):
+    """
+    Write package data, i.e., task id and source info, in compact format.
+    """
+    source_info = dict(data.get('source_info') or {})
+    paths = source_info.pop('paths', None) or []
+    swhids = source_info.pop('swhids', None) or []
+    table = PathTable()
+    for path in paths:
+        table.add_path(path.get('path'), path.get('file'))
+    # Swhids referenced are added ahead of writing the table.
+    unseen_swhids = [table.add_swhid(swhid) for swhid in swhids]
+    meta = {
+        'task_id': data.get('task_id'),
+        'source_info': source_info,
+    }
+    with gzip.open(file_path, 'wt', encoding='utf-8') as f:
+        write_header(f, 'package', meta, cls)
+        write_table(f, table, cls)
+        write_chunks(f, 'unseen_swhids', unseen_swhids, cls)
+
+
+def dump_scan_result(data, file_path, cls=None):
+    """
+    Write scan result in compact format.
+    """
+    meta = dict(data)
+    table = PathTable()
+    for path, swhid in meta.pop('path_with_swhids', None) or []:
+        table.add_path(path, swhid)
+    licenses = []
+    if 'licenses' in meta:
+        meta['licenses'] = dict(meta['licenses'])
+        licenses = [[table.add_path(lic[0])] + list(lic[1:])
+                    for lic in meta['licenses'].pop('data') or []]
+    copyrights = []
+    if 'copyrights' in meta:
+        meta['copyrights'] = dict(meta['copyrights'])
+        copyright_data = dict(meta['copyrights'].pop('data') or {})
+        detail_copyrights = copyright_data.pop('detail_copyrights', {})
+        copyrights = [[table.add_path(path), value]
+                      for path, value in detail_copyrights.items()]
+        meta['copyrights']['data'] = copyright_data
+    failed_paths = [table.add_path(path)
+                    for path in meta.pop('failed_paths', None) or []]
+    with gzip.open(file_path, 'wt', encoding='utf-8') as f:
+        write_header(f, 'scan_result', meta, cls)
+        write_table(f, table, cls)
+        write_chunks(f, 'licenses', licenses, cls)
+        write_chunks(f, 'copyrights', copyrights, cls)
+        write_chunks(f, 'failed_paths', failed_paths, cls)
+
+
+class CompactItems(object):
+    """
+    Items chunked under the given key in a compact format file. Items are
+    read from the file each time iterated, so that they're never held in
+    memory as a whole, and could be iterated again on retries.
+    """
+    def __init__(self, file_path, key, decode):
+        self.file_path = file_path
+        self.key = key
+        self.decode = decode
+        self.prefix = get_line_prefix(key)
+
+    def __iter__(self):
+        with gzip.open(self.file_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith(self.prefix):
+                    yield from map(self.decode, json.loads(line)[self.key])
+
+
+class CompactMapping(CompactItems):
+    """
+    Items of (key, value) pairs, accessed with `items()` as a mapping.
+    """
+    def items(self):
+        return iter(self)
+
+
+def get_line_prefix(key):
+    """
+    Get the start of chunk lines with the given key, as written by
+    write_chunks, to skip lines without decoding them.
+    """
+    return json.dumps({key: None})[:-len('null}')]
+
+
+def load_package_data(header, lines):
+    meta = header.get('meta')
+    swhids = []
+    paths = []
+    unseen_swhids = []
+    for line in map(json.loads, lines):
+        if 'swhids' in line:
+            swhids.extend(line['swhids'])
+        elif 'paths' in line:
+            paths.extend({'path': path, 'file': swhids[idx]}
+                         for path, idx in line['paths'])
+        elif 'unseen_swhids' in line:
+            unseen_swhids.extend(swhids[idx] for idx in line['unseen_swhids'])
+    source_info = meta.get('source_info')
+    source_info.update({'swhids': unseen_swhids, 'paths': paths})
+    return {'task_id': meta.get('task_id'), 'source_info': source_info}
+
+
+def load_scan_result(header, lines, file_path):
+    """
+    Load the path table and failed paths of the scan result, licenses and
+    copyrights are left in the file, and read as streams when saved.
+    """
+    data = header.get('meta')
+    swhids = []
+    paths = []
+    failed_paths = []
+    detection_prefixes = (get_line_prefix('licenses'),
+                          get_line_prefix('copyrights'))
+    for line in lines:
+        if line.startswith(detection_prefixes):
+            continue
+        line = json.loads(line)
+        if 'swhids' in line:
+            swhids.extend(line['swhids'])
+        elif 'paths' in line:
+            paths.extend(line['paths'])
+        elif 'failed_paths' in line:
+            failed_paths.extend(paths[idx][0] for idx in line['failed_paths'])
+    data['path_with_swhids'] = [
+        [path, swhids[idx]] for path, idx in paths if idx != NO_SWHID]
+    if 'licenses' in data:
+        data['licenses']['data'] = CompactItems(
+            file_path, 'licenses', lambda lic: [paths[lic[0]][0]] + lic[1:])
+    if 'copyrights' in data:
+        data['copyrights']['data']['detail_copyrights'] = CompactMapping(
+            file_path, 'copyrights', lambda c: (paths[c[0]][0], c[1]))
+    data['failed_paths'] = failed_paths
+    return data
+
+
+def load_data(file_path):
+    """
+    Load package data or scan result posted to hub, either in compact
+    format or in plain json. Licenses and copyrights of a scan result in
+    compact format are iterables read from the file as streams, the file
+    should be kept until they're saved.
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(len(GZIP_MAGIC))
+    if magic != GZIP_MAGIC:
+        with open(file_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    with gzip.open(file_path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != COMPACT_FORMAT:
+            raise ValueError(f"Unknown data format: {header.get('format')}")
+        if header.get('version') != COMPACT_VERSION:
+            raise ValueError(
+                f"Unsupported data format version: {header.get('version')}")
+        lines = (line for line in f if line.strip())
+        if header.get('kind') == 'package':
+            return load_package_data(header, lines)
+        elif header.get('kind') == 'scan_result':
+            return load_scan_result(header, lines, file_path)
+        raise ValueError(f"Unknown data kind: {header.get('kind')}")
@@ -9,6 +9,21 @@ PRIORITY_STR_KWARGS_MAP = {
 
 ALLOW_PRIORITY = list(PRIORITY_STR_KWARGS_MAP.keys())
 TASK_IDENTITY_PREFIX = "TASK_IDENTICAL_LOCK_"
+# Counter of running tasks on each worker node
+RUNNING_TASKS_PREFIX = "RUNNING_TASKS_"
+# Claim of a scan shard, by either the shard task or its parent task
+SCAN_SHARD_PREFIX = "SCAN_SHARD_"
+# Interval in seconds to poll the status of scan shard tasks
+SCAN_SHARD_POLL_INTERVAL = 30
+# Config sent to scan shard tasks, besides the scancode ones
+SCAN_SHARD_CONFIG_KEYS = ['LOGGER_DIR', 'TMP_ROOT_DIR', 'IGNORE_HOLDERS',
+                          'SCAN_BATCH_SIZE']
+# Claim of a file(swhid) being scanned by a task
+SCAN_CLAIM_PREFIX = "SCAN_CLAIM_"
+# Interval in seconds to poll files claimed by other tasks
+SCAN_CLAIM_POLL_INTERVAL = 30
+# Mark of a task waiting for files claimed by other tasks
+SCAN_WAITING_PREFIX = "SCAN_WAITING_"
 
 # Request timeout
 DEFAULT_REQUEST_TIMEOUT = 300
@@ -190,9 +190,11 @@ class OpenlcsClient:
             return url
         return sep.join(s.strip(sep) for s in [self.api_url_prefix, url]) + sep
 
-    def get(self, url, params=None, timeout=DEFAULT_REQUEST_TIMEOUT):
+    def get(self, url, params=None, timeout=DEFAULT_REQUEST_TIMEOUT,
+            headers=None):
         abs_url = self.get_abs_url(url)
-        return self.session.get(abs_url, headers=self.headers,
+        headers = {**self.headers, **headers} if headers else self.headers
+        return self.session.get(abs_url, headers=headers,
                                 params=params, timeout=timeout)
 
     def post(self, url, data, timeout=DEFAULT_REQUEST_TIMEOUT):
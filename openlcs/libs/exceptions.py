@@ -32,3 +32,12 @@ class ParamsErrorException(OpenLCSException):
     Raised when API params error
     """
     pass  # pylint: disable=unnecessary-pass
+
+
+class UnsupportedPayloadException(OpenLCSException):
+    """
+    Raised when a package payload can't be read in-process, e.g. compressed
+    with an unsupported compressor, the package is then extracted with
+    external tools.
+    """
+    pass  # pylint: disable=unnecessary-pass
@@ -0,0 +1,145 @@
+"""
+Node-local cache of file hashes, so that files shared by tasks on the same
+node, e.g. shared remote source and source container trees, are read once.
+
+Hashes are keyed by (device, inode, size, mtime_ns, ctime_ns) of the file.
+Mtimes come from archives and are often fixed, e.g. in npm packages or
+reproducible builds, while inodes are reused once extracted trees are
+removed, so the ctime, set by the filesystem on every creation or change,
+is part of the key as well.
+
+Hashes are stored in a sqlite database shared by worker processes on the
+node. The database is in WAL mode, which works only on local disk, so it
+must not be placed on shared network storage. The least recently used
+entries are evicted once the cache is full.
+"""
+import os
+import socket
+import sqlite3
+import time
+
+# Entries in the cache, about 200 bytes each on disk.
+DEFAULT_MAX_ENTRIES = 2000000
+# Evict down to below ratio of max entries, so eviction is not run on each
+# write once the cache is full.
+EVICT_RATIO = 0.9
+# Files changed within below seconds are not cached, since a change in the
+# same ctime granularity would not be noticed.
+RACY_SECONDS = 2
+SQLITE_TIMEOUT = 60
+
+
+def get_hash_cache_path(cache_dir):
+    """
+    Hash cache database file under cache_dir, named after the host so that
+    the cache stays node-local when cache_dir is on a shared filesystem.
+    """
+    return os.path.join(
+        cache_dir, f'hash_cache_{socket.gethostname()}.sqlite3')
+
+
+def get_stat_key(stat):
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns,
+            stat.st_ctime_ns)
+
+
+class HashCache(object):
+    """
+    Cache of (swhid, sha256) of files. Failures to access the database are
+    treated as cache misses, the cache never fails hashing.
+
+    A HashCache object should be used in the thread creating it.
+    """
+    def __init__(self, db_path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=SQLITE_TIMEOUT)
+            # Readers are not blocked by writers from other processes.
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                # Table of cache without ctime in the key.
+                conn.execute('DROP TABLE IF EXISTS file_hash')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS file_stat_hash ('
+                    'dev INTEGER, inode INTEGER, size INTEGER, '
+                    'mtime_ns INTEGER, ctime_ns INTEGER, swhid TEXT, '
+                    'sha256 TEXT, used INTEGER, '
+                    'UNIQUE (dev, inode, size, mtime_ns, ctime_ns))')
+                conn.execute('CREATE INDEX IF NOT EXISTS file_stat_hash_used '
+                             'ON file_stat_hash (used)')
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, stats):
+        """
+        Get cached (swhid, sha256) of files by their stat results, in the
+        same order as stats, None for files not in the cache.
+        """
+        keys = [get_stat_key(stat) for stat in stats]
+        try:
+            conn = self.conn
+            hashes = [conn.execute(
+                'SELECT swhid, sha256 FROM file_stat_hash WHERE dev = ? AND '
+                'inode = ? AND size = ? AND mtime_ns = ? AND ctime_ns = ?',
+                key).fetchone()
+                for key in keys]
+            with conn:
+                conn.executemany(
+                    'UPDATE file_stat_hash SET used = ? WHERE dev = ? AND '
+                    'inode = ? AND size = ? AND mtime_ns = ? AND '
+                    'ctime_ns = ?',
+                    [(int(time.time()),) + key
+                     for key, item in zip(keys, hashes) if item])
+        except sqlite3.Error:
+            self.errors += 1
+            hashes = [None] * len(keys)
+        hits = len([item for item in hashes if item])
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return [tuple(item) if item else None for item in hashes]
+
+    def put_many(self, items):
+        """
+        Cache (stat, swhid, sha256) items of files, and evict the least
+        recently used entries if the cache is full.
+        """
+        now = int(time.time())
+        racy_ns = (time.time() - RACY_SECONDS) * 10 ** 9
+        rows = [get_stat_key(stat) + (swhid, sha256, now)
+                for stat, swhid, sha256 in items
+                if stat.st_ctime_ns < racy_ns]
+        if not rows:
+            return
+        try:
+            with self.conn as conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO file_stat_hash (dev, inode, '
+                    'size, mtime_ns, ctime_ns, swhid, sha256, used) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self.evict()
+        except sqlite3.Error:
+            self.errors += 1
+
+    def evict(self):
+        with self.conn as conn:
+            count = conn.execute(
+                'SELECT COUNT(*) FROM file_stat_hash').fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    'DELETE FROM file_stat_hash WHERE rowid IN (SELECT '
+                    'rowid FROM file_stat_hash ORDER BY used, rowid LIMIT ?)',
+                    (count - int(self.max_entries * EVICT_RATIO),))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,236 @@
+import hashlib
+import os
+
+from .swh_tools import hash_file
+from .swh_tools import map_chunks
+
+
+class ManifestEntry(object):
+    """
+    A file in the source manifest.
+    """
+    __slots__ = ('path', 'stat', 'size', 'dev', 'inode', 'mtime_ns',
+                 'is_link', 'swhid', 'sha256')
+
+    def __init__(self, path, stat, is_link):
+        self.path = path
+        self.stat = stat
+        self.size = stat.st_size if stat else 0
+        self.dev = stat.st_dev if stat else None
+        self.inode = stat.st_ino if stat else None
+        self.mtime_ns = stat.st_mtime_ns if stat else None
+        self.is_link = is_link
+        self.swhid = None
+        self.sha256 = None
+
+    @property
+    def cacheable(self):
+        return self.stat is not None and not self.is_link
+
+
+class SourceManifest(object):
+    """
+    Manifest of files in a source directory, built with a single walk and
+    a single read of each file, which produces both the source checksum and
+    SWH IDs of files.
+
+    Symbolic links to files are recorded as well, with the sha256 of the
+    target file content, so that the checksum is the same as
+    `checksumdir.dirhash(root, 'sha256')`. Links are not followed into
+    directories, and have no SWH ID since they are excluded from scanning.
+
+    Hashes of regular files are looked up in the hash cache if given, before
+    reading the files. Files known and not written while extracted are kept
+    in the manifest without being on disk.
+    """
+    EMPTY_SHA256 = hashlib.sha256().hexdigest()
+
+    def __init__(self, root, workers=None, hash_cache=None):
+        self.root = root
+        self.workers = workers
+        self.hash_cache = hash_cache
+        self.entries = {}
+        # Entries of files not on disk, by relative path.
+        self.known = {}
+        self.hashed_count = 0
+        self.reused_count = 0
+
+    def walk(self):
+        """
+        Walk the source directory with os.scandir, returns manifest entries
+        without hashes.
+        """
+        entries = []
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    is_link = entry.is_symlink()
+                    if is_dir:
+                        if not is_link:
+                            stack.append(entry.path)
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        # Broken link
+                        stat = None
+                    rel_path = os.path.relpath(entry.path, self.root)
+                    entries.append(ManifestEntry(rel_path, stat, is_link))
+        return entries
+
+    def add_hashes(self, hashes):
+        """
+        Add regular files already hashed, e.g. while extracted, as a dict of
+        path relative to root to (swhid, sha256). They are not read again
+        in the next build if unchanged.
+        """
+        for path, (swhid, sha256) in hashes.items():
+            stat = os.stat(os.path.join(self.root, path))
+            entry = ManifestEntry(path, stat, False)
+            entry.swhid, entry.sha256 = swhid, sha256
+            self.entries[path] = entry
+        return self
+
+    def add_known(self, hashes):
+        """
+        Add files known and not written to disk, as a dict of path relative
+        to root to (swhid, sha256).
+        """
+        for path, (swhid, sha256) in hashes.items():
+            entry = ManifestEntry(path, None, False)
+            entry.swhid, entry.sha256 = swhid, sha256
+            self.known[path] = entry
+            self.entries[path] = entry
+        return self
+
+    def hash_entry(self, entry):
+        path = os.path.join(self.root, entry.path)
+        if entry.is_link:
+            entry.sha256 = hash_file(path)[1] if entry.dev is not None \
+                else self.EMPTY_SHA256
+            return
+        entry.swhid, entry.sha256 = hash_file(path)
+
+    def hash_entries(self, entries):
+        for entry in entries:
+            self.hash_entry(entry)
+        return entries
+
+    def hash_cached(self, entries):
+        """
+        Fill hashes of regular files found in the hash cache, returns entries
+        still to be hashed.
+        """
+        files = [e for e in entries if e.cacheable]
+        to_hash = [e for e in entries if not e.cacheable]
+        hashes = self.hash_cache.get_many([e.stat for e in files])
+        for entry, item in zip(files, hashes):
+            if item is None:
+                to_hash.append(entry)
+            else:
+                entry.swhid, entry.sha256 = item
+        return to_hash
+
+    def build(self):
+        """
+        Build the manifest, files unchanged since the last build, i.e. with
+        the same path, size and mtime, are not read again. This allows
+        reusing the manifest after the source is copied or unpacked.
+        """
+        to_hash = []
+        entries = {}
+        for entry in self.walk():
+            old = self.entries.get(entry.path)
+            if old is not None and old.is_link == entry.is_link and \
+                    old.size == entry.size and \
+                    old.mtime_ns == entry.mtime_ns:
+                entry.swhid, entry.sha256 = old.swhid, old.sha256
+                self.reused_count += 1
+            else:
+                to_hash.append(entry)
+            entries[entry.path] = entry
+        for path, entry in self.known.items():
+            entries.setdefault(path, entry)
+        if self.hash_cache is not None:
+            to_hash = self.hash_cached(to_hash)
+        map_chunks(self.hash_entries, to_hash, self.workers)
+        if self.hash_cache is not None:
+            self.hash_cache.put_many(
+                (e.stat, e.swhid, e.sha256) for e in to_hash if e.cacheable)
+        self.hashed_count += len(to_hash)
+        self.entries = entries
+        return self
+
+    def rebase(self, root):
+        """
+        Move the manifest to another root with the same relative paths,
+        e.g. a copy of the source, call `build` to refresh it afterwards.
+        """
+        self.root = root
+        return self
+
+    @property
+    def checksum(self):
+        """
+        Stable tree checksum from per-file sha256 digests, same as
+        `checksumdir.dirhash(root, 'sha256')`.
+        """
+        hasher = hashlib.sha256()
+        for sha256 in sorted(e.sha256 for e in self.entries.values()):
+            hasher.update(sha256.encode('utf-8'))
+        return hasher.hexdigest()
+
+    def get_directory_swhids(self):
+        """
+        Get SWH IDs of directories, as hashes of git trees of the files in
+        the manifest computed bottom-up, links and empty directories are not
+        included. Returns a dict of directory path to its SWH ID, except the
+        root directory.
+        """
+        children = {'': {}}
+        for path, entry in self.entries.items():
+            if entry.is_link or entry.swhid is None:
+                continue
+            parts = path.split(os.sep)
+            for i in range(len(parts) - 1):
+                parent = os.sep.join(parts[:i])
+                directory = os.sep.join(parts[:i + 1])
+                if directory not in children:
+                    children[directory] = {}
+                    children[parent][parts[i] + '/'] = directory
+            parent = os.sep.join(parts[:-1])
+            children[parent][parts[-1]] = entry.swhid
+
+        swhids = {}
+        # Subdirectories are hashed ahead of their parents.
+        for directory in sorted(children, key=lambda d: -d.count(os.sep)
+                                if d else 1):
+            tree = []
+            # Git sorts trees by name with a trailing slash for directories.
+            for name, value in sorted(children[directory].items()):
+                if name.endswith('/'):
+                    mode, name, sha1 = b'40000', name[:-1], swhids[value]
+                else:
+                    mode, sha1 = b'100644', value
+                tree.append(mode + b' ' + os.fsencode(name) + b'\0' +
+                            bytes.fromhex(sha1.rsplit(':', 1)[-1]))
+            content = b''.join(tree)
+            swhids[directory] = 'swh:1:dir:' + hashlib.sha1(
+                b'tree %d\0' % len(content) + content).hexdigest()
+        swhids.pop('')
+        return swhids
+
+    def get_paths_with_swhids(self):
+        """
+        Get (path, swhid) of files except links, with paths under root and
+        in the order of a sorted walk.
+        """
+        return [(os.path.join(self.root, path), self.entries[path].swhid)
+                for path in sorted(self.entries)
+                if not self.entries[path].is_link]
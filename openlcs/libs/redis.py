@@ -7,11 +7,26 @@ from redis_lock import NotAcquired
 
 from openlcsd.celeryconfig import broker_url
 from openlcsd.celeryconfig import task_time_limit
+from .constants import RUNNING_TASKS_PREFIX  # noqa: E402
 from .constants import TASK_IDENTITY_PREFIX  # noqa: E402
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Claim all keys in one script, which runs atomically, so claims of tasks
+# running at the same time never interleave.
+CLAIM_KEYS_SCRIPT = """
+local claimed = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('SET', key, ARGV[1], 'NX', 'EX', ARGV[2]) then
+        claimed[i] = 1
+    else
+        claimed[i] = 0
+    end
+end
+return claimed
+"""
+
 
 # Based upon singleton's lock generation mechanism with some simplification.
 def generate_lock_key(
@@ -87,3 +102,106 @@ class RedisClient(object):
             logger.info("Lock %s not acquired.", lock_repr)
         else:
             logger.info("Lock %s released.", lock_repr)
+
+    def update_running_tasks(self, hostname: str, amount: int = 1) -> int:
+        """Increase(or decrease with a negative amount) the number of tasks
+        running on the worker node.
+
+        Args:
+            hostname (str): hostname of the worker node.
+            amount (int, optional): amount to increase. Defaults to 1.
+
+        Returns:
+            int: the number of running tasks after the update.
+        """
+        key = RUNNING_TASKS_PREFIX + hostname
+        running_tasks = self.client.incrby(key, amount)
+        if running_tasks < 0:
+            # In case the counter is reset while tasks are running.
+            self.client.set(key, 0)
+            running_tasks = 0
+        return running_tasks
+
+    def reset_running_tasks(self, hostname: str) -> None:
+        """Reset the number of tasks running on the worker node.
+
+        Args:
+            hostname (str): hostname of the worker node.
+        """
+        self.client.delete(RUNNING_TASKS_PREFIX + hostname)
+
+    def get_running_tasks(self, hostname: str) -> int:
+        """Get the number of tasks running on the worker node.
+
+        Args:
+            hostname (str): hostname of the worker node.
+
+        Returns:
+            int: the number of running tasks.
+        """
+        running_tasks = self.client.get(RUNNING_TASKS_PREFIX + hostname)
+        return int(running_tasks) if running_tasks else 0
+
+    def claim_key(self, key: str, owner: str,
+                  expire: int = task_time_limit) -> bool:
+        """Claim the key for the owner if it isn't claimed yet.
+
+        Args:
+            key (str): The key to claim.
+            owner (str): Identity of the claimer, e.g. the task id.
+            expire (int, optional): The expiration time for the claim in
+                seconds. Defaults to task_time_limit.
+
+        Returns:
+            bool: True if the key is claimed by the owner.
+        """
+        return bool(self.client.set(key, owner, nx=True, ex=expire))
+
+    def claim_keys(self, keys: list, owner: str,
+                   expire: int = task_time_limit) -> list:
+        """Claim the keys for the owner atomically in a single round trip,
+        keys already claimed by others are left untouched. Since claims of
+        different owners never interleave, an owner only misses keys
+        claimed by owners before it.
+
+        Args:
+            keys (list): The keys to claim.
+            owner (str): Identity of the claimer, e.g. the task id.
+            expire (int, optional): The expiration time for the claims in
+                seconds. Defaults to task_time_limit.
+
+        Returns:
+            list: Whether each key is claimed by the owner.
+        """
+        if not keys:
+            return []
+        claim_keys_script = self.client.register_script(CLAIM_KEYS_SCRIPT)
+        return [bool(claimed) for claimed in claim_keys_script(
+            keys=keys, args=[owner, expire])]
+
+    def get_key_owners(self, keys: list) -> list:
+        """Get owners of the claimed keys.
+
+        Args:
+            keys (list): The claimed keys.
+
+        Returns:
+            list: Owner of each key, None if the key isn't claimed.
+        """
+        if not keys:
+            return []
+        return [owner.decode('utf-8') if owner else None
+                for owner in self.client.mget(keys)]
+
+    def release_keys(self, keys: list, owner: str) -> None:
+        """Release the keys claimed by the owner.
+
+        Args:
+            keys (list): The claimed keys.
+            owner (str): Identity of the claimer, keys claimed by others
+                are left untouched.
+        """
+        owned_keys = [key for key, key_owner in zip(
+            keys, self.get_key_owners(keys)) if key_owner == owner]
+        if owned_keys:
+            self.client.delete(*owned_keys)
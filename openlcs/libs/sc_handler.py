@@ -1,25 +1,31 @@
+import fnmatch
 import glob
 import koji
 import os
 import re
 import sys
 import shutil
+import tempfile
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # Fix absolute import issue in openlcs.
 openlcs_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 if openlcs_dir not in sys.path:
     sys.path.append(openlcs_dir)
 from libs.common import (  # noqa: E402
+    ComponentTrie,
     compress_source_to_tarball,
     create_dir,
     get_component_flat,
     get_component_name_version_combination,
+    get_mime_type,
+    merge_tree,
     search_content_by_patterns,
-    uncompress_blob_gzip_files,
-    uncompress_source_tarball,
-    selection_sort_components
+    uncompress_source_tarball
 )
+from libs.unpack import EXTRACT_ERRORS  # noqa: E402
+from libs.unpack import extract_tar  # noqa: E402
 
 
 CORGI_OSBS_RS_TYPE_MAPPING = {
@@ -37,6 +43,201 @@ RS_TARBALL_EXTENSIONS = [
     '.gem',
     '.crate'
 ]
+# Path parts of the go module cache under 'deps'.
+GOMOD_CACHE_PARTS = ['gomod', 'pkg', 'mod', 'cache', 'download']
+
+
+def match_path_parts(pattern_parts, parts):
+    """
+    Match path parts with glob pattern parts the same as recursive glob,
+    i.e., '**' matches zero or more directories, and hidden names are only
+    matched by patterns starting with '.'.
+    """
+    if not pattern_parts:
+        return not parts
+    pattern = pattern_parts[0]
+    if pattern == '**':
+        for i in range(len(parts) + 1):
+            if i > 0 and parts[i - 1].startswith('.'):
+                break
+            if match_path_parts(pattern_parts[1:], parts[i:]):
+                return True
+        return False
+    if not parts:
+        return False
+    name = parts[0]
+    if glob.has_magic(pattern) and name.startswith('.') and \
+            not pattern.startswith('.'):
+        return False
+    return fnmatch.fnmatchcase(name, pattern) and \
+        match_path_parts(pattern_parts[1:], parts[1:])
+
+
+class RemoteSourceIndex(object):
+    """
+    Index of remote source paths in 'extra_src_dir' of a source container,
+    built with a single walk, so that components are looked up in memory
+    instead of globbing the whole directory for each of them.
+
+    Source tarballs under 'deps' are indexed by their ecosystem, escaped
+    name, version and extension, directories under 'app/vendor' by their
+    name, so that components are looked up by keys, see
+    `SourceContainerHandler.get_remote_source_keys`.
+
+    Paths are also indexed by each of their path parts for components
+    without keys, e.g. with git versions, a search pattern is matched only
+    against paths with its most selective literal part.
+    """
+    def __init__(self, extra_src_dir):
+        self.extra_src_dir = extra_src_dir
+        self.paths = []
+        self.part_index = {}
+        self.candidates = {}
+        self.removed = set()
+        self.modules = {}
+        self.build()
+
+    def add(self, rel_path):
+        idx = len(self.paths)
+        parts = rel_path.split(os.sep)
+        self.paths.append((rel_path, parts))
+        for part in set(parts):
+            self.part_index.setdefault(part, []).append(idx)
+        return parts
+
+    def add_candidate(self, key, rel_path):
+        self.candidates.setdefault(key, []).append(
+            os.path.join(self.extra_src_dir, rel_path))
+
+    def add_vendor(self, rel_path):
+        """
+        Index a directory under 'app/vendor' by its name, e.g.
+        'app/vendor/github.com/pkg' by ('vendor', 'github.com/pkg').
+        """
+        parts = self.add(rel_path)
+        for i in range(len(parts) - 2):
+            # Recursive glob doesn't walk into hidden directories.
+            if parts[i].startswith('.'):
+                break
+            if parts[i:i + 2] == ['app', 'vendor']:
+                self.add_candidate(
+                    ('vendor', '/'.join(parts[i + 2:])), rel_path)
+
+    def add_tarball(self, rel_path):
+        """
+        Index a source tarball under 'deps' by its ecosystem, escaped name
+        and version, e.g. 'deps/npm/@babel/core/core-7.1.0.tgz' by ('npm',
+        'babel/core', '7.1.0', '.tgz'), and go modules in module cache by
+        each parent of the module path as well.
+        """
+        parts = self.add(rel_path)
+        if any(part.startswith('.') for part in parts):
+            return
+        i = parts.index('deps') + 1
+        if parts[i:i + len(GOMOD_CACHE_PARTS)] == GOMOD_CACHE_PARTS:
+            name_parts = parts[i + len(GOMOD_CACHE_PARTS):-2]
+            if not name_parts or parts[-2] != '@v' or \
+                    not parts[-1].endswith('.zip'):
+                return
+            version = parts[-1][:-len('.zip')]
+            self.add_candidate(
+                ('gomod', '/'.join(name_parts), version), rel_path)
+            for j in range(1, len(name_parts) + 1):
+                self.add_candidate(
+                    ('gomod-parent', '/'.join(name_parts[:j]), version),
+                    rel_path)
+            return
+        # Tarballs are named after the last part of the name, e.g.
+        # 'deps/pip/requests/requests-2.25.1.tar.gz'.
+        name_parts, file_name = parts[i + 1:-1], parts[-1]
+        extension = next((ext for ext in RS_TARBALL_EXTENSIONS
+                          if file_name.endswith(ext)), None)
+        if not name_parts or extension is None:
+            return
+        prefix = name_parts[-1] + '-'
+        stem = file_name[:-len(extension)]
+        if stem.startswith(prefix):
+            name = '/'.join(name_parts).replace('@', '')
+            self.add_candidate(
+                (parts[i], name, stem[len(prefix):], extension), rel_path)
+
+    def build(self):
+        for root, dirs, files in os.walk(self.extra_src_dir):
+            rel_root = os.path.relpath(root, self.extra_src_dir)
+            parts = [] if rel_root == '.' else rel_root.split(os.sep)
+            if any(parts[i:i + 2] == ['app', 'vendor']
+                   for i in range(len(parts) - 1)):
+                for dn in dirs:
+                    self.add_vendor(os.path.join(rel_root, dn))
+            if 'deps' in parts:
+                for fn in files:
+                    self.add_tarball(os.path.join(rel_root, fn))
+
+    def lookup(self, keys):
+        """
+        Get paths of the first key with paths, keys are in the same order
+        as search patterns of the component.
+        """
+        for key in keys:
+            paths = [path for path in self.candidates.get(key, [])
+                     if not self.is_removed(path)]
+            if paths:
+                return paths
+        return []
+
+    def is_removed(self, path):
+        while path != self.extra_src_dir and path != os.sep:
+            if path in self.removed:
+                return True
+            path = os.path.dirname(path)
+        return False
+
+    def remove(self, path):
+        """
+        Exclude the path and paths under it, once it's moved or removed.
+        """
+        self.removed.add(path)
+
+    def glob(self, pattern):
+        """
+        Get paths matching the glob pattern under extra_src_dir.
+        """
+        rel_pattern = os.path.relpath(pattern, self.extra_src_dir)
+        pattern_parts = [p for p in rel_pattern.split(os.sep) if p]
+        literal_parts = [p for p in pattern_parts if not glob.has_magic(p)]
+        if literal_parts:
+            candidates = min(
+                (self.part_index.get(p, []) for p in literal_parts), key=len)
+        else:
+            candidates = range(len(self.paths))
+        paths = []
+        for idx in candidates:
+            rel_path, parts = self.paths[idx]
+            path = os.path.join(self.extra_src_dir, rel_path)
+            if match_path_parts(pattern_parts, parts) and \
+                    not self.is_removed(path):
+                paths.append(path)
+        return paths
+
+    def search(self, search_patterns):
+        """
+        Search paths by the patterns, same as `search_content_by_patterns`.
+        """
+        paths = []
+        for search_pattern in search_patterns or []:
+            paths = self.glob(search_pattern)
+            if paths:
+                break
+        return paths
+
+    def read_modules(self, modules_file_path):
+        """
+        Read the vendor modules file once.
+        """
+        if modules_file_path not in self.modules:
+            with open(modules_file_path, encoding='utf8') as f:
+                self.modules[modules_file_path] = f.read()
+        return self.modules[modules_file_path]
 
 
 class SourceContainerHandler(object):
@@ -213,6 +414,56 @@ class SourceContainerHandler(object):
 
         return misc_dir
 
+    def get_layer_workers(self):
+        workers = self.config.get('UNPACK_PROCESSES') if self.config \
+            else None
+        return workers or 1
+
+    def extract_layers(self, layer_files):
+        """
+        Extract layer tarballs into the destination directory concurrently
+        and in-process. Each layer is extracted into its own directory, then
+        merged in order, so that later layers overwrite earlier ones the
+        same as extracted one after another. Layers extracted are removed.
+        Returns the errors per layer.
+        """
+        def extract(layer_file):
+            layer_dir = os.path.realpath(
+                tempfile.mkdtemp(prefix='layer_', dir=self.dest_dir))
+            try:
+                extract_tar(layer_file, layer_dir)
+            except EXTRACT_ERRORS as err:
+                shutil.rmtree(layer_dir)
+                return None, (f"Failed to decompress blob file "
+                              f"{os.path.basename(layer_file)}: {err}")
+            return layer_dir, None
+
+        with ThreadPoolExecutor(
+                max_workers=self.get_layer_workers()) as executor:
+            results = list(executor.map(extract, layer_files))
+        errors = []
+        for layer_file, (layer_dir, error) in zip(layer_files, results):
+            if error:
+                errors.append(error)
+                continue
+            merge_tree(layer_dir, self.dest_dir)
+            os.remove(layer_file)
+        return errors
+
+    def uncompress_blob_gzip_files(self):
+        """
+        Uncompress the blob files that come from source container registry.
+        Under the directory, most of the files are gzip files that need to
+        decompress. There are some metadata files that no need to
+        decompress.
+        """
+        src_dir = os.path.dirname(self.src_file)
+        blob_files = [os.path.join(src_dir, fn)
+                      for fn in sorted(os.listdir(src_dir))]
+        layer_files = [blob_file for blob_file in blob_files
+                       if get_mime_type(blob_file) == "application/gzip"]
+        return self.extract_layers(layer_files)
+
     def unpack_source_container_image(self):
         """
         Unpack source container image to destination directory.
@@ -223,11 +474,14 @@ class SourceContainerHandler(object):
         errs = []
         if 'docker_image' in self.src_file:
             uncompress_source_tarball(self.src_file, self.dest_dir)
-            tarballs = glob.glob(f"{self.dest_dir}/*.tar")
-            for tarball in tarballs:
-                uncompress_source_tarball(tarball)
+            tarballs = sorted(glob.glob(f"{self.dest_dir}/*.tar"))
+            errors = self.extract_layers(tarballs)
+            if errors:
+                err_msg = "Failed to uncompress source tarball: %s" % (
+                    "; ".join(errors))
+                raise ValueError(err_msg)
         else:
-            errs = uncompress_blob_gzip_files(self.src_file, self.dest_dir)
+            errs = self.uncompress_blob_gzip_files()
         # Get source RPMs in the source container.
         srpm_dir = self.get_source_container_srpms()
 
@@ -321,7 +575,38 @@ class SourceContainerHandler(object):
                                for extension in RS_TARBALL_EXTENSIONS]
         return search_patterns
 
-    def get_special_component_path(self, component, extra_src_dir):
+    def get_remote_source_keys(self, component):
+        """
+        Get keys of the component in the remote source index, in the same
+        order as its search patterns. Returns None for components with git
+        or url versions, which are searched by patterns instead.
+        """
+        search_name, name_items, version_items = \
+            self.get_component_search_items(component)
+        if len(version_items) != 1:
+            return None
+        name = '/'.join(name_items)
+        version = version_items[0]
+        comp_type = component.get('type')
+        if comp_type == 'GOLANG':
+            keys = [('gomod', name, version),
+                    ('gomod-parent', name, version),
+                    ('vendor', search_name)]
+            # Use the original name in app vendor source path.
+            if search_name != component.get('name'):
+                keys.append(('vendor', component.get('name')))
+        elif comp_type in ['NPM', 'YARN']:
+            # YARN type in brew can be NPM type in corgi
+            keys = [(CORGI_OSBS_RS_TYPE_MAPPING[rs_type], name, version, ext)
+                    for rs_type in ['NPM', 'YARN']
+                    for ext in RS_TARBALL_EXTENSIONS]
+        else:
+            keys = [(CORGI_OSBS_RS_TYPE_MAPPING[comp_type], name, version,
+                     ext) for ext in RS_TARBALL_EXTENSIONS]
+        return keys
+
+    def get_special_component_path(self, component, extra_src_dir,
+                                   rs_index=None):
         comp_type = component.get('type')
         comp_version = component.get('version')
         comp_type = CORGI_OSBS_RS_TYPE_MAPPING.get(comp_type)
@@ -376,18 +661,30 @@ class SourceContainerHandler(object):
             for extension in RS_TARBALL_EXTENSIONS
         ])
 
-        paths = search_content_by_patterns(search_patterns)
+        if rs_index is not None:
+            paths = rs_index.search(search_patterns)
+        else:
+            paths = search_content_by_patterns(search_patterns)
         return paths[0] if paths else None
 
-    def get_remote_source_path(self, component, extra_src_dir):
+    def get_remote_source_path(self, component, extra_src_dir,
+                               rs_index=None):
         """
-        Get source tarball path of the remote source component.
+        Get source tarball path of the remote source component, searched in
+        the remote source index if given.
         """
         search_patterns = self.get_remote_source_search_patterns(
             component, extra_src_dir)
 
         # Search remote source path.
-        paths = search_content_by_patterns(search_patterns)
+        keys = self.get_remote_source_keys(component) \
+            if rs_index is not None else None
+        if keys is not None:
+            paths = rs_index.lookup(keys)
+        elif rs_index is not None:
+            paths = rs_index.search(search_patterns)
+        else:
+            paths = search_content_by_patterns(search_patterns)
         source_path = None
         if paths:
             # Find the correct source path.
@@ -406,10 +703,16 @@ class SourceContainerHandler(object):
                         app_path = path[:path.index('vendor')]
                         modules_file_path = os.path.join(
                             app_path, 'vendor', 'modules.txt')
-                        with open(modules_file_path, encoding='utf8') as f:
-                            if check_str in f.read():
-                                source_path = path
-                                break
+                        if rs_index is not None:
+                            modules = rs_index.read_modules(
+                                modules_file_path)
+                        else:
+                            with open(modules_file_path,
+                                      encoding='utf8') as f:
+                                modules = f.read()
+                        if check_str in modules:
+                            source_path = path
+                            break
                     # Exist many source paths in "deps".
                     elif "/deps/" in path and comp_type == 'GOLANG':
                         modules_file_path = os.path.join(
@@ -427,7 +730,7 @@ class SourceContainerHandler(object):
             # mismatch with source path in source container. More detail,
             # check PELC-4511, CLOUDBLD-3809, and OLCS-292.
             source_path = self.get_special_component_path(
-                component, extra_src_dir)
+                component, extra_src_dir, rs_index)
         return source_path, search_patterns
 
     def get_container_remote_source(self, components):
@@ -441,13 +744,14 @@ class SourceContainerHandler(object):
         if os.path.exists(extra_src_dir):
             # Sort components so that not remove the source needed by other
             # components.
-            components = selection_sort_components(components)
+            component_trie = ComponentTrie(components)
+            # Index remote source paths once for all the components.
+            rs_index = RemoteSourceIndex(extra_src_dir)
 
             # Get source for each component.
-            for _ in range(len(components)):
-                component = components.pop(0)
+            for component in component_trie.sort_components():
                 comp_path, search_patterns = self.get_remote_source_path(
-                    component, extra_src_dir)
+                    component, extra_src_dir, rs_index)
                 if not comp_path:
                     missing_components.append(component)
                     err_msg = (f"Failed to get remote source for component."
@@ -476,16 +780,12 @@ class SourceContainerHandler(object):
                         # TODO: the policy here should be refined. This way
                         # the same source will be scanned twice, the parent's
                         # result could be summarized from its children nodes.
-                        comp_name = component.get('name')
-                        comp_type = component.get('type')
-                        if any([comp_name.startswith(
-                                c.get('name') + os.sep) and c.get(
-                                'type') == comp_type for c in components]):
-                            remove_source = False
-                        else:
-                            remove_source = True
+                        remove_source = not component_trie.has_parent(
+                            component)
                         compress_source_to_tarball(
                             dest_path, comp_path, remove_source=remove_source)
+                        if remove_source:
+                            rs_index.remove(comp_path)
                     except RuntimeError as err:
                         err_msg = (f"Failed to compress {component} source in "
                                    f"app vendor: {err}")
@@ -493,6 +793,7 @@ class SourceContainerHandler(object):
                 else:
                     # Move source tarball to destination directory.
                     shutil.move(comp_path, comp_dir)
+                    rs_index.remove(comp_path)
 
             # Handle misc data in remote source.
             misc_dir = os.path.join(self.dest_dir, 'metadata')
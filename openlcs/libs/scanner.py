@@ -1,18 +1,91 @@
-import json
+import ijson
+import os
 import subprocess
+import tempfile
+import time
 import traceback
 
 from kobo.shortcuts import run
 
+# Scanner alias used in detector, results of different backends of the same
+# scanner are interchangeable.
+SCANNER_ALIASES = {
+    'scancode_api': 'scancode',
+}
+
+# Scancode version per cli, cached for the life of the worker process.
+_scancode_versions = {}
+
+
+def load_scancode_api():
+    """
+    Load the scancode api together with the license index, this is slow
+    and done on the first in-process scan, the index is cached for the
+    life of the worker process afterwards.
+    """
+    from licensedcode.cache import get_index
+    get_index()
+
+
+def build_json_value(events, event, value):
+    """
+    Build the json value starting with the given parse event, the events
+    of the value are consumed from the parser.
+    """
+    builder = ijson.ObjectBuilder()
+    depth = 0
+    while True:
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        if depth == 0:
+            return builder.value
+        _, event, value = next(events)
+
+
+def iter_scan_files(result_file, tallies=None):
+    """
+    Incrementally parse the scancode json output file, yield the scan
+    result of each file, so that the whole output is never loaded at once.
+    Tallies met in the same pass are collected into the given dict.
+    """
+    with open(result_file, 'rb') as f:
+        events = ijson.parse(f, use_float=True)
+        for prefix, event, value in events:
+            if prefix == 'files.item' and event == 'start_map':
+                yield build_json_value(events, event, value)
+            elif tallies is not None and event == 'map_key' \
+                    and prefix == 'tallies':
+                _, event, tally_value = next(events)
+                tallies[value] = build_json_value(events, event, tally_value)
+
+
+def get_available_cpus():
+    """
+    Get the number of cpus available to the current process.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
 
 class BaseScanner(object):
-    def __init__(self, config, src_dir=None, logger=None):
+    def __init__(self, config, src_dir=None, logger=None, file_count=None,
+                 running_tasks=0):
         self.config = config
         self.src_dir = src_dir
         self.logger = logger
+        # Used to size scancode parallelism, see get_scancode_processes.
+        self.file_count = file_count
+        self.running_tasks = running_tasks
 
     def get_scancode_version(self):
         scancode_cli = self.config.get('SCANCODE_CLI', '/bin/scancode')
+        if scancode_cli in _scancode_versions:
+            return _scancode_versions[scancode_cli]
         cmd = ('%s -V | grep -i "scancode version"' % scancode_cli)
         try:
             _, output = run(cmd, stdout=False)
@@ -20,8 +93,13 @@ class BaseScanner(object):
             err_msg = 'Failed to get the scancode version used.'
             raise RuntimeError(err_msg) from None
         version = output.decode("utf-8").split(': ')[1].rstrip('\n')
+        _scancode_versions[scancode_cli] = version
         return version
 
+    def get_scancode_api_version(self):
+        from scancode_config import __version__
+        return __version__
+
     def get_scanner_version(self, scanner='scancode'):
         """
         Get the scanner together with its version used for scanning,
@@ -32,80 +110,248 @@ class BaseScanner(object):
             raise ValueError("No version info for %s." % scanner)
         else:
             version = get_version_method()
+            scanner = SCANNER_ALIASES.get(scanner, scanner)
             self.detector = scanner + " " + version
 
     def scan(self, scanner='scancode'):
         self.get_scanner_version(scanner)
         scan_method = getattr(self, scanner + '_scan', None)
         if scan_method is None:
-            raise ValueError("Scanner %s does not support." % self.scanner)
+            raise ValueError("Scanner %s does not support." % scanner)
         else:
             return scan_method()
 
+    def get_scancode_processes(self):
+        """
+        Get the number of scancode processes. Without the file count, the
+        static `SCANCODE_PROCESSES` is used. Otherwise it's sized from the
+        file count, bounded by the cpus shared with other running tasks on
+        the node.
+        """
+        scancode_processes = self.config.get('SCANCODE_PROCESSES', 1)
+        if self.file_count is None:
+            return scancode_processes
+        files_per_process = self.config.get(
+            'SCANCODE_FILES_PER_PROCESS', 1000)
+        available = get_available_cpus() // max(self.running_tasks, 1)
+        wanted = -(-self.file_count // files_per_process)
+        return max(min(wanted, available), 1)
+
+    def run_scancode(self, options):
+        """
+        Run scancode with the given detection options against src_dir, the
+        json output is written to a temporary file instead of stdout.
+        Returns a tuple of the output file path(None if scancode failed),
+        error messages and whether an exception occurred. Caller is
+        responsible for removing the output file.
+        """
+        scancode_processes = self.get_scancode_processes()
+        scancode_cli = self.config.get('SCANCODE_CLI', '/bin/scancode')
+        errors = []
+        fd, result_file = tempfile.mkstemp(
+            prefix='scancode_', suffix='.json',
+            dir=self.config.get('TMP_ROOT_DIR'))
+        os.close(fd)
+        cmd = ('{} {} --only-findings --strip-root --processes {} '
+               '--json {} --quiet {}'.format(
+                scancode_cli, options, scancode_processes, result_file,
+                self.src_dir))
+        if self.logger is not None:
+            self.logger.info(
+                f"Running scancode with {scancode_processes} processes for "
+                f"{self.file_count} files, {self.running_tasks} tasks "
+                f"running on the node.")
+        start = time.time()
+        try:
+            proc = subprocess.Popen(cmd, shell=True,
+                                    stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE)
+            _, error = proc.communicate()
+        except Exception:
+            os.remove(result_file)
+            errors.append(traceback.format_exc())
+            return None, errors, True
+        elapsed = time.time() - start
+        if self.logger is not None and self.file_count:
+            self.logger.info(
+                f"Scancode scanned {self.file_count} files in {elapsed:.1f}s "
+                f"with {scancode_processes} processes, "
+                f"{self.file_count / max(elapsed, 0.001):.1f} files/s.")
+        # Output file is empty or incomplete in case scancode was killed.
+        if os.path.getsize(result_file) == 0:
+            os.remove(result_file)
+            errors.extend(self.get_scancode_exit_errors(proc, error))
+            return None, errors, True
+        self.proc, self.proc_error = proc, error
+        return result_file, errors, False
+
+    @staticmethod
+    def get_scancode_exit_errors(proc, error):
+        errors = ["Scancode exited with exit code {}".format(proc.returncode)]
+        # There may be traceback or nothing in case scancode was killed
+        if error.strip():
+            if isinstance(error, bytes):
+                error = error.decode('utf-8')
+            errors.append(error)
+        return errors
+
+    def parse_scancode_output(self, result_file, parse_method, errors):
+        """
+        Parse the scancode output file with the given method, and remove
+        the output file afterwards.
+        Returns whether an exception occurred while parsing.
+        """
+        try:
+            parse_method(result_file)
+        except Exception:
+            errors.extend(
+                self.get_scancode_exit_errors(self.proc, self.proc_error))
+            return True
+        finally:
+            os.remove(result_file)
+        return False
+
+    def iter_scancode_api_files(self, licenses=False, copyrights=False):
+        """
+        Scan files under src_dir in-process with the scancode api, yield
+        the scan result of each file in the same format as scancode cli.
+        """
+        from scancode.api import get_copyrights
+        from scancode.api import get_licenses
+        from scancode.interrupt import interruptible
+
+        scancode_license_score = self.config.get('SCANCODE_LICENSE_SCORE', 90)
+        scancode_timeout = self.config.get('SCANCODE_TIMEOUT', 300)
+        scan_funcs = []
+        if licenses:
+            scan_funcs.append(
+                (get_licenses, {'min_score': scancode_license_score}))
+        if copyrights:
+            scan_funcs.append((get_copyrights, {}))
+        for root, _, files in os.walk(self.src_dir):
+            for name in sorted(files):
+                location = os.path.join(root, name)
+                if os.path.islink(location):
+                    continue
+                f = {
+                    'path': os.path.relpath(location, self.src_dir),
+                    'type': 'file',
+                    'scan_errors': [],
+                }
+                # Same per-file deadline as scancode cli.
+                deadline = time.time() + int(scancode_timeout / 2.5)
+                for func, kwargs in scan_funcs:
+                    kwargs = dict(kwargs, location=location, deadline=deadline)
+                    error, value = interruptible(
+                        func, kwargs=kwargs, timeout=scancode_timeout)
+                    if error:
+                        f['scan_errors'].append(error)
+                    elif value:
+                        f.update(value)
+                yield f
+
+    def run_scancode_api(self, parse_method):
+        """
+        Run the in-process scan with the given parse method.
+        Returns a tuple of error messages and whether an exception occurred.
+        """
+        errors = []
+        try:
+            load_scancode_api()
+            parse_method()
+        except Exception:
+            errors.append(traceback.format_exc())
+            return errors, True
+        return errors, False
+
+    @staticmethod
+    def tally_copyrights(copyrights):
+        """
+        Get the summary copyrights from all detected copyright statements,
+        the same as "copyrights" in scancode cli tallies.
+        """
+        from summarycode.copyright_tallies import tally_copyrights
+        from summarycode.utils import sorted_counter
+        tallies = sorted_counter(tally_copyrights(copyrights))
+        return list(filter(None, [t.get('value') for t in tallies]))
+
 
 class LicenseScanner(BaseScanner):
     """
     Package source license detection.
     """
-    def scancode_scan(self):
+    def get_license_options(self):
         scancode_license_score = self.config.get('SCANCODE_LICENSE_SCORE', 90)
         scancode_timeout = self.config.get('SCANCODE_TIMEOUT', 300)
-        scancode_processes = self.config.get('SCANCODE_PROCESSES', 1)
-        scancode_cli = self.config.get('SCANCODE_CLI', '/bin/scancode')
+        return '--license --license-score {} --timeout {}'.format(
+            scancode_license_score, scancode_timeout)
+
+    def get_file_licenses(self, f, license_errors):
+        """
+        Yield license tuples from the scan result of a file.
+        """
         scancode_unknown_licenses = self.config.get(
             'SCANCODE_UNKNOWN_LICENSES', 'unknown')
+        filepath = f.get('path')
+        matched_licenses = f.get('licenses', [])
+        if f.get('scan_errors'):
+            license_errors.append("{}: {}".format(
+                filepath, f['scan_errors']))
+        for lic in matched_licenses:
+            if lic.get('key') in scancode_unknown_licenses:
+                continue
+            spdx_key = lic.get('spdx_license_key', '')
+            lic_key = spdx_key if not spdx_key.startswith('LicenseRef-') else lic.get('key')  # noqa: E501
+            yield (filepath,
+                   lic_key,
+                   lic.get('score'),
+                   lic.get('start_line'),
+                   lic.get('end_line'),
+                   lic['matched_rule']['is_license_text'],
+                   lic['matched_rule']['identifier'])
+
+    def iter_licenses(self, result_file, license_errors):
+        """
+        Yield license tuples from the scancode output file.
+        """
+        for f in iter_scan_files(result_file):
+            yield from self.get_file_licenses(f, license_errors)
 
+    def scancode_scan(self):
         license_list = []
+        result_file, license_errors, has_exception = self.run_scancode(
+            self.get_license_options())
+        if result_file is not None:
+            licenses = set()
+
+            def parse(result_file):
+                licenses.update(
+                    self.iter_licenses(result_file, license_errors))
+
+            has_exception = self.parse_scancode_output(
+                result_file, parse, license_errors)
+            if not has_exception:
+                license_list = list(licenses)
+
+        if self.logger is not None:
+            for err_msg in license_errors:
+                self.logger.error(err_msg)
+
+        return (self.detector, license_list, license_errors, has_exception)
+
+    def scancode_api_scan(self):
+        license_list = []
+        licenses = set()
         license_errors = []
-        has_exception = False
-        cmd = ('{} --license --license-score {} --only-findings --strip-root '
-               '--processes {} --timeout {} --json - --quiet {}'.format(
-                scancode_cli, scancode_license_score, scancode_processes,
-                scancode_timeout, self.src_dir))
 
-        output, error = '', ''
-        try:
-            proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            output, error = proc.communicate()
-        except Exception:
-            has_exception = True
-            license_errors.append(traceback.format_exc())
-        else:
-            try:
-                scan_result = json.loads(output)
-            except Exception:
-                has_exception = True
-                license_errors.append("Scancode exited with exit code {}"
-                                      .format(proc.returncode))
-                # There may be traceback or nothing in case scancode was killed
-                if error.strip():
-                    if isinstance(error, bytes):
-                        error = error.decode('utf-8')
-                    license_errors.append(error)
-            else:
-                files = scan_result.get('files', [])
-                for f in files:
-                    filepath = f.get('path')
-                    matched_licenses = f.get('licenses')
-                    if f.get('scan_errors'):
-                        license_errors.append("{}: {}".format(
-                            filepath, f['scan_errors']))
-                    for lic in matched_licenses:
-                        if lic.get('key') in scancode_unknown_licenses:
-                            continue
-                        spdx_key = lic.get('spdx_license_key', '')
-                        lic_key = spdx_key if not spdx_key.startswith('LicenseRef-') else lic.get('key')  # noqa: E501
-                        license_list.append(
-                            (filepath,
-                             lic_key,
-                             lic.get('score'),
-                             lic.get('start_line'),
-                             lic.get('end_line'),
-                             lic['matched_rule']['is_license_text'],
-                             lic['matched_rule']['identifier'])
-                        )
-                license_list = list(set(license_list))
+        def parse():
+            for f in self.iter_scancode_api_files(licenses=True):
+                licenses.update(self.get_file_licenses(f, license_errors))
+
+        errors, has_exception = self.run_scancode_api(parse)
+        license_errors.extend(errors)
+        if not has_exception:
+            license_list = list(licenses)
 
         if self.logger is not None:
             for err_msg in license_errors:
@@ -118,6 +364,33 @@ class CopyrightScanner(BaseScanner):
     """
     Package source copyright statement detection.
     """
+    def get_copyright_options(self):
+        return '--copyright --tallies'
+
+    @staticmethod
+    def get_summary_copyrights(tallies):
+        copyrights = [c.get('value') for c in tallies.get('copyrights', [])]
+        return list(filter(None, copyrights))
+
+    @staticmethod
+    def get_file_copyrights(f):
+        """
+        Get copyright statements from the scan result of a file.
+        """
+        if f['type'] == 'file' and f.get('copyrights'):
+            return f['copyrights']
+        return None
+
+    def iter_copyrights(self, result_file, tallies):
+        """
+        Yield copyright entries, i.e., tuples of file path and its copyright
+        statements, from the scancode output file. Tallies are collected
+        into the given dict in the same pass.
+        """
+        for f in iter_scan_files(result_file, tallies):
+            copyrights = self.get_file_copyrights(f)
+            if copyrights:
+                yield f['path'], copyrights
 
     def scancode_scan(self, **options):
         """ Get the copyright statements in this package. """
@@ -125,47 +398,134 @@ class CopyrightScanner(BaseScanner):
         # ignore_holders = self.config.get('IGNORE_HOLDERS', [])
         # ignore_holder_pattern = "'(" + '|'.join(ignore_holders) + ")'"
         copyright_dict = {}
-        copyright_errors = []
-        has_exception = False
+        result_file, copyright_errors, has_exception = self.run_scancode(
+            self.get_copyright_options())
+        if result_file is not None:
 
-        scancode_cli = self.config.get('SCANCODE_CLI', '/bin/scancode')
-        scancode_processes = self.config.get('SCANCODE_PROCESSES', 1)
-        cmd = ('{} --copyright --only-findings --strip-root --tallies '
-               '--processes {} --json - --quiet {}'.format(
-                    scancode_cli, scancode_processes, self.src_dir))
-        try:
-            proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-            output, error = proc.communicate()
-        except Exception:
-            has_exception = True
-            copyright_errors.append(traceback.format_exc())
-        else:
-            try:
-                scan_result = json.loads(output)
-            except Exception:
-                has_exception = True
-                copyright_errors.append("Scancode exited with exit code {}"
-                                        .format(proc.returncode))
-                if error.strip():
-                    if isinstance(error, bytes):
-                        error = error.decode('utf-8')
-                    copyright_errors.append(error)
-            else:
-                # Get the summary copyrights
-                copyrights_tallies = scan_result['tallies']['copyrights']
-                copyrights = [c.get('value') for c in copyrights_tallies]
-                # Get copyright statements for each file.
-                detail_copyrights = dict([
-                    (f['path'], f['copyrights']) for f in scan_result['files']
-                    if f['type'] == 'file' and f['copyrights']
-                ])
+            def parse(result_file):
+                tallies = {}
+                detail_copyrights = dict(
+                    self.iter_copyrights(result_file, tallies))
                 copyright_dict.update({
-                    'summary_copyrights': list(filter(None, copyrights)),
+                    'summary_copyrights': self.get_summary_copyrights(
+                        tallies),
                     'detail_copyrights': detail_copyrights,
                 })
+
+            has_exception = self.parse_scancode_output(
+                result_file, parse, copyright_errors)
+            if has_exception:
+                copyright_dict = {}
+
         if self.logger is not None:
             for err_msg in copyright_errors:
                 self.logger.error(err_msg)
 
         return (self.detector, copyright_dict, copyright_errors, has_exception)
+
+    def scancode_api_scan(self):
+        copyright_dict = {}
+        detail_copyrights = {}
+
+        def parse():
+            for f in self.iter_scancode_api_files(copyrights=True):
+                copyrights = self.get_file_copyrights(f)
+                if copyrights:
+                    detail_copyrights[f['path']] = copyrights
+            copyright_dict.update({
+                'summary_copyrights': self.tally_copyrights([
+                    c['copyright'] for copyrights in detail_copyrights.values()
+                    for c in copyrights]),
+                'detail_copyrights': detail_copyrights,
+            })
+
+        copyright_errors, has_exception = self.run_scancode_api(parse)
+        if has_exception:
+            copyright_dict = {}
+
+        if self.logger is not None:
+            for err_msg in copyright_errors:
+                self.logger.error(err_msg)
+
+        return (self.detector, copyright_dict, copyright_errors, has_exception)
+
+
+class CombinedScanner(LicenseScanner, CopyrightScanner):
+    """
+    Package source license and copyright detection in a single scancode run,
+    so that the source tree is only walked and tokenized once.
+    """
+    def scancode_scan(self):
+        license_list = []
+        copyright_dict = {}
+        options = '{} {}'.format(
+            self.get_license_options(), self.get_copyright_options())
+        result_file, errors, has_exception = self.run_scancode(options)
+        if result_file is not None:
+            # Per-file scan errors are license errors, as in LicenseScanner.
+            license_errors = []
+            licenses = set()
+            detail_copyrights = {}
+
+            def parse(result_file):
+                tallies = {}
+                for f in iter_scan_files(result_file, tallies):
+                    licenses.update(self.get_file_licenses(f, license_errors))
+                    copyrights = self.get_file_copyrights(f)
+                    if copyrights:
+                        detail_copyrights[f['path']] = copyrights
+                copyright_dict.update({
+                    'summary_copyrights': self.get_summary_copyrights(
+                        tallies),
+                    'detail_copyrights': detail_copyrights,
+                })
+
+            has_exception = self.parse_scancode_output(
+                result_file, parse, errors)
+            if has_exception:
+                copyright_dict = {}
+            else:
+                license_list = list(licenses)
+                errors.extend(license_errors)
+
+        if self.logger is not None:
+            for err_msg in errors:
+                self.logger.error(err_msg)
+
+        return (self.detector, license_list, copyright_dict, errors,
+                has_exception)
+
+    def scancode_api_scan(self):
+        license_list = []
+        copyright_dict = {}
+        license_errors = []
+        licenses = set()
+        detail_copyrights = {}
+
+        def parse():
+            for f in self.iter_scancode_api_files(
+                    licenses=True, copyrights=True):
+                licenses.update(self.get_file_licenses(f, license_errors))
+                copyrights = self.get_file_copyrights(f)
+                if copyrights:
+                    detail_copyrights[f['path']] = copyrights
+            copyright_dict.update({
+                'summary_copyrights': self.tally_copyrights([
+                    c['copyright'] for copyrights in detail_copyrights.values()
+                    for c in copyrights]),
+                'detail_copyrights': detail_copyrights,
+            })
+
+        errors, has_exception = self.run_scancode_api(parse)
+        if has_exception:
+            copyright_dict = {}
+        else:
+            license_list = list(licenses)
+            errors.extend(license_errors)
+
+        if self.logger is not None:
+            for err_msg in errors:
+                self.logger.error(err_msg)
+
+        return (self.detector, license_list, copyright_dict, errors,
+                has_exception)
@@ -1,6 +1,18 @@
+import hashlib
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
 from swh.model.cli import swhid_of_file
 from swh.model.swhids import SWHID_RE
 
+# Files larger than this are hashed through memory-mapped I/O.
+MMAP_THRESHOLD = 1024 * 1024
+# Number of paths hashed in a work item.
+HASH_CHUNK_SIZE = 256
+READ_BLOCK_SIZE = 64 * 1024
+
 
 def swhid_check(swhid):
     """
@@ -22,8 +34,78 @@ def get_swhids(paths):
     return [str(swhid_of_file(path)) for path in paths]
 
 
-def get_swhids_with_paths(paths):
+def swhid_of_path(path):
+    """
+    Get SWH ID of a regular file, i.e., the git blob sha1 of its content,
+    same as `swhid_of_file` but hashing without loading the whole file.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        sha1 = hashlib.sha1(b'blob %d\0' % size)
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                sha1.update(m)
+        else:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+                sha1.update(block)
+    return 'swh:1:cnt:' + sha1.hexdigest()
+
+
+def hash_file(path):
+    """
+    Read the file once, returns its SWH ID(git blob sha1) and sha256.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        sha1 = hashlib.sha1(b'blob %d\0' % size)
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                sha1.update(m)
+                sha256.update(m)
+        else:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+                sha1.update(block)
+                sha256.update(block)
+    return 'swh:1:cnt:' + sha1.hexdigest(), sha256.hexdigest()
+
+
+def hash_bytes(data):
+    """
+    Hash file content in memory, returns its SWH ID(git blob sha1) and
+    sha256.
+    """
+    sha1 = hashlib.sha1(b'blob %d\0' % len(data))
+    sha1.update(data)
+    return 'swh:1:cnt:' + sha1.hexdigest(), hashlib.sha256(data).hexdigest()
+
+
+def map_chunks(func, items, workers=None):
+    """
+    Apply func to chunks of items concurrently, returns the results of all
+    chunks in the same order as items.
+
+    A thread pool is used since hashlib and file reads release the GIL,
+    while celery prefork worker processes are daemonic and not allowed to
+    have child processes.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(items) <= HASH_CHUNK_SIZE:
+        return func(items)
+    chunks = [items[i:i + HASH_CHUNK_SIZE]
+              for i in range(0, len(items), HASH_CHUNK_SIZE)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(chain.from_iterable(executor.map(func, chunks)))
+
+
+def get_chunk_swhids(paths):
+    return [(path, swhid_of_path(path)) for path in paths]
+
+
+def get_swhids_with_paths(paths, workers=None):
     """
-    Get SWH IDs with package source file paths.
+    Get SWH IDs with package source file paths, in the same order as paths.
+    Paths are hashed in chunks concurrently.
     """
-    return [(path, str(swhid_of_file(path))) for path in paths]
+    return map_chunks(get_chunk_swhids, list(paths), workers)
@@ -1,9 +1,14 @@
+import gzip
+import lzma
 import os
 from io import StringIO
 from pathlib import Path
 import json
 import shutil
+import struct
+import tarfile
 import tempfile
+import time
 import warnings
 from unittest import mock
 from unittest import TestCase
@@ -11,10 +16,20 @@ from kobo.shortcuts import run
 from django.conf import settings
 import hashlib
 from redis import Redis
+from checksumdir import dirhash
 
+from libs.bloom import BloomFilter
+from libs.compact import dump_package_data
+from libs.compact import dump_scan_result
+from libs.compact import load_data
 from libs.corgi import CorgiConnector
+from libs.common import ComponentTrie
 from libs.common import guess_env_from_principal
+from libs.common import search_content_by_patterns
+from libs.exceptions import UnsupportedPayloadException
+from libs.hash_cache import HashCache
 from libs.kojiconnector import KojiConnector
+from libs.manifest import SourceManifest
 from libs.metadata import CargoMeta
 from libs.metadata import GemMeta
 from libs.metadata import GolangMeta
@@ -22,9 +37,19 @@ from libs.metadata import NpmMeta
 from packagedcode.maven import MavenPomXmlHandler
 from packagedcode.pypi import PypiSdistArchiveHandler
 from libs.parsers import parse_manifest_file
+from libs.sc_handler import RemoteSourceIndex
+from libs.sc_handler import SourceContainerHandler
 from libs.scanner import LicenseScanner
 from libs.scanner import CopyrightScanner
+from libs.scanner import CombinedScanner
+from libs.scanner import iter_scan_files
+from libs.swh_tools import get_swhids
+from libs.swh_tools import get_swhids_with_paths
+from libs.swh_tools import hash_bytes
+from libs.swh_tools import hash_file
+from libs.unpack import KnownFiles
 from libs.unpack import UnpackArchive
+from libs.unpack import extract_rpm
 from libs.exceptions import MissingBinaryBuildException
 from libs.constants import TASK_IDENTITY_PREFIX
 from libs.redis import RedisClient
@@ -115,6 +140,429 @@ class TestUnpack(TestCase):
         shutil.rmtree(tmp_dir, ignore_errors=True)
 
 
+class TestParallelUnpack(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmp_dir, 'src')
+        os.mkdir(self.src_dir)
+        # Nested archives: outer-N.tar.gz/outer/inner.tar.gz/inner/a.txt
+        inner_dir = os.path.join(self.tmp_dir, 'outer', 'inner')
+        os.makedirs(inner_dir)
+        with open(os.path.join(inner_dir, 'a.txt'), 'w') as f:
+            f.write('a')
+        shutil.make_archive(inner_dir, 'gztar', os.path.dirname(inner_dir),
+                            'inner')
+        shutil.rmtree(inner_dir)
+        for i in range(3):
+            shutil.make_archive(os.path.join(self.src_dir, f'outer-{i}'),
+                                'gztar', self.tmp_dir, 'outer')
+
+    def unpack_archive(self, archive):
+        # Shallow unpack in place, same as extractcode.
+        target = archive + '-extract'
+        shutil.unpack_archive(archive, target, 'gztar')
+        os.remove(archive)
+        os.rename(target, archive)
+        return [f'{os.path.basename(archive)} unpacked']
+
+    def test_unpack_archives_parallel(self):
+        ua = UnpackArchive(config={'UNPACK_PROCESSES': 2},
+                           dest_dir=self.src_dir)
+        with mock.patch.object(ua, 'unpack_archive', self.unpack_archive):
+            errors = ua.unpack_archives()
+        self.assertEqual(len(errors), 6)
+        for i in range(3):
+            self.assertTrue(os.path.isfile(os.path.join(
+                self.src_dir, f'outer-{i}.tar.gz', 'outer', 'inner.tar.gz',
+                'inner', 'a.txt')))
+
+    def test_unpack_archive_using_atool(self):
+        archive = os.path.join(self.src_dir, 'foo.rar')
+        with open(archive, 'wb') as f:
+            f.write(b'Rar!')
+        tmp_dirs = []
+
+        def atool(cmd, workdir=None):
+            # atool -X '<tmp_dir>' -q '<archive>'
+            tmp_dir = cmd.split("'")[1]
+            tmp_dirs.append(tmp_dir)
+            with open(os.path.join(tmp_dir, 'a.txt'), 'w') as f:
+                f.write('a')
+
+        ua = UnpackArchive(config={'EXTRACTCODE_CLI': '/nonexistent'},
+                           dest_dir=self.src_dir)
+        with mock.patch('libs.unpack.run', side_effect=atool):
+            errors = ua.unpack_archive(archive)
+        self.assertEqual(len(errors), 1)
+        # Unpacked next to the archive, not in the system temp directory.
+        self.assertEqual(os.path.dirname(tmp_dirs[0]), self.src_dir)
+        self.assertTrue(os.path.isfile(os.path.join(archive, 'a.txt')))
+
+    def test_unpack_archives_decodes_errors(self):
+        ua = UnpackArchive(config={'UNPACK_PROCESSES': 2},
+                           dest_dir=self.src_dir)
+        with mock.patch.object(ua, 'unpack_archive',
+                               return_value=[b'bad archive']):
+            errors = ua.unpack_archives()
+        self.assertEqual(errors, ['bad archive'] * 3)
+
+    def test_unpack_archives_skipping_known(self):
+        known_swhid = hash_bytes(b'a')[0]
+        checked = []
+
+        def get_known(swhids):
+            checked.append(swhids)
+            return {known_swhid}
+
+        known_files = KnownFiles(get_known, lambda swhid: swhid != 'new')
+        ua = UnpackArchive(config={'UNPACK_PROCESSES': 1},
+                           dest_dir=self.src_dir, known_files=known_files)
+        self.assertEqual(ua.unpack_archives(), [])
+        # Archives are always written to be unpacked.
+        self.assertEqual(len(checked), 3)
+        self.assertEqual(sorted(known_files.skipped), [
+            os.path.join(f'outer-{i}.tar.gz', 'outer', 'inner.tar.gz',
+                         'inner', 'a.txt') for i in range(3)])
+        for i in range(3):
+            inner_dir = os.path.join(self.src_dir, f'outer-{i}.tar.gz',
+                                     'outer', 'inner.tar.gz', 'inner')
+            self.assertEqual(os.listdir(inner_dir), [])
+
+        manifest = SourceManifest(self.src_dir).add_known(
+            known_files.skipped).build()
+        self.assertEqual(len(manifest.entries), 3)
+        self.assertEqual(manifest.hashed_count, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestExtractInProcess(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.content_dir = os.path.join(self.tmp_dir, 'foo')
+        os.makedirs(os.path.join(self.content_dir, 'sub'))
+        with open(os.path.join(self.content_dir, 'sub', 'a.txt'), 'w') as f:
+            f.write('a')
+
+    def test_unpack_file(self):
+        for fmt, ext in [('gztar', '.tar.gz'), ('bztar', '.tar.bz2'),
+                         ('xztar', '.tar.xz'), ('zip', '.zip')]:
+            archive = shutil.make_archive(
+                os.path.join(self.tmp_dir, 'foo-1.0'), fmt, self.tmp_dir,
+                'foo')
+            self.assertTrue(archive.endswith(ext))
+            unpack_dir = UnpackArchive.unpack_file(archive)
+            with open(os.path.join(unpack_dir, 'foo', 'sub', 'a.txt')) as f:
+                self.assertEqual(f.read(), 'a')
+            shutil.rmtree(unpack_dir)
+
+        archive = os.path.join(self.tmp_dir, 'a.txt.gz')
+        with gzip.open(archive, 'wt') as f:
+            f.write('a')
+        unpack_dir = UnpackArchive.unpack_file(archive)
+        self.assertEqual(os.listdir(unpack_dir), ['a.txt'])
+        shutil.rmtree(unpack_dir)
+
+    def test_unsafe_members(self):
+        archive = os.path.join(self.tmp_dir, 'evil.tar')
+        with tarfile.open(archive, 'w') as tar:
+            tar.add(os.path.join(self.content_dir, 'sub', 'a.txt'),
+                    arcname='../evil.txt')
+            link = tarfile.TarInfo('link')
+            link.type = tarfile.SYMTYPE
+            link.linkname = '/etc'
+            tar.addfile(link)
+            tar.add(os.path.join(self.content_dir, 'sub', 'a.txt'),
+                    arcname='safe.txt')
+        unpack_dir = UnpackArchive.unpack_file(archive)
+        self.assertEqual(os.listdir(unpack_dir), ['safe.txt'])
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmp_dir, 'evil.txt')))
+        shutil.rmtree(unpack_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestExtractRpm(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dest_dir = os.path.join(self.tmp_dir, 'src')
+        os.makedirs(self.dest_dir)
+
+    @staticmethod
+    def make_cpio(entries):
+        data = b''
+        for ino, name, mode, nlink, content in entries + [
+                (0, 'TRAILER!!!', 0, 1, b'')]:
+            name = name.encode() + b'\0'
+            fields = [ino, mode, 0, 0, nlink, 1600000000, len(content), 0, 0,
+                      0, 0, len(name), 0]
+            header = b'070701' + b''.join(b'%08X' % f for f in fields)
+            data += header + name + b'\0' * (-len(header + name) % 4)
+            data += content + b'\0' * (-len(content) % 4)
+        return data
+
+    @staticmethod
+    def make_header(tags):
+        index, store = b'', b''
+        for tag, value in tags.items():
+            index += struct.pack('>iiii', tag, 6, len(store), 1)
+            store += value.encode() + b'\0'
+        return b'\x8e\xad\xe8\x01\0\0\0\0' + \
+            struct.pack('>II', len(tags), len(store)) + index + store
+
+    def make_rpm(self, compressor, payload):
+        signature = self.make_header({})
+        header = self.make_header({1124: 'cpio', 1125: compressor})
+        rpm_path = os.path.join(self.tmp_dir, 'foo-1.0-1.src.rpm')
+        with open(rpm_path, 'wb') as f:
+            f.write(b'\xed\xab\xee\xdb' + b'\0' * 92 + signature)
+            f.write(b'\0' * (-len(signature) % 8) + header + payload)
+        return rpm_path
+
+    def test_extract_rpm(self):
+        cpio = self.make_cpio([
+            (1, 'foo.spec', 0o100644, 1, b'Name: foo\n'),
+            (2, './dir', 0o40755, 2, b''),
+            (3, 'dir/a.txt', 0o100644, 2, b''),
+            (3, 'dir/b.txt', 0o100644, 2, b'linked'),
+            (4, 'dir/link', 0o120777, 1, b'b.txt'),
+            (5, '../evil.txt', 0o100644, 1, b'evil'),
+        ])
+        rpm_path = self.make_rpm('xz', lzma.compress(cpio))
+        hashes = extract_rpm(rpm_path, self.dest_dir)
+        self.assertEqual(sorted(hashes),
+                         ['dir/a.txt', 'dir/b.txt', 'foo.spec'])
+        for path, (swhid, sha256) in hashes.items():
+            abs_path = os.path.join(self.dest_dir, path)
+            self.assertEqual(get_swhids_with_paths([abs_path]),
+                             [(abs_path, swhid)])
+            with open(abs_path, 'rb') as f:
+                self.assertEqual(hashlib.sha256(f.read()).hexdigest(),
+                                 sha256)
+        self.assertEqual(os.stat(os.path.join(
+            self.dest_dir, 'foo.spec')).st_mtime, 1600000000)
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.dest_dir, 'dir', 'a.txt'),
+            os.path.join(self.dest_dir, 'dir', 'b.txt')))
+        self.assertEqual(os.readlink(
+            os.path.join(self.dest_dir, 'dir', 'link')), 'b.txt')
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmp_dir, 'evil.txt')))
+
+        manifest = SourceManifest(self.dest_dir).add_hashes(hashes).build()
+        self.assertEqual(manifest.reused_count, 3)
+        self.assertEqual(manifest.checksum, dirhash(self.dest_dir, 'sha256'))
+
+    def test_extract_rpm_skipping_known(self):
+        cpio = self.make_cpio([
+            (1, 'foo.spec', 0o100644, 1, b'Name: foo\n'),
+            (2, 'known.patch', 0o100644, 1, b'known'),
+            (3, 'foo-1.0.tar.gz', 0o100644, 1, b'known'),
+        ])
+        rpm_path = self.make_rpm('gzip', gzip.compress(cpio))
+        known_swhid = hash_bytes(b'known')[0]
+        known_files = KnownFiles(lambda swhids: {known_swhid})
+        ua = UnpackArchive(src_file=rpm_path, dest_dir=self.dest_dir,
+                           known_files=known_files)
+        ua._extract_rpm()
+        self.assertEqual(sorted(os.listdir(self.dest_dir)),
+                         ['foo-1.0.tar.gz', 'foo.spec'])
+        self.assertEqual(sorted(ua.hashes), ['foo-1.0.tar.gz', 'foo.spec'])
+        self.assertEqual(list(known_files.skipped), ['known.patch'])
+
+    def test_unsupported_payload(self):
+        rpm_path = self.make_rpm('lzip', b'')
+        with self.assertRaises(UnsupportedPayloadException):
+            extract_rpm(rpm_path, self.dest_dir)
+        self.assertEqual(os.listdir(self.dest_dir), [])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestComponentTrie(TestCase):
+
+    def setUp(self):
+        self.components = [
+            {'type': 'GOLANG', 'name': 'github.com/foo', 'version': '1'},
+            {'type': 'GOLANG', 'name': 'github.com/foo/bar/baz',
+             'version': '1'},
+            {'type': 'NPM', 'name': 'github.com/foo/bar', 'version': '1'},
+            {'type': 'GOLANG', 'name': 'github.com/foo/bar', 'version': '1'},
+            {'type': 'GOLANG', 'name': 'github.com/foo/bar', 'version': '2'},
+            {'type': 'GOLANG', 'name': 'github.com/foobar', 'version': '1'},
+            {'type': 'NPM', 'name': 'github.com', 'version': '1'},
+        ]
+
+    def test_sort_components(self):
+        components = ComponentTrie(self.components).sort_components()
+        self.assertCountEqual(components, self.components)
+        # Children are ahead of their parents of any type.
+        for i, component in enumerate(components):
+            for child in components[i + 1:]:
+                self.assertFalse(
+                    child['name'].startswith(component['name'] + os.sep),
+                    f"{child} after its parent {component}")
+
+    def test_has_parent(self):
+        component_trie = ComponentTrie(self.components)
+        for component in self.components:
+            self.assertEqual(
+                component_trie.has_parent(component),
+                any(component['name'].startswith(c['name'] + os.sep) and
+                    c['type'] == component['type']
+                    for c in self.components))
+
+    def test_has_parent_in_order(self):
+        # Parents are not handled yet when their children are handled.
+        component_trie = ComponentTrie(self.components)
+        components = component_trie.sort_components()
+        while components:
+            component = components.pop(0)
+            self.assertEqual(
+                component_trie.has_parent(component),
+                any(component['name'].startswith(c['name'] + os.sep) and
+                    c['type'] == component['type'] for c in components))
+
+
+class TestExtractLayers(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.blob_dir = os.path.join(self.tmp_dir, 'blobs')
+        self.dest_dir = os.path.join(self.tmp_dir, 'dest')
+        os.makedirs(self.blob_dir)
+        os.makedirs(self.dest_dir)
+        content_dir = os.path.join(self.tmp_dir, 'content')
+        for i in range(3):
+            layer_dir = os.path.join(content_dir, str(i))
+            os.makedirs(os.path.join(layer_dir, 'rpm_dir'))
+            for name in [f'foo-{i}.src.rpm', 'common.txt']:
+                with open(os.path.join(layer_dir, 'rpm_dir', name), 'w') as f:
+                    f.write(f'{i}')
+            # Blobs are named by digests, without extension.
+            archive = shutil.make_archive(
+                os.path.join(self.tmp_dir, str(i)), 'gztar', layer_dir)
+            os.rename(archive, os.path.join(self.blob_dir, f'sha256-{i}'))
+        with open(os.path.join(self.blob_dir, 'sha256-3'), 'wb') as f:
+            f.write(b'\x1f\x8b\x08\x00' + b'\0' * 100)
+        self.manifest = os.path.join(self.blob_dir, 'manifest.json')
+        with open(self.manifest, 'w') as f:
+            f.write('{}')
+
+    def test_uncompress_blob_gzip_files(self):
+        sc_handler = SourceContainerHandler(
+            config={'UNPACK_PROCESSES': 2}, src_file=self.manifest,
+            dest_dir=self.dest_dir)
+        errors = sc_handler.uncompress_blob_gzip_files()
+        # Errors are reported per blob.
+        self.assertEqual(len(errors), 1)
+        self.assertIn('sha256-3', errors[0])
+        self.assertCountEqual(os.listdir(self.blob_dir),
+                              ['manifest.json', 'sha256-3'])
+        self.assertEqual(os.listdir(self.dest_dir), ['rpm_dir'])
+        self.assertCountEqual(
+            os.listdir(os.path.join(self.dest_dir, 'rpm_dir')),
+            ['common.txt', 'foo-0.src.rpm', 'foo-1.src.rpm',
+             'foo-2.src.rpm'])
+        # Later layers overwrite earlier ones.
+        with open(os.path.join(self.dest_dir, 'rpm_dir', 'common.txt')) as f:
+            self.assertEqual(f.read(), '2')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestRemoteSourceIndex(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.extra_src_dir = os.path.join(self.tmp_dir, 'extra_src_dir')
+        rs_dir = os.path.join(self.extra_src_dir, 'foo-rs')
+        for path in [
+                'deps/gomod/pkg/mod/cache/download/k8s.io/klog/@v/v1.0.0.zip',
+                'deps/gomod/pkg/mod/cache/download/k8s.io/klog/v2/@v/'
+                'v2.9.0.zip',
+                'deps/gomod/pkg/mod/cache/download/github.com/!burnt!sushi/'
+                'toml/@v/v0.3.1.zip',
+                'deps/npm/@babel/core/core-7.1.0.tgz',
+                'deps/npm/.hidden/core-7.1.0.tgz',
+                'deps/pip/requests/requests-2.25.1.tar.gz',
+                'app/vendor/github.com/pkg/errors/errors.go',
+                'app/main.go']:
+            file_path = os.path.join(rs_dir, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as f:
+                f.write(path)
+        self.components = [
+            {'type': 'GOLANG', 'name': 'k8s.io/klog', 'version': 'v1.0.0'},
+            {'type': 'GOLANG', 'name': 'k8s.io/klog/v2', 'version': 'v2.9.0'},
+            {'type': 'GOLANG', 'name': 'github.com/BurntSushi/toml',
+             'version': 'v0.3.1'},
+            {'type': 'GOLANG', 'name': 'github.com/pkg/errors',
+             'version': 'v0.9.1'},
+            {'type': 'NPM', 'name': '@babel/core', 'version': '7.1.0'},
+            {'type': 'PYPI', 'name': 'requests', 'version': '2.25.1'},
+            {'type': 'PYPI', 'name': 'missing', 'version': '1.0'},
+        ]
+
+    def test_search_same_as_glob(self):
+        handler = SourceContainerHandler()
+        rs_index = RemoteSourceIndex(self.extra_src_dir)
+        for component in self.components:
+            patterns = handler.get_remote_source_search_patterns(
+                component, self.extra_src_dir)
+            self.assertCountEqual(rs_index.search(patterns),
+                                  search_content_by_patterns(patterns))
+            self.assertEqual(
+                handler.get_remote_source_path(
+                    component, self.extra_src_dir, rs_index),
+                handler.get_remote_source_path(
+                    component, self.extra_src_dir))
+
+    def test_lookup_by_keys(self):
+        handler = SourceContainerHandler()
+        rs_index = RemoteSourceIndex(self.extra_src_dir)
+        # Components are looked up by keys, without matching patterns
+        # against indexed paths.
+        with mock.patch('libs.sc_handler.match_path_parts') as mock_match:
+            for component in self.components[:-1]:
+                path, _ = handler.get_remote_source_path(
+                    component, self.extra_src_dir, rs_index)
+                self.assertIsNotNone(path)
+            mock_match.assert_not_called()
+        self.assertEqual(
+            rs_index.lookup(handler.get_remote_source_keys(
+                self.components[4])),
+            [os.path.join(self.extra_src_dir,
+                          'foo-rs/deps/npm/@babel/core/core-7.1.0.tgz')])
+        # Components with git versions are searched by patterns.
+        self.assertIsNone(handler.get_remote_source_keys(
+            {'type': 'NPM', 'name': 'security-middleware',
+             'version': 'github:foo/security-middleware#f88cdf95'}))
+
+    def test_remove(self):
+        handler = SourceContainerHandler()
+        rs_index = RemoteSourceIndex(self.extra_src_dir)
+        component = self.components[3]
+        path, _ = handler.get_remote_source_path(
+            component, self.extra_src_dir, rs_index)
+        self.assertTrue(path.endswith('app/vendor/github.com/pkg/errors'))
+        rs_index.remove(os.path.dirname(path))
+        path, _ = handler.get_remote_source_path(
+            component, self.extra_src_dir, rs_index)
+        self.assertIsNone(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
 class TestDownloadFromBrew(TestCase):
 
     def setUp(self):
@@ -285,6 +733,378 @@ class TestCopyrightScan(TestCase):
         shutil.rmtree(self.src_dir, ignore_errors=True)
 
 
+class TestCombinedScan(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.config = {
+            # Update below path to your virtualenv path in local
+            'SCANCODE_CLI': os.getenv("SCANCODE_CLI",
+                                      "/opt/app-root/bin/scancode"),
+        }
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp(prefix='scan_')
+
+    def test_scan(self):
+        # Prepare text files for both license and copyright scanning
+        license_file = os.path.join(self.src_dir, 'license_file')
+        with open(license_file, "w", encoding="utf-8") as f:
+            f.write("http://www.gzip.org/zlib/zlib_license.html")
+        copyright_file = os.path.join(self.src_dir, 'copyright_file')
+        statement = "Copyright (c) 2022 Qingmin Duanmu <qduanmu@test.com>"
+        with open(copyright_file, "w", encoding="utf-8") as f:
+            f.write(statement)
+        scanner = CombinedScanner(
+            src_dir=self.src_dir,
+            config=TestCombinedScan.config)
+        (detector, licenses, copyrights, errors, has_exception) = \
+            scanner.scan()
+        self.assertEqual(len(licenses), 1)
+        self.assertEqual(licenses[0][0], 'license_file')
+        self.assertEqual(licenses[0][1], 'Zlib')
+        detail = copyrights.get('detail_copyrights')
+        self.assertEqual(list(detail.keys()), ['copyright_file'])
+        self.assertEqual(detail['copyright_file'][0], {
+            'copyright': statement, 'start_line': 1, 'end_line': 1}
+        )
+        # Summary copyrights are tallied without years.
+        self.assertEqual(copyrights.get('summary_copyrights'),
+                         ['Copyright (c) Qingmin Duanmu <qduanmu@test.com>'])
+        self.assertEqual(errors, [])
+        self.assertFalse(has_exception)
+        self.assertTrue('scancode' in detector)
+
+    def test_scancode_api_scan(self):
+        for name in ['license_file', 'copyright_file']:
+            with open(os.path.join(self.src_dir, name), "w",
+                      encoding="utf-8") as f:
+                f.write("Copyright (c) 2022 Qingmin Duanmu\n"
+                        if name == 'copyright_file'
+                        else "http://www.gzip.org/zlib/zlib_license.html")
+        scanner = CombinedScanner(
+            src_dir=self.src_dir,
+            config=TestCombinedScan.config)
+        cli_result = scanner.scan()
+        api_result = scanner.scan('scancode_api')
+        # In-process scan results are interchangeable with cli ones.
+        self.assertEqual(
+            api_result[0], 'scancode ' + scanner.get_scancode_api_version())
+        self.assertEqual(sorted(api_result[1]), sorted(cli_result[1]))
+        self.assertEqual(api_result[2], cli_result[2])
+        self.assertEqual(api_result[3:], ([], False))
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir, ignore_errors=True)
+
+
+class TestScancodeProcesses(TestCase):
+
+    def setUp(self):
+        self.config = {
+            'SCANCODE_PROCESSES': 1,
+            'SCANCODE_FILES_PER_PROCESS': 1000,
+        }
+
+    @mock.patch('libs.scanner.get_available_cpus', return_value=16)
+    def test_get_scancode_processes(self, mock_cpus):
+        # Static processes without file count.
+        scanner = LicenseScanner(config=self.config)
+        self.assertEqual(scanner.get_scancode_processes(), 1)
+        scanner = LicenseScanner(config=self.config, file_count=20)
+        self.assertEqual(scanner.get_scancode_processes(), 1)
+        scanner = LicenseScanner(config=self.config, file_count=5500)
+        self.assertEqual(scanner.get_scancode_processes(), 6)
+        scanner = LicenseScanner(config=self.config, file_count=70000)
+        self.assertEqual(scanner.get_scancode_processes(), 16)
+        # Cpus are shared with other running tasks on the node.
+        scanner = LicenseScanner(config=self.config, file_count=70000,
+                                 running_tasks=4)
+        self.assertEqual(scanner.get_scancode_processes(), 4)
+        scanner = LicenseScanner(config=self.config, file_count=70000,
+                                 running_tasks=32)
+        self.assertEqual(scanner.get_scancode_processes(), 1)
+
+
+class TestScanOutput(TestCase):
+
+    def test_iter_scan_files(self):
+        output = {
+            'headers': [{'tool_name': 'scancode-toolkit'}],
+            'tallies': {
+                'copyrights': [{'value': 'Copyright Foo', 'count': 2},
+                               {'value': None, 'count': 1}],
+                'holders': [{'value': 'Foo', 'count': 2}],
+            },
+            'files': [
+                {'path': 'a.c', 'type': 'file',
+                 'copyrights': [{'copyright': 'Copyright Foo'}]},
+                {'path': 'b.c', 'type': 'file', 'copyrights': []},
+            ],
+        }
+        fd, result_file = tempfile.mkstemp(suffix='.json')
+        self.addCleanup(os.remove, result_file)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(output, f)
+        tallies = {}
+        files = iter_scan_files(result_file, tallies)
+        self.assertEqual(next(files), output['files'][0])
+        # Tallies ahead of files are collected while yielding files.
+        self.assertEqual(tallies, output['tallies'])
+        self.assertEqual(list(files), output['files'][1:])
+        self.assertEqual(CopyrightScanner.get_summary_copyrights(tallies),
+                         ['Copyright Foo'])
+        self.assertEqual(list(iter_scan_files(result_file)), output['files'])
+
+
+class TestSwhTools(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        self.paths = []
+        # Empty, small and memory-mapped large files.
+        for i, size in enumerate([0, 10, 2 * 1024 * 1024] * 100):
+            path = os.path.join(self.src_dir, str(i))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size))
+            self.paths.append(path)
+
+    def test_get_swhids_with_paths(self):
+        expected = list(zip(self.paths, get_swhids(self.paths)))
+        self.assertEqual(get_swhids_with_paths(self.paths, workers=4),
+                         expected)
+        self.assertEqual(get_swhids_with_paths(self.paths, workers=1),
+                         expected)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
+
+
+class TestSourceManifest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmp_dir, 'src')
+        sub_dir = os.path.join(self.src_dir, 'a', 'b')
+        os.makedirs(sub_dir)
+        for i, size in enumerate([0, 10, 2 * 1024 * 1024] * 10):
+            with open(os.path.join(sub_dir, str(i)), 'wb') as f:
+                f.write(os.urandom(size))
+        os.symlink(os.path.join(sub_dir, '1'),
+                   os.path.join(self.src_dir, 'link'))
+        os.symlink('missing', os.path.join(self.src_dir, 'broken'))
+        os.symlink(sub_dir, os.path.join(self.src_dir, 'link_dir'))
+
+    def test_build(self):
+        manifest = SourceManifest(self.src_dir, workers=4).build()
+        self.assertEqual(manifest.checksum,
+                         dirhash(self.src_dir, 'sha256'))
+        paths = sorted(os.path.join(root, name)
+                       for root, _, files in os.walk(self.src_dir)
+                       for name in files
+                       if not os.path.islink(os.path.join(root, name)))
+        self.assertEqual(manifest.get_paths_with_swhids(),
+                         get_swhids_with_paths(paths))
+
+    def test_directory_swhids(self):
+        src_dir = os.path.join(self.tmp_dir, 'tree')
+        for path, content in [('a/b/f1', 'x'), ('a/f2', 'y'), ('c/f3', 'z'),
+                              ('top', 'w')]:
+            file_path = os.path.join(src_dir, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(content + '\n')
+        os.symlink('top', os.path.join(src_dir, 'c', 'link'))
+        manifest = SourceManifest(src_dir).build()
+        # Same as git tree hashes, links are not included.
+        self.assertEqual(manifest.get_directory_swhids(), {
+            'a': 'swh:1:dir:c373af6881933e20bb92349f8d27a0939f7291de',
+            'a/b': 'swh:1:dir:ddecd05eb748bad50cc509cbb8646a791d02b5f3',
+            'c': 'swh:1:dir:120d51b69237a1f81d7b470a8c17658791539aa9',
+        })
+
+    def test_rebase(self):
+        manifest = SourceManifest(self.src_dir).build()
+        dest_dir = os.path.join(self.tmp_dir, 'dest')
+        shutil.copytree(self.src_dir, dest_dir, symlinks=True)
+        checksum = manifest.checksum
+        manifest.rebase(dest_dir).build()
+        self.assertEqual(manifest.hashed_count, 32)
+        self.assertEqual(manifest.reused_count, 32)
+        self.assertEqual(manifest.checksum, checksum)
+        self.assertTrue(all(path.startswith(dest_dir) for path, _ in
+                            manifest.get_paths_with_swhids()))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestHashCache(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmp_dir, 'src')
+        os.mkdir(self.src_dir)
+        self.paths = []
+        for i in range(10):
+            path = os.path.join(self.src_dir, str(i))
+            with open(path, 'wb') as f:
+                f.write(os.urandom(i * 100))
+            # Fixed mtime as in archives.
+            os.utime(path, (0, 0))
+            self.paths.append(path)
+        self.db_path = os.path.join(self.tmp_dir, 'hash_cache.sqlite3')
+        # Files just changed are cached in tests.
+        patcher = mock.patch('libs.hash_cache.RACY_SECONDS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_many(self):
+        stats = [os.stat(path) for path in self.paths]
+        hashes = [hash_file(path) for path in self.paths]
+        hash_cache = HashCache(self.db_path)
+        self.assertEqual(hash_cache.get_many(stats), [None] * 10)
+        hash_cache.put_many(
+            (stat, swhid, sha256)
+            for stat, (swhid, sha256) in zip(stats, hashes))
+        self.assertEqual(hash_cache.get_many(stats), hashes)
+        self.assertEqual((hash_cache.hits, hash_cache.misses), (10, 10))
+        hash_cache.close()
+
+    def test_source_manifest(self):
+        checksum = dirhash(self.src_dir, 'sha256')
+        hash_cache = HashCache(self.db_path)
+        SourceManifest(self.src_dir, hash_cache=hash_cache).build()
+        # Modified files are hashed again.
+        with open(self.paths[0], 'wb') as f:
+            f.write(b'changed')
+        os.utime(self.paths[0], (0, 0))
+        manifest = SourceManifest(self.src_dir, hash_cache=hash_cache).build()
+        self.assertEqual((hash_cache.hits, hash_cache.misses), (9, 11))
+        self.assertNotEqual(manifest.checksum, checksum)
+        self.assertEqual(manifest.checksum, dirhash(self.src_dir, 'sha256'))
+        hash_cache.close()
+
+    def test_changed_ctime(self):
+        hash_cache = HashCache(self.db_path)
+        stat = os.stat(self.paths[1])
+        hash_cache.put_many([(stat, 'swhid', 'sha256')])
+        time.sleep(0.05)
+        # Same inode, size and mtime, but different content.
+        with open(self.paths[1], 'wb') as f:
+            f.write(os.urandom(100))
+        os.utime(self.paths[1], (0, 0))
+        new_stat = os.stat(self.paths[1])
+        self.assertEqual(
+            (new_stat.st_ino, new_stat.st_size, new_stat.st_mtime_ns),
+            (stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        self.assertEqual(hash_cache.get_many([new_stat]), [None])
+        with mock.patch('libs.hash_cache.RACY_SECONDS', 60):
+            hash_cache.put_many([(new_stat, 'swhid', 'sha256')])
+        # Files just changed are not cached.
+        self.assertEqual(hash_cache.get_many([new_stat]), [None])
+        hash_cache.close()
+
+    def test_evict(self):
+        hash_cache = HashCache(self.db_path, max_entries=5)
+        stats = [os.stat(path) for path in self.paths]
+        hash_cache.put_many((stat, 'swhid', 'sha256') for stat in stats)
+        hash_cache.get_many(stats)
+        self.assertEqual(hash_cache.hits, 4)
+        hash_cache.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestBloomFilter(TestCase):
+
+    def test_bloom_filter(self):
+        swhids = ['swh:1:cnt:' + hashlib.sha1(str(i).encode()).hexdigest()
+                  for i in range(20000)]
+        bloom_filter = BloomFilter.for_capacity(10000, 0.01)
+        bloom_filter.update(swhids[:10000])
+        loaded = BloomFilter.from_bytes(bloom_filter.to_bytes())
+        self.assertTrue(all(swhid in loaded for swhid in swhids[:10000]))
+        false_positives = [swhid for swhid in swhids[10000:]
+                           if swhid in loaded]
+        self.assertLess(len(false_positives), 200)
+        bloom_filter = BloomFilter.for_capacity(1)
+        bloom_filter.add('not a swhid')
+        self.assertIn('not a swhid', bloom_filter)
+        with self.assertRaises(ValueError):
+            BloomFilter.from_bytes(loaded.to_bytes()[:-1])
+
+
+class TestCompactFormat(TestCase):
+
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        os.close(fd)
+
+    def test_package_data(self):
+        data = {
+            'task_id': 'task-1',
+            'source_info': {
+                'source': {'name': 'test-1.0.tar.gz', 'checksum': 'abc'},
+                'swhids': ['swh:1:cnt:2222', 'swh:1:cnt:3333'],
+                'paths': [{'path': 'a/LICENSE', 'file': 'swh:1:cnt:1111'},
+                          {'path': 'b/LICENSE', 'file': 'swh:1:cnt:1111'},
+                          {'path': 'b/main.c', 'file': 'swh:1:cnt:2222'}]
+            }
+        }
+        dump_package_data(data, self.file_path)
+        self.assertEqual(load_data(self.file_path), data)
+
+    def test_scan_result(self):
+        data = {
+            'source_checksum': 'abc',
+            'license_detector': 'scancode 31.2.4',
+            'license_scan': True,
+            'path_with_swhids': [['a/LICENSE', 'swh:1:cnt:1111'],
+                                 ['b/main.c', 'swh:1:cnt:2222']],
+            'licenses': {
+                'data': [['a/LICENSE', 'MIT', 100.0, 1, 20, True, 'mit']],
+                'errors': [],
+                'has_exception': False
+            },
+            'copyright_detector': 'scancode 31.2.4',
+            'copyright_scan': True,
+            'copyrights': {
+                'data': {
+                    'summary_copyrights': ['Copyright Foo'],
+                    'detail_copyrights': {'b/main.c': [{'copyright': 'Foo'}]}
+                },
+                'errors': [],
+                'has_exception': False
+            },
+            'failed_paths': ['b/main.c'],
+        }
+        dump_scan_result(data, self.file_path)
+        loaded = load_data(self.file_path)
+        # Detections are streamed from the file, and could be read again.
+        licenses = loaded['licenses']['data']
+        copyrights = loaded['copyrights']['data']['detail_copyrights']
+        for _ in range(2):
+            self.assertEqual(list(licenses), data['licenses']['data'])
+            self.assertEqual(
+                dict(copyrights.items()),
+                data['copyrights']['data']['detail_copyrights'])
+        loaded['licenses']['data'] = list(licenses)
+        loaded['copyrights']['data']['detail_copyrights'] = dict(
+            copyrights.items())
+        self.assertEqual(loaded, data)
+
+    def test_plain_json(self):
+        with open(self.file_path, 'w', encoding='utf-8') as f:
+            json.dump({'task_id': 'task-1'}, f)
+        self.assertEqual(load_data(self.file_path), {'task_id': 'task-1'})
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+
 class TestComponents(TestCase):
     def setUp(self):
         warnings.simplefilter('ignore', RuntimeWarning)
@@ -785,3 +1605,15 @@ class TestRedisClient(TestCase):
         # Assert get_lock()/release() was called.
         redis_client.get_lock.assert_called_once_with(lock_key, None)
         lock_mock.release.assert_called_once()
+
+    def test_claim_keys(self):
+        redis_client = RedisClient()
+        redis_client.client = mock.MagicMock(spec=Redis)
+        claim_keys_script = redis_client.client.register_script.return_value
+        claim_keys_script.return_value = [1, 0]
+        claimed = redis_client.claim_keys(['key1', 'key2'], 'task-1', 60)
+        self.assertEqual(claimed, [True, False])
+        # All keys are claimed in one atomic script.
+        claim_keys_script.assert_called_once_with(
+            keys=['key1', 'key2'], args=['task-1', 60])
+        self.assertEqual(redis_client.claim_keys([], 'task-1'), [])
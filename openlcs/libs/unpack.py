@@ -1,13 +1,37 @@
+import bz2
+import gzip
+import hashlib
+import lzma
 import os
+import shlex
 import shutil
+import stat
+import struct
+import tarfile
 import tempfile
 import traceback
+import zipfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+import extractcode
+from extractcode import archive as extractcode_archive
 from kobo.shortcuts import run
 from .common import (
     get_mime_type, get_extension,
     run_and_capture,
     search_content_by_patterns
 )
+from .exceptions import UnsupportedPayloadException
+from .swh_tools import READ_BLOCK_SIZE
+from .swh_tools import hash_bytes
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 SUPPORTED_FILE_EXTENSIONS = [
@@ -25,17 +49,430 @@ SP_EXTENSIONS = [
 ]
 
 
+# Archives extracted in-process, others are extracted with atool.
+TAR_EXTENSIONS = [
+        '.tar.gz', '.tgz', '.tar.bz', '.tbz', '.tar.bz2', '.tbz2', '.tar.xz',
+        '.txz', '.tar'
+]
+ZIP_EXTENSIONS = ['.zip', '.jar', '.war']
+COMPRESSED_FILE_OPENERS = {
+        '.gz': gzip.open,
+        '.bz': bz2.open,
+        '.bz2': bz2.open,
+        '.xz': lzma.open,
+        '.lzma': lzma.open,
+}
+EXTRACT_ERRORS = (tarfile.TarError, zipfile.BadZipFile, lzma.LZMAError,
+                  zlib.error, EOFError, OSError, ValueError)
+if zstandard is not None:
+    EXTRACT_ERRORS += (zstandard.ZstdError,)
+
+RPM_LEAD_SIZE = 96
+RPM_LEAD_MAGIC = b'\xed\xab\xee\xdb'
+RPM_HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+# magic, reserved, number of index entries, size of the data store
+RPM_HEADER_INTRO = struct.Struct('>4s4xII')
+# tag, type, offset, count
+RPM_INDEX_ENTRY = struct.Struct('>iiii')
+RPM_STRING_TYPE = 6
+RPMTAG_PAYLOADFORMAT = 1124
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+# New ASCII cpio format, without and with checksum.
+CPIO_MAGICS = (b'070701', b'070702')
+CPIO_HEADER_SIZE = 110
+CPIO_TRAILER = 'TRAILER!!!'
+
+# Files up to below size are buffered in memory to be checked if known,
+# larger files are written as usual.
+KNOWN_FILE_MAX_SIZE = 1024 * 1024
+# Buffered files are checked once their total size exceeds below size.
+KNOWN_BUFFER_SIZE = 64 * 1024 * 1024
+
+
+def decode_error(error):
+    """
+    Get the error message as str, errors captured from commands could be
+    bytes.
+    """
+    if isinstance(error, bytes):
+        return error.decode('utf-8', errors='replace')
+    return str(error)
+
+
+def is_safe_path(dest_dir, path):
+    """
+    Check if the path resolves to a path in dest_dir, also through links
+    already extracted.
+    """
+    target = os.path.realpath(os.path.join(dest_dir, path))
+    return target == dest_dir or target.startswith(dest_dir + os.sep)
+
+
+def is_safe_tar_member(dest_dir, member):
+    if member.isdev() or member.isfifo():
+        return False
+    if not is_safe_path(dest_dir, member.name):
+        return False
+    if member.issym():
+        link_path = os.path.join(os.path.dirname(member.name),
+                                 member.linkname)
+        return not os.path.isabs(member.linkname) and \
+            is_safe_path(dest_dir, link_path)
+    if member.islnk():
+        return is_safe_path(dest_dir, member.linkname)
+    return True
+
+
+def write_content(file_path, data, mode, mtime):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if os.path.lexists(file_path):
+        os.remove(file_path)
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    os.chmod(file_path, (mode & 0o777) | 0o600)
+    os.utime(file_path, (mtime, mtime))
+
+
+class KnownFiles(object):
+    """
+    Skip writing files already known, i.e. scanned before, while extracting
+    archives, only hashes of the files known are recorded.
+
+    Files are hashed while streamed. Files possibly known, i.e. passed by
+    `is_candidate`, are buffered and confirmed in batches by `get_known`,
+    other files are written at once.
+
+    @params: get_known, callable returns the set of the given swhids known.
+    @params: is_candidate, callable checks if a swhid is possibly known,
+    e.g. in the swhid filters, all files are candidates if not given.
+    """
+    def __init__(self, get_known, is_candidate=None,
+                 max_size=KNOWN_FILE_MAX_SIZE, buffer_size=KNOWN_BUFFER_SIZE):
+        self.get_known = get_known
+        self.is_candidate = is_candidate
+        self.max_size = max_size
+        self.buffer_size = buffer_size
+        # Hashes of files skipped, by path relative to the source root.
+        self.skipped = {}
+
+    def accepts(self, name, size):
+        """
+        Check if the file could be skipped, archives are always written to
+        be unpacked.
+        """
+        return size <= self.max_size and \
+            not is_supported_archive(os.path.basename(name))
+
+    def batch(self, dest_dir):
+        return KnownFilesBatch(self, dest_dir)
+
+    def add_skipped(self, batch, prefix=''):
+        """
+        Record files skipped in the batch, with paths under prefix relative
+        to the source root.
+        """
+        self.skipped.update((os.path.join(prefix, path), hashes)
+                            for path, hashes in batch.skipped.items())
+
+
+class KnownFilesBatch(object):
+    """
+    Files extracted into dest_dir to be checked if known, `written` and
+    `skipped` are hashes of files by path relative to dest_dir.
+    """
+    def __init__(self, known_files, dest_dir):
+        self.known_files = known_files
+        self.dest_dir = dest_dir
+        self.items = []
+        self.buffered = 0
+        self.written = {}
+        self.skipped = {}
+
+    def add(self, path, data, mode, mtime):
+        swhid, sha256 = hash_bytes(data)
+        is_candidate = self.known_files.is_candidate
+        if is_candidate is not None and not is_candidate(swhid):
+            write_content(os.path.join(self.dest_dir, path), data, mode,
+                          mtime)
+            self.written[path] = swhid, sha256
+            return
+        self.items.append((path, data, mode, mtime, swhid, sha256))
+        self.buffered += len(data)
+        if self.buffered >= self.known_files.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Check buffered files, and write the files not known.
+        """
+        if not self.items:
+            return
+        known = self.known_files.get_known(
+            list(set(item[4] for item in self.items)))
+        for path, data, mode, mtime, swhid, sha256 in self.items:
+            if swhid in known:
+                self.skipped[path] = swhid, sha256
+            else:
+                write_content(os.path.join(self.dest_dir, path), data, mode,
+                              mtime)
+                self.written[path] = swhid, sha256
+        self.items = []
+        self.buffered = 0
+
+
+def extract_tar(file_path, dest_dir, batch=None):
+    """
+    Extract tar archive member by member, members resolving to paths out
+    of dest_dir, and devices are skipped. Regular files are checked if
+    known with the batch if given.
+    """
+    uid, gid = os.getuid(), os.getgid()
+    with tarfile.open(file_path, 'r:*') as tar:
+        for member in tar:
+            if not is_safe_tar_member(dest_dir, member):
+                continue
+            if batch is not None and member.isreg() and \
+                    batch.known_files.accepts(member.name, member.size):
+                batch.add(os.path.normpath(member.name),
+                          tar.extractfile(member).read(), member.mode,
+                          member.mtime)
+                continue
+            # Keep the extracted files accessible and owned by current user.
+            member.mode |= 0o700 if member.isdir() else 0o600
+            member.uid, member.gid = uid, gid
+            member.uname = member.gname = ''
+            tar.extract(member, dest_dir, set_attrs=not member.isdir())
+
+
+def extract_zip(file_path, dest_dir):
+    with zipfile.ZipFile(file_path) as zf:
+        for info in zf.infolist():
+            if is_safe_path(dest_dir, info.filename):
+                zf.extract(info, dest_dir)
+
+
+def extract_compressed_file(file_path, dest_dir, opener):
+    """
+    Decompress a single compressed file, e.g. foo.txt.gz into foo.txt.
+    """
+    file_name = os.path.splitext(os.path.basename(file_path))[0]
+    with opener(file_path, 'rb') as src, \
+            open(os.path.join(dest_dir, file_name), 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+
+
+def extract_in_process(file_path, dest_dir):
+    """
+    Extract common archive formats in-process, without spawning atool.
+    Returns False if the format isn't extracted in-process.
+    """
+    dest_dir = os.path.realpath(dest_dir)
+    file_name = os.path.basename(file_path)
+    _, file_extension = get_extension(file_name, SP_EXTENSIONS)
+    if file_extension in TAR_EXTENSIONS:
+        extract_tar(file_path, dest_dir)
+    elif file_extension in ZIP_EXTENSIONS:
+        extract_zip(file_path, dest_dir)
+    elif file_extension in COMPRESSED_FILE_OPENERS:
+        extract_compressed_file(file_path, dest_dir,
+                                COMPRESSED_FILE_OPENERS[file_extension])
+    else:
+        return False
+    return True
+
+
+def read_exactly(f, size):
+    data = b''
+    while len(data) < size:
+        block = f.read(size - len(data))
+        if not block:
+            raise EOFError('Unexpected end of archive.')
+        data += block
+    return data
+
+
+def skip_bytes(f, size):
+    while size > 0:
+        size -= len(read_exactly(f, min(size, READ_BLOCK_SIZE)))
+
+
+def read_rpm_header(f, align=False):
+    """
+    Read a rpm header structure, returns its string tags. The signature
+    header is aligned to 8 bytes with padding.
+    """
+    magic, count, size = RPM_HEADER_INTRO.unpack(
+        read_exactly(f, RPM_HEADER_INTRO.size))
+    if magic != RPM_HEADER_MAGIC:
+        raise ValueError('Bad rpm header magic.')
+    index = read_exactly(f, count * RPM_INDEX_ENTRY.size)
+    store = read_exactly(f, size)
+    if align:
+        skip_bytes(f, -size % 8)
+    tags = {}
+    for i in range(count):
+        tag, tag_type, offset, _ = RPM_INDEX_ENTRY.unpack_from(
+            index, i * RPM_INDEX_ENTRY.size)
+        if tag_type == RPM_STRING_TYPE:
+            end = store.index(b'\0', offset)
+            tags[tag] = store[offset:end].decode('utf-8', 'replace')
+    return tags
+
+
+def open_rpm_payload(f):
+    """
+    Skip the rpm lead and headers, returns a stream of the decompressed
+    cpio payload.
+    """
+    try:
+        if read_exactly(f, RPM_LEAD_SIZE)[:4] != RPM_LEAD_MAGIC:
+            raise ValueError('Bad rpm lead magic.')
+        read_rpm_header(f, align=True)
+        tags = read_rpm_header(f)
+    except (EOFError, ValueError) as e:
+        raise UnsupportedPayloadException(e) from None
+    payload_format = tags.get(RPMTAG_PAYLOADFORMAT, 'cpio')
+    if payload_format != 'cpio':
+        raise UnsupportedPayloadException(
+            f'Unsupported payload format {payload_format}.')
+    compressor = tags.get(RPMTAG_PAYLOADCOMPRESSOR, 'gzip')
+    if compressor == 'gzip':
+        return gzip.GzipFile(fileobj=f)
+    elif compressor == 'bzip2':
+        return bz2.BZ2File(f)
+    elif compressor in ('xz', 'lzma'):
+        return lzma.LZMAFile(f)
+    elif compressor == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(f)
+    raise UnsupportedPayloadException(
+        f'Unsupported payload compressor {compressor}.')
+
+
+def write_hashed_file(f, file_path, size):
+    """
+    Write size bytes from stream f into file_path, returns its SWH ID(git
+    blob sha1) and sha256 computed while writing.
+    """
+    sha1 = hashlib.sha1(b'blob %d\0' % size)
+    sha256 = hashlib.sha256()
+    with open(file_path, 'wb') as dst:
+        while size > 0:
+            block = read_exactly(f, min(size, READ_BLOCK_SIZE))
+            sha1.update(block)
+            sha256.update(block)
+            dst.write(block)
+            size -= len(block)
+    return 'swh:1:cnt:' + sha1.hexdigest(), sha256.hexdigest()
+
+
+def extract_cpio(f, dest_dir, batch=None):
+    """
+    Extract a new ASCII cpio stream, entries resolving to paths out of
+    dest_dir, and devices are skipped. Returns a dict of path relative to
+    dest_dir to (swhid, sha256) of extracted regular files. Regular files
+    are checked if known with the batch if given.
+    """
+    hashes = {}
+    # Hard links without data, by inode, the data comes with the last link.
+    links = {}
+    first = True
+    while True:
+        header = read_exactly(f, CPIO_HEADER_SIZE)
+        if header[:6] not in CPIO_MAGICS:
+            # Nothing is extracted yet, e.g. the stripped cpio format of
+            # rpm with large files.
+            if first:
+                raise UnsupportedPayloadException('Unsupported cpio format.')
+            raise ValueError('Bad cpio header magic.')
+        (ino, mode, _, _, nlink, mtime, size, devmajor, devminor, _, _,
+         namesize, _) = [int(header[i:i + 8], 16)
+                         for i in range(6, CPIO_HEADER_SIZE, 8)]
+        name = os.fsdecode(read_exactly(f, namesize).rstrip(b'\0'))
+        skip_bytes(f, -(CPIO_HEADER_SIZE + namesize) % 4)
+        first = False
+        if name == CPIO_TRAILER:
+            break
+        path = os.path.normpath(name.lstrip('/'))
+        abs_path = os.path.join(dest_dir, path)
+        padding = -size % 4
+        if path == '.' or not is_safe_path(dest_dir, path) or not (
+                stat.S_ISREG(mode) or stat.S_ISDIR(mode) or
+                stat.S_ISLNK(mode)):
+            skip_bytes(f, size + padding)
+            continue
+        if stat.S_ISDIR(mode):
+            os.makedirs(abs_path, exist_ok=True)
+            skip_bytes(f, size + padding)
+            continue
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        if os.path.lexists(abs_path):
+            os.remove(abs_path)
+        if stat.S_ISLNK(mode):
+            target = os.fsdecode(read_exactly(f, size))
+            link_path = os.path.join(os.path.dirname(path), target)
+            if not os.path.isabs(target) and \
+                    is_safe_path(dest_dir, link_path):
+                os.symlink(target, abs_path)
+        elif batch is not None and nlink == 1 and \
+                batch.known_files.accepts(path, size):
+            batch.add(path, read_exactly(f, size), mode, mtime)
+        elif nlink > 1 and size == 0:
+            links.setdefault((devmajor, devminor, ino), []).append(path)
+        else:
+            hashes[path] = write_hashed_file(f, abs_path, size)
+            os.chmod(abs_path, (mode & 0o777) | 0o600)
+            os.utime(abs_path, (mtime, mtime))
+            for link in links.pop((devmajor, devminor, ino), []):
+                os.link(abs_path, os.path.join(dest_dir, link))
+                hashes[link] = hashes[path]
+        skip_bytes(f, padding)
+    # Hard links of empty files
+    for paths in links.values():
+        for path in paths:
+            hashes[path] = write_hashed_file(
+                f, os.path.join(dest_dir, path), 0)
+    return hashes
+
+
+def extract_rpm(file_path, dest_dir, batch=None):
+    """
+    Extract the rpm payload in-process, without spawning rpm2cpio and cpio.
+    Files are hashed while written, returns a dict of path relative to
+    dest_dir to (swhid, sha256) of extracted regular files.
+
+    Raises UnsupportedPayloadException before anything is extracted if the
+    payload can't be read in-process.
+    """
+    dest_dir = os.path.realpath(dest_dir)
+    with open(file_path, 'rb') as f:
+        with open_rpm_payload(f) as payload:
+            return extract_cpio(payload, dest_dir, batch)
+
+
+def is_supported_archive(file_name):
+    """
+    Check if the file is an archive that could be unpacked, by extension.
+    """
+    _, file_extension = get_extension(file_name, SP_EXTENSIONS)
+    return file_extension in SUPPORTED_FILE_EXTENSIONS
+
+
 class UnpackArchive(object):
     """
     @params: config, configuration related to unpack function.
     @params: src_file, absolute filepath. e.g., /tmp/foo-1.1-0.rpm
     @params: dest_dir, destination directory to which the unpacked sources
     will be moving to.
+    @params: known_files, KnownFiles to skip writing files known.
     """
-    def __init__(self, config=None, src_file=None, dest_dir=None):
+    def __init__(self, config=None, src_file=None, dest_dir=None,
+                 known_files=None):
         self.config = config
         self.src_file = src_file
         self.dest_dir = dest_dir
+        self.known_files = known_files
+        # Hashes of files extracted in-process, by relative path.
+        self.hashes = None
 
     def _get_archive_type(self):
         """
@@ -45,8 +482,25 @@ class UnpackArchive(object):
 
     def _extract_rpm(self):
         """
-        Extract source rpm into directory src_dir.
+        Extract source rpm into directory src_dir. The payload is extracted
+        in-process and hashed on the way if possible, with rpm2cpio and cpio
+        otherwise.
         """
+        batch = self.known_files.batch(self.dest_dir) \
+            if self.known_files is not None else None
+        try:
+            self.hashes = extract_rpm(self.src_file, self.dest_dir, batch)
+            if batch is not None:
+                batch.flush()
+                self.hashes.update(batch.written)
+                self.known_files.add_skipped(batch)
+            return
+        except UnsupportedPayloadException:
+            pass
+        except EXTRACT_ERRORS as e:
+            err_msg = 'Error while extracting files from %s. Reason: %s' % (
+                    self.src_file, e)
+            raise RuntimeError(err_msg) from None
         cmd = ('rpm2cpio %s | cpio -idm --quiet' % self.src_file)
         try:
             run(cmd, stdout=False, workdir=self.dest_dir)
@@ -94,9 +548,16 @@ class UnpackArchive(object):
         abs_path = os.path.abspath(file_name)
         file_name = os.path.basename(file_name)
         file_path = main_dir or os.path.dirname(abs_path)
-        _, file_extension = get_extension(file_name, SP_EXTENSIONS)
-        if file_extension in SUPPORTED_FILE_EXTENSIONS:
+        if is_supported_archive(file_name):
             tmp_dir = tempfile.mkdtemp(prefix='tmpunpack_', dir=main_dir)
+            try:
+                if extract_in_process(os.path.join(file_path, file_name),
+                                      tmp_dir):
+                    return tmp_dir
+            except EXTRACT_ERRORS:
+                # Try again with atool.
+                shutil.rmtree(tmp_dir)
+                os.mkdir(tmp_dir)
             cmd = ("atool -X '%(tmp_dir)s' -q '%(file_path)s/%(file_name)s' "
                    ">/dev/null" % locals())
             try:
@@ -181,17 +642,136 @@ class UnpackArchive(object):
             shutil.rmtree(src_dir)
         return errors
 
+    def get_unpack_processes(self):
+        """
+        Number of archives unpacked concurrently, archives are unpacked
+        serially unless `UNPACK_PROCESSES` is set explicitly.
+        """
+        processes = self.config.get('UNPACK_PROCESSES') if self.config \
+            else None
+        return processes or 1
+
+    @staticmethod
+    def find_archives(src_dir):
+        """
+        Find archives in src_dir directory that extractcode extracts.
+        """
+        archives = []
+        for root, _, files in os.walk(src_dir):
+            for fn in files:
+                fpath = os.path.join(root, fn)
+                if not os.path.islink(fpath) and \
+                        extractcode_archive.should_extract(
+                            fpath, extractcode.default_kinds):
+                    archives.append(fpath)
+        return archives
+
+    def unpack_tar_skipping_known(self, archive):
+        """
+        Unpack a tar archive in place in-process, without writing files
+        known. Returns False if the archive isn't a tar archive, or fails to
+        be extracted in-process.
+        """
+        _, file_extension = get_extension(
+            os.path.basename(archive), SP_EXTENSIONS)
+        if file_extension not in TAR_EXTENSIONS:
+            return False
+        tmp_dir = os.path.realpath(tempfile.mkdtemp(
+            prefix='tmpunpack_', dir=os.path.dirname(archive)))
+        batch = self.known_files.batch(tmp_dir)
+        try:
+            extract_tar(archive, tmp_dir, batch)
+            batch.flush()
+        except EXTRACT_ERRORS:
+            shutil.rmtree(tmp_dir)
+            return False
+        os.remove(archive)
+        os.rename(tmp_dir, archive)
+        self.known_files.add_skipped(
+            batch, os.path.relpath(archive, self.dest_dir))
+        return True
+
+    def unpack_archive(self, archive):
+        """
+        Unpack an archive shallowly in place, i.e., replace the archive with
+        a directory of its content, the same as extractcode with
+        '--replace-originals'. Falls back to atool if extractcode fails.
+        Returns the errors.
+        """
+        errors = []
+        if self.known_files is not None and \
+                self.unpack_tar_skipping_known(archive):
+            return errors
+        extract_cli = self.config.get(
+            'EXTRACTCODE_CLI', '/bin/extractcode')
+        target = archive + '-extract'
+        cmd = f'{extract_cli} --shallow {shlex.quote(archive)}'
+        try:
+            _, error = run_and_capture(cmd)
+        except Exception:
+            error = "Failed to unpack source archive {} using " \
+                    "extractcode: {}".format(archive, traceback.format_exc())
+        # Skip extracting errors for testing archives
+        if error and '/testdata/' in archive and os.path.isdir(target):
+            errors.append(decode_error(error))
+            error = None
+        if not error and os.path.isdir(target):
+            os.remove(archive)
+            os.rename(target, archive)
+            return errors
+
+        if error:
+            errors.append(decode_error(error))
+        shutil.rmtree(target, ignore_errors=True)
+        try:
+            # Unpacked next to the archive, to be renamed on the same
+            # filesystem.
+            tmp = self.unpack_file(archive, main_dir=os.path.dirname(archive))
+            if tmp:
+                # Delete the archive file after unpack
+                os.remove(archive)
+                os.rename(tmp, archive)
+        except ValueError as e:
+            errors.append(str(e))
+        return errors
+
+    def unpack_archives_parallel(self, src_dir):
+        """
+        Unpack the source archives in src_dir directory recursively, archives
+        are unpacked concurrently in a bounded number of processes, and
+        nested archives are queued once their parents are unpacked.
+        """
+        errors = []
+        processes = self.get_unpack_processes()
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            pending = {executor.submit(self.unpack_archive, archive): archive
+                       for archive in self.find_archives(src_dir)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    archive = pending.pop(future)
+                    errors.extend(map(decode_error, future.result()))
+                    if os.path.isdir(archive):
+                        for nested in self.find_archives(archive):
+                            future = executor.submit(
+                                self.unpack_archive, nested)
+                            pending[future] = nested
+        return errors
+
     def unpack_archives(self, src_dir=None):
         """
         Unpack the source archives in src_dir directory.
         """
         errors = []
         src_dir = self.dest_dir if src_dir is None else src_dir
+        # Archives are unpacked one by one to skip writing known files.
+        if self.get_unpack_processes() > 1 or self.known_files is not None:
+            return self.unpack_archives_parallel(src_dir)
         raw_src_list = os.listdir(src_dir)
         raw_error = self.unpack_archives_using_extractcode(src_dir)
         if raw_error:
             if isinstance(raw_error, bytes):
-                error = raw_error.decode('utf-8')
+                error = decode_error(raw_error)
                 errors.append(error)
                 # Skip extracting errors for testing archives
                 extract_errors = [
@@ -210,7 +790,7 @@ class UnpackArchive(object):
                         os.rename(path, target)
                     return errors
             else:
-                errors.append(raw_error)
+                errors.append(decode_error(raw_error))
             for fn in os.listdir(src_dir):
                 if fn not in raw_src_list:
                     fpath = os.path.join(src_dir, fn)
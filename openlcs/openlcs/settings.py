@@ -184,6 +184,11 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': timedelta(days=2),
         'kwargs': {'provenance': 'sync_corgi', 'retry': True}
     },
+    'publish_swhid_filters': {
+        'task': 'openlcsd.flow.periodic_tasks.publish_swhid_filters',
+        'schedule': crontab(minute=30),
+        'kwargs': {'provenance': 'sync_corgi'}
+    },
     'publish_confluence': {
         'task': 'openlcsd.flow.periodic_tasks.publish_confluence',
         'schedule': crontab(minute=0, hour=2),
@@ -200,8 +205,16 @@ CELERY_BROKER_TRANSPORT_OPTIONS = {
 }
 
 # Scancode settings
+# Scanner backend, 'scancode' runs the scancode cli for each scan with
+# `--processes` sized by SCANCODE_PROCESSES, 'scancode_api' scans in-process
+# one file at a time, with the license index loaded on the first scan in
+# the worker process.
+SCANNER = 'scancode'
 SCANCODE_LICENSE_SCORE = 90
 SCANCODE_PROCESSES = 1
+# Scancode processes are sized from the number of files to scan, one process
+# per below number of files, bounded by the cpus shared by running tasks.
+SCANCODE_FILES_PER_PROCESS = 1000
 SCANCODE_TIMEOUT = 300
 SCANCODE_CLI = '/opt/app-root/bin/scancode'
 SCANCODE_UNKNOWN_LICENSES = [
@@ -211,6 +224,87 @@ SCANCODE_UNKNOWN_LICENSES = [
     'unknown-spdx'
 ]
 EXTRACTCODE_CLI = '/opt/app-root/bin/extractcode'
+# Scan only one file per unique content(swhid) in the source
+SCAN_STAGING_ENABLED = True
+# Sources with more files than below are scanned in shards across tasks,
+# one shard per below number of files. Set to 0 to disable.
+SCAN_SHARD_THRESHOLD = 50000
+# Shard tasks not finished within below seconds are treated as lost, the
+# parent task fails instead of waiting forever.
+SCAN_SHARD_TIMEOUT = 24 * 60 * 60
+# Files being scanned are claimed by a task, other tasks wait at most below
+# seconds to reuse the results, then scan them themselves. Set to 0 to
+# disable.
+SCAN_CLAIM_TIMEOUT = 6 * 60 * 60
+# Swhids of a source are checked for duplicate files in chunks of below
+# size, with at most below number of concurrent requests.
+DEDUPLICATE_CHUNK_SIZE = 10000
+DEDUPLICATE_CONCURRENCY = 4
+# Nested archives of sources already fully scanned are not unpacked, paths
+# of the scanned sources are reused instead.
+NESTED_ARCHIVE_SPLICE_ENABLED = True
+# Directories with all files scanned are skipped as a whole, paths of them
+# are materialized by reference.
+DIRECTORY_DEDUP_ENABLED = True
+# Check with hub only swhids possibly in the published swhid filters.
+SWHID_FILTER_ENABLED = True
+# Files already scanned are hashed while extracted and never written to
+# disk, only rpm payloads and tar archives are extracted in this way.
+SKIP_KNOWN_FILES_ENABLED = True
+# Number of archives unpacked concurrently, archives are unpacked serially
+# with extractcode if not set or 1.
+UNPACK_PROCESSES = 1
+# Sources are unpacked and scanned on faster worker-local storage if the
+# expected unpacked size, i.e. the source size multiplied by the ratio,
+# fits into the tier, tiers are tried in order, e.g.:
+# [{'path': '/dev/shm/openlcs', 'max_size': 512 * 1024 * 1024},
+#  {'path': '/var/tmp/openlcs', 'max_size': 20 * 1024 * 1024 * 1024}]
+# Sources fit into no tier are placed under SRC_ROOT_DIR or TMP_ROOT_DIR.
+SCRATCH_TIERS = []
+SCRATCH_SIZE_RATIO = 4
+# Hashes of at most below number of files are cached on each worker node,
+# so that files shared by tasks are read once. Set to 0 to disable.
+HASH_CACHE_MAX_ENTRIES = 2000000
+# Directory of the hash cache, it must be on worker-local disk rather than
+# shared storage like TMP_ROOT_DIR, since sqlite WAL mode needs local disk.
+HASH_CACHE_DIR = '/var/tmp/openlcs'
+# Sources are scanned in resumable batches of below number of files.
+SCAN_BATCH_SIZE = 10000
+# Files excluded from scanning, paths of them are still recorded.
+# Files larger than below size in bytes
+SCAN_MAX_FILE_SIZE = 50 * 1024 * 1024
+# Mime types, type ends with '/' matches all its subtypes
+SCAN_SKIP_MIME_TYPES = [
+    # Not all 'image/', svg is text which may have copyright notices.
+    'image/png',
+    'image/jpeg',
+    'image/gif',
+    'image/bmp',
+    'image/tiff',
+    'image/webp',
+    'image/x-icon',
+    'image/vnd.microsoft.icon',
+    'audio/',
+    'video/',
+    'font/',
+    'application/x-executable',
+    'application/x-sharedlib',
+    'application/x-object',
+    'application/x-sqlite3',
+    'application/vnd.ms-fontobject',
+]
+# Path patterns matched against the relative path in source
+SCAN_SKIP_PATH_PATTERNS = [
+    '*.min.js',
+    '*.min.css',
+    '*.js.map',
+    '*.css.map',
+    '*.pyc',
+    '*.class',
+    '*.o',
+    '*.so',
+    '*.a',
+]
 
 # Brew/Koji settings
 KOJI_DOWNLOAD = os.getenv(
@@ -278,6 +372,9 @@ TMP_ROOT_DIR = os.path.join(SRC_ROOT_DIR, 'tmp')
 POST_DIR = os.path.join(SRC_ROOT_DIR, 'post')
 # The root directory for remote source package source tarball import
 RS_SRC_ROOT_DIR = os.path.join(SRC_ROOT_DIR, 'remote_source')
+# Bloom filters of swhids in the database published to workers.
+SWHID_FILTER_DIR = os.path.join(SRC_ROOT_DIR, 'swhid_filter')
+SWHID_FILTER_ERROR_RATE = 0.01
 
 LOGGER_DIR = '/var/log/openlcs/'
 
@@ -87,6 +87,15 @@ urlpatterns = [
     path(f'{DRF_ROOT}/check_duplicate_files/',
          package_views.CheckDuplicateFiles.as_view(),
          name='check_duplicate_files'),
+    path(f'{DRF_ROOT}/swhid_filters/',
+         package_views.SwhidFilterView.as_view(),
+         name='swhid_filters'),
+    path(f'{DRF_ROOT}/check_duplicate_directories/',
+         package_views.CheckDuplicateDirectories.as_view(),
+         name='check_duplicate_directories'),
+    path(f'{DRF_ROOT}/scanned_source_paths/',
+         package_views.GetScannedSourcePaths.as_view(),
+         name='scanned_source_paths'),
     path(f'{DRF_ROOT}/check_source_status/',
          package_views.CheckSourceStatus.as_view(),
          name='check_source_status'),
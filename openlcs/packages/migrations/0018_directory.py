@@ -0,0 +1,24 @@
+# Generated by Django 3.2.24 on 2026-10-17 05:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packages', '0017_missingcomponent_retry_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Directory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('swhid', models.CharField(help_text='SoftWare Heritage persistent IDentifier of directory', max_length=50, unique=True, verbose_name='SWH ID')),
+                ('path', models.TextField(help_text='Directory path within source package')),
+                ('scan_flag', models.TextField(blank=True, help_text='A comma separated "scan_type(detector)" of its files', null=True)),
+                ('source', models.ForeignKey(help_text='Reference to source package with the directory', on_delete=django.db.models.deletion.CASCADE, related_name='directories', to='packages.source')),
+            ],
+        ),
+    ]
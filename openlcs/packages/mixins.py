@@ -1,11 +1,16 @@
+import logging
+import os
+import threading
 import time
 
 from django.conf import settings
+from django.db import connection
 from django.db import transaction
 from django.db.models import Q
 from django.db.utils import IntegrityError
 
 from packages.models import (
+    Directory,
     File,
     Source
 )
@@ -15,6 +20,10 @@ from reports.models import (
     FileLicenseScan,
     LicenseDetection
 )
+from libs.bloom import BloomFilter
+from libs.bloom import get_swhid_filter_name
+
+logger = logging.getLogger(__name__)
 
 
 class SaveScanResultMixin:
@@ -33,13 +42,12 @@ class SaveScanResultMixin:
             self.file_license_scan_dict.update(new_file_license_scan_dict)
 
     def save_license_detections(self, path_file_dict, data, license_detector):
-        licenses = [
+        # Detections are created in batches as they're read from data.
+        licenses = (
             [self.file_license_scan_dict.get(path_file_dict.get(x[0]))] + x[1:]
-            for x in data]
-        if licenses:
-            # Query license detection that need to be created.
-            LicenseDetection.bulk_create_objects(
-                    licenses, batch_size=settings.BULK_CREATE_BATCH_SIZE)
+            for x in data)
+        LicenseDetection.bulk_create_objects(
+                licenses, batch_size=settings.BULK_CREATE_BATCH_SIZE)
 
     def update_scan_flag(self, source, scan_type, detector):
         scan_flag = source.scan_flag
@@ -68,7 +76,7 @@ class SaveScanResultMixin:
             self, path_file_dict, data, copyright_detector):
         # TODO: Schema needs an update for summary copyrights
         raw_data = data.get('detail_copyrights')
-        copyrights = dict(
+        copyrights = (
             (self.file_copyright_scan_dict.get(path_file_dict.get(k)), v) for
             (k, v) in raw_data.items())
 
@@ -82,8 +90,14 @@ class SaveScanResultMixin:
             swhid__in=swhids).values_list('swhid', 'id'))
         file_ids = [swhid_file_dict.get(swhid) for swhid in swhids]
         path_file_dict = dict(zip(paths, file_ids))
+        # Files failed to scan are left unscanned, so that they could be
+        # scanned again in other sources.
+        failed_file_ids = set(path_file_dict.get(path)
+                              for path in kwargs.pop('failed_paths', []))
         source_checksum = kwargs.pop('source_checksum')
         source = Source.objects.get(checksum=source_checksum)
+        # Directories without files failed to scan.
+        directories = kwargs.pop('directories', None)
 
         if kwargs.get('license_scan'):
             licenses = kwargs.pop('licenses')
@@ -101,7 +115,8 @@ class SaveScanResultMixin:
                                 *filters).values_list('file_id', 'id'))
                         license_file_ids = self.file_license_scan_dict.keys()
                         new_file_ids = list(
-                            set(file_ids).difference(license_file_ids))
+                            set(file_ids).difference(license_file_ids,
+                                                     failed_file_ids))
 
                         with transaction.atomic():
                             # Exist same files in different paths.
@@ -139,7 +154,8 @@ class SaveScanResultMixin:
                         copyright_file_ids = \
                             self.file_copyright_scan_dict.keys()
                         new_file_ids = list(
-                            set(file_ids).difference(copyright_file_ids))
+                            set(file_ids).difference(copyright_file_ids,
+                                                     failed_file_ids))
 
                         with transaction.atomic():
                             self.save_file_copyright_scan(
@@ -157,3 +173,68 @@ class SaveScanResultMixin:
                         else:
                             time.sleep(1 << i)
                             continue
+
+        if directories:
+            Directory.register_directories(source, directories)
+
+
+class SwhidFilterMixin:
+    """
+    Build bloom filters of swhids in the database, i.e., of all files, and
+    of files license or copyright scanned per detector.
+    """
+    filter_models = {
+        'license': FileLicenseScan,
+        'copyright': FileCopyrightScan,
+    }
+    # Filters are rebuilt by one background thread at a time in a process.
+    build_lock = threading.Lock()
+
+    @staticmethod
+    def get_swhid_filter_path(kind, detector=None):
+        return os.path.join(settings.SWHID_FILTER_DIR,
+                            get_swhid_filter_name(kind, detector))
+
+    @staticmethod
+    def build_swhid_filter(queryset, file_path):
+        bloom_filter = BloomFilter.for_capacity(
+            queryset.count(), settings.SWHID_FILTER_ERROR_RATE)
+        bloom_filter.update(queryset.iterator(
+            chunk_size=settings.BULK_CREATE_BATCH_SIZE))
+        bloom_filter.dump(file_path)
+
+    def build_swhid_filters(self):
+        os.makedirs(settings.SWHID_FILTER_DIR, exist_ok=True)
+        self.build_swhid_filter(
+            File.objects.values_list('swhid', flat=True),
+            self.get_swhid_filter_path('file'))
+        for kind, model in self.filter_models.items():
+            detectors = model.objects.values_list(
+                'detector', flat=True).distinct()
+            for detector in detectors:
+                queryset = model.objects.filter(
+                    detector=detector).values_list('file__swhid', flat=True)
+                self.build_swhid_filter(
+                    queryset, self.get_swhid_filter_path(kind, detector))
+
+    def start_building_swhid_filters(self):
+        """
+        Rebuild the filters in a background thread, so that requests are
+        not blocked while the tables are iterated. Returns False if the
+        filters are being rebuilt already.
+        """
+        if not self.build_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self.build_swhid_filters_locked,
+                         daemon=True).start()
+        return True
+
+    def build_swhid_filters_locked(self):
+        try:
+            self.build_swhid_filters()
+        except Exception:
+            logger.exception('Failed to build swhid filters.')
+        finally:
+            # Database connection of the thread isn't closed by django.
+            connection.close()
+            self.build_lock.release()
@@ -1,3 +1,5 @@
+from itertools import islice
+
 from django.db import models
 from django.db.models import Q
 from django.conf import settings
@@ -142,6 +144,96 @@ class Path(models.Model):
         return f'{self.source}, {self.path}'
 
 
+class Directory(models.Model):
+    """
+    Directories with all files scanned, by the SWH ID of the directory,
+    i.e., the hash of the git tree of its files. Paths of a directory are
+    materialized in other sources by reference to the first source and
+    path where it's seen.
+    """
+    swhid = models.CharField(
+        max_length=50,
+        verbose_name="SWH ID",
+        help_text='SoftWare Heritage persistent IDentifier of directory',
+        unique=True
+    )
+    source = models.ForeignKey(
+        Source,
+        on_delete=models.CASCADE,
+        related_name="directories",
+        help_text='Reference to source package with the directory'
+    )
+    path = models.TextField(
+        help_text='Directory path within source package'
+    )
+    scan_flag = models.TextField(
+        null=True, blank=True,
+        help_text='A comma separated "scan_type(detector)" of its files'
+    )
+
+    class Meta:
+        app_label = 'packages'
+
+    def __str__(self):
+        return self.swhid
+
+    def is_scanned(self, scan_flags):
+        return set(scan_flags).issubset((self.scan_flag or '').split(','))
+
+    @classmethod
+    def register_directories(cls, source, directories):
+        """
+        Register directories of the source with all files scanned, as a
+        dict of path to SWH ID. Directories registered with less scans are
+        moved to reference the source.
+        """
+        scan_flags = set((source.scan_flag or '').split(','))
+        existing = {d.swhid: d for d in cls.objects.filter(
+            swhid__in=set(directories.values()))}
+        new_dirs = {}
+        for path, swhid in sorted(directories.items()):
+            if swhid in existing:
+                directory = existing[swhid]
+                if not directory.is_scanned(scan_flags):
+                    cls.objects.filter(pk=directory.pk).update(
+                        source=source, path=path,
+                        scan_flag=source.scan_flag)
+            elif swhid not in new_dirs:
+                new_dirs[swhid] = cls(swhid=swhid, source=source, path=path,
+                                      scan_flag=source.scan_flag)
+        cls.objects.bulk_create(
+            new_dirs.values(), batch_size=settings.BULK_CREATE_BATCH_SIZE,
+            ignore_conflicts=True)
+
+    @classmethod
+    def materialize_paths(cls, source, directories,
+                          batch_size=settings.BULK_CREATE_BATCH_SIZE):
+        """
+        Create paths of the source under the directories, by copying paths
+        of the referenced directories. Directories no longer registered,
+        e.g. removed together with their sources, are skipped.
+        """
+        referenced = {d.swhid: d for d in cls.objects.filter(
+            swhid__in=set(item.get('directory') for item in directories))}
+        for item in directories:
+            directory = referenced.get(item.get('directory'))
+            if directory is None:
+                continue
+            prefix = directory.path + '/'
+            ref_paths = Path.objects.filter(
+                source_id=directory.source_id,
+                path__startswith=prefix).values_list('file_id', 'path')
+            path_objs = (
+                Path(source=source, file_id=file_id,
+                     path=item.get('path') + '/' + path[len(prefix):])
+                for file_id, path in ref_paths.iterator())
+            while True:
+                batch = list(islice(path_objs, batch_size))
+                if not batch:
+                    break
+                Path.objects.bulk_create(batch, batch_size=batch_size)
+
+
 class CorgiComponentMixin(models.Model):
     """Model mixin for corgi component attributes
 
@@ -4,20 +4,23 @@ import time
 from distutils.util import strtobool
 import django_filters
 from django.conf import settings
-from django.db import IntegrityError, transaction
-from django.db.models import Q
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
 from django.http.request import QueryDict
 from django_celery_beat.models import (
     PeriodicTask,
     CrontabSchedule
 )
+from libs.compact import load_data
 from libs.encrypt_decrypt import encrypt_with_secret_key
 from libs.parsers import parse_manifest_file
 from libs.exceptions import ParamsErrorException
 from packages.mixins import SaveScanResultMixin
+from packages.mixins import SwhidFilterMixin
 from packages.models import (
     Component,
     ComponentSubscription,
+    Directory,
     MissingComponent,
     File,
     Path,
@@ -513,6 +516,13 @@ class PackageImportTransactionView(APIView):
                     "path":"/test6"
                 }
             ],
+            "directories":[
+                {
+                    "directory": \
+"swh:1:dir:c373af6881933e20bb92349f8d27a0939f7291de",
+                    "path":"vendor/foo"
+                }
+            ],
             "component":{
                 "name":"jquery",
                 "version":"3.5.1",
@@ -529,8 +539,7 @@ class PackageImportTransactionView(APIView):
     def post(self, request, *args, **kwargs):
         try:
             file_path = request.data.get("file_path")
-            with open(file_path, encoding='utf-8') as f:
-                data = json.load(f)
+            data = load_data(file_path)
         except Exception as err:
             return Response(
                 data={'message': err.args}, status=status.HTTP_400_BAD_REQUEST
@@ -541,6 +550,7 @@ class PackageImportTransactionView(APIView):
         swhids = source_info.get('swhids')
         source = source_info.get('source')
         paths = source_info.get('paths')
+        directories = source_info.get('directories')
         component = source_info.get('component')
         product_release = source_info.get('product_release')
         if not any([swhids, source, paths, component]):
@@ -582,6 +592,9 @@ class PackageImportTransactionView(APIView):
                                 batch_size=settings.BULK_CREATE_BATCH_SIZE)
                         if paths:
                             Path.bulk_create_objects(source_obj, paths)
+                        if directories:
+                            Directory.materialize_paths(
+                                source_obj, directories)
                         if component:
                             component_obj = Component.\
                                 update_or_create_component(component)
@@ -623,8 +636,7 @@ class SaveScanResultView(APIView, SaveScanResultMixin):
     def post(self, request, *args, **kwargs):
         try:
             file_path = request.data.get("file_path")
-            with open(file_path, encoding='utf-8') as f:
-                data = json.load(f)
+            data = load_data(file_path)
         except Exception as e:
             return Response(
                 data={'message': e.args},
@@ -645,48 +657,141 @@ class CheckDuplicateFiles(APIView):
     Check duplicate files, so that we can skip scan step for these files.
     Duplicate files is files that exist in the database, and
     license/copyright should be scanned if needed.
+
+    Workers post swhids of a source in chunks, each chunk is answered on
+    its own, swhids are joined as an array instead of in `IN` lists.
     """
+    @staticmethod
+    def get_duplicate_swhids(swhids, detector, license_scan,
+                             copyright_scan):
+        file_table = File._meta.db_table
+        sql = (f'SELECT DISTINCT f.swhid FROM unnest(%s::varchar[]) '
+               f'AS s(swhid) JOIN {file_table} f ON f.swhid = s.swhid')
+        params = [list(swhids)]
+        conditions = []
+        for scan_required, model in [(license_scan, FileLicenseScan),
+                                     (copyright_scan, FileCopyrightScan)]:
+            if scan_required:
+                conditions.append(
+                    f'EXISTS (SELECT 1 FROM {model._meta.db_table} sc '
+                    f'WHERE sc.file_id = f.id AND sc.detector = %s)')
+                params.append(detector)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
     def post(self, request, *args, **kwargs):
         swhids = request.data.get('swhids')
         license_scan = request.data.get('license_scan')
         copyright_scan = request.data.get('copyright_scan')
         detector = request.data.get('detector')
-        existing_swhids = []
-        license_swhids = []
-        copyright_swhids = []
-
+        duplicate_swhids = []
         if swhids:
-            existing_swhids = File.objects.in_bulk(id_list=list(swhids),
-                                                   field_name='swhid').keys()
-        if not existing_swhids:
-            return Response(data={"duplicate_swhids": existing_swhids})
-
-        # Duplicate files that license scanned.
-        if license_scan:
-            license_swhids = FileLicenseScan.objects.filter(
-                Q(file__swhid__in=existing_swhids,
-                  detector=detector)).values_list('file__swhid', flat=True)
-        # Duplicate files that copyright scanned.
-        if copyright_scan:
-            copyright_swhids = FileCopyrightScan.objects.filter(
-                Q(file__swhid__in=existing_swhids,
-                    detector=detector)).values_list('file__swhid', flat=True)
-        # Deduplicate files.
-        if license_scan and copyright_scan:
-            duplicate_swhids = list(
-                set(existing_swhids).intersection(license_swhids,
-                                                  copyright_swhids))
-        elif license_scan:
-            duplicate_swhids = list(
-                set(existing_swhids).intersection(license_swhids))
-        elif copyright_scan:
-            duplicate_swhids = list(
-                set(existing_swhids).intersection(copyright_swhids))
+            duplicate_swhids = self.get_duplicate_swhids(
+                swhids, detector, license_scan, copyright_scan)
+        return Response(data={"duplicate_swhids": duplicate_swhids})
+
+
+class SwhidFilterView(APIView, SwhidFilterMixin):
+    """
+    Bloom filters of swhids in the database, workers check with hub only
+    the swhids possibly in the filters for duplicate files.
+
+    get: Get the filter of `kind`, which is one of 'file', 'license' and
+    'copyright', scan filters are per `detector`. Filter is not returned if
+    it matches the ETag in `If-None-Match` header.
+    post: Start rebuilding all the filters in the background.
+    """
+    def get(self, request, *args, **kwargs):
+        kind = request.query_params.get('kind', 'file')
+        detector = request.query_params.get('detector')
+        if kind != 'file' and (kind not in self.filter_models or
+                               not detector):
+            return Response(
+                data={'message': 'Invalid filter kind or detector.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        file_path = self.get_swhid_filter_path(kind, detector)
+        try:
+            with open(file_path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+                if request.headers.get('If-None-Match') == etag:
+                    response = HttpResponse(
+                        status=status.HTTP_304_NOT_MODIFIED)
+                else:
+                    response = HttpResponse(
+                        f.read(), content_type='application/octet-stream')
+        except FileNotFoundError:
+            return Response(data={'message': 'Filter not found.'},
+                            status=status.HTTP_404_NOT_FOUND)
+        response['ETag'] = etag
+        return response
+
+    def post(self, request, *args, **kwargs):
+        if self.start_building_swhid_filters():
+            message = 'Filters rebuild started.'
         else:
-            duplicate_swhids = existing_swhids
+            message = 'Filters are being rebuilt already.'
+        return Response(data={'message': message},
+                        status=status.HTTP_202_ACCEPTED)
+
+
+class CheckDuplicateDirectories(APIView):
+    """
+    Check directories with all files scanned as required, so that workers
+    skip them as a whole, paths of them are materialized by reference.
+    """
+    def post(self, request, *args, **kwargs):
+        swhids = request.data.get('swhids')
+        detector = request.data.get('detector')
+        scan_flags = []
+        if request.data.get('license_scan'):
+            scan_flags.append(f'license({detector})')
+        if request.data.get('copyright_scan'):
+            scan_flags.append(f'copyright({detector})')
+        duplicate_swhids = []
+        if swhids:
+            duplicate_swhids = [
+                directory.swhid for directory in Directory.objects.filter(
+                    swhid__in=swhids).only('swhid', 'scan_flag')
+                if directory.is_scanned(scan_flags)]
         return Response(data={"duplicate_swhids": duplicate_swhids})
 
 
+class GetScannedSourcePaths(APIView):
+    """
+    Get paths of a source fully scanned, i.e., the source is scanned as
+    required and all its files have the required scans by the detector.
+    Workers splice the paths in place of a nested archive with the same
+    checksum, instead of unpacking and scanning it again.
+    """
+    def post(self, request, *args, **kwargs):
+        checksum = request.data.get('checksum')
+        detector = request.data.get('detector')
+        license_scan = request.data.get('license_scan')
+        copyright_scan = request.data.get('copyright_scan')
+        not_found = Response(data={"source_name": None, "paths": None})
+        source = Source.objects.filter(checksum=checksum).first()
+        if source is None:
+            return not_found
+        scan_flag = source.scan_flag or ''
+        file_paths = source.file_paths.all()
+        for scan_required, scan_type, related_name in [
+                (license_scan, 'license', 'license_scans'),
+                (copyright_scan, 'copyright', 'copyright_scans')]:
+            if not scan_required:
+                continue
+            if f'{scan_type}({detector})' not in scan_flag:
+                return not_found
+            if file_paths.exclude(**{
+                    f'file__{related_name}__detector': detector}).exists():
+                return not_found
+        paths = list(file_paths.values_list('path', 'file__swhid'))
+        return Response(data={"source_name": source.name, "paths": paths})
+
+
 class CheckSourceStatus(APIView):
     """
     Check the source existance and scanning flag.
@@ -187,24 +187,28 @@ class CopyrightDetection(models.Model):
     )
 
     @classmethod
-    def bulk_create_objs(cls,  copyrights):
-        # Query copyrights detection that need to be created.
-        objs = []
-        for k, v in copyrights.items():
-            k_objs = [
+    def bulk_create_objs(cls, copyrights,
+                         batch_size=settings.BULK_CREATE_BATCH_SIZE):
+        """
+        Create copyright detections in batches from pairs of file scan id
+        and its copyright statements.
+        """
+        objs = (
                 CopyrightDetection(
                     file_scan_id=k,
                     statement=statement["copyright"],
                     start_line=statement["start_line"],
                     end_line=statement["end_line"]
-                ) for statement in v
-            ]
-            objs.extend(k_objs)
+                ) for k, v in copyrights for statement in v
+            )
         # existing_objs = CopyrightDetection.objects.all()
         # new_objs = [obj for obj in objs if obj not in existing_objs]
-        CopyrightDetection.objects.bulk_create(
-            objs, ignore_conflicts=True,
-            batch_size=settings.BULK_CREATE_BATCH_SIZE)
+        while True:
+            batch = list(islice(objs, batch_size))
+            if not batch:
+                break
+            CopyrightDetection.objects.bulk_create(
+                batch, ignore_conflicts=True, batch_size=batch_size)
 
     class Meta:
         app_label = 'reports'
@@ -22,12 +22,33 @@ class ObtainConfigView(generics.RetrieveAPIView):
             'KOJI_DOWNLOAD',
             'KOJI_WEBSERVICE',
             'KOJI_WEBURL',
+            'SCANNER',
             'SCANCODE_CLI',
             'SCANCODE_LICENSE_SCORE',
             'SCANCODE_TIMEOUT',
             'SCANCODE_PROCESSES',
+            'SCANCODE_FILES_PER_PROCESS',
             'SCANCODE_UNKNOWN_LICENSES',
             'EXTRACTCODE_CLI',
+            'SCAN_STAGING_ENABLED',
+            'SCAN_SHARD_THRESHOLD',
+            'SCAN_SHARD_TIMEOUT',
+            'SCAN_BATCH_SIZE',
+            'SCAN_CLAIM_TIMEOUT',
+            'SCAN_MAX_FILE_SIZE',
+            'SCAN_SKIP_MIME_TYPES',
+            'SCAN_SKIP_PATH_PATTERNS',
+            'HASH_CACHE_MAX_ENTRIES',
+            'HASH_CACHE_DIR',
+            'DEDUPLICATE_CHUNK_SIZE',
+            'DEDUPLICATE_CONCURRENCY',
+            'SWHID_FILTER_ENABLED',
+            'SKIP_KNOWN_FILES_ENABLED',
+            'UNPACK_PROCESSES',
+            'SCRATCH_TIERS',
+            'SCRATCH_SIZE_RATIO',
+            'NESTED_ARCHIVE_SPLICE_ENABLED',
+            'DIRECTORY_DEDUP_ENABLED',
             'LICENSE_DIR',
             'LOGGER_DIR',
             'RETRY_DIR',
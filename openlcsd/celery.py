@@ -1,10 +1,15 @@
+import socket
+
 from celery import Celery
 from celery import signals
 from celery.signals import celeryd_init
+from celery.signals import task_postrun
+from celery.signals import task_prerun
 from celery.signals import worker_process_shutdown
 from redis import Redis
 
 from openlcs.libs.constants import TASK_IDENTITY_PREFIX
+from openlcs.libs.redis import RedisClient
 
 from . import celeryconfig
 
@@ -37,6 +42,18 @@ def remove_stale_redis_locks():
 @celeryd_init.connect
 def on_celeryd_init(sender, **kwargs):
     enable_signals()
+    # Tasks running on the node before restarting are all gone.
+    RedisClient().reset_running_tasks(socket.gethostname())
+
+
+@task_prerun.connect
+def on_task_prerun(sender, **kwargs):
+    RedisClient().update_running_tasks(socket.gethostname())
+
+
+@task_postrun.connect
+def on_task_postrun(sender, **kwargs):
+    RedisClient().update_running_tasks(socket.gethostname(), -1)
 
 
 @worker_process_shutdown.connect
@@ -29,3 +29,9 @@ def retry(self, **kwargs):
 def clean_unused_shared_remote_source(self, **kwargs):
     flow = "flow.tasks.flow_clean_unused_shared_remote_source"
     app.send_task(flow, [kwargs], **generate_priority_kwargs("low"))
+
+
+@app.task(bind=True)
+def publish_swhid_filters(self, **kwargs):
+    flow = "flow.tasks.flow_publish_swhid_filters"
+    app.send_task(flow, [kwargs], **generate_priority_kwargs("low"))
@@ -43,6 +43,21 @@ class WorkflowWrapperTask(celery.Task):
                 if tmp_src_filepath and os.path.exists(tmp_src_filepath):
                     delete(tmp_src_filepath)
 
+            scan_dir = args[0].get('scan_dir')
+            if scan_dir and os.path.exists(scan_dir):
+                delete(scan_dir)
+            for shard_dir in args[0].get('shard_dirs', []):
+                if os.path.exists(shard_dir):
+                    delete(shard_dir)
+            deferred_dir = args[0].get('deferred_dir')
+            if deferred_dir and os.path.exists(deferred_dir):
+                delete(deferred_dir)
+            # Files are either saved or failed to scan by now, release them
+            # for other tasks.
+            scan_claim_keys = args[0].get('scan_claim_keys')
+            if scan_claim_keys:
+                RedisClient().release_keys(scan_claim_keys, task_id)
+
             if args[0].get('shared_remote_source_dir') is not None:
                 delete(args[0]['shared_remote_source_dir'])
 
@@ -1,14 +1,21 @@
+import fnmatch
 import glob
+import hashlib
+import heapq
 import json
 import os
 import shutil
 import socket
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
+from itertools import chain
 from requests.exceptions import HTTPError
+from requests.exceptions import RequestException
 from pyrpm.spec import Spec
 
-from checksumdir import dirhash
+from celery import states
 from commoncode.fileutils import delete
 from workflow.patterns.controlflow import IF
 from workflow.patterns.controlflow import IF_ELSE
@@ -19,9 +26,16 @@ from packagedcode.maven import MavenPomXmlHandler
 from pathlib import Path
 
 from openlcsd.celery import app
+from openlcsd.celeryconfig import task_time_limit
 from openlcsd.flow.task_wrapper import WorkflowWrapperTask
+from openlcs.libs.bloom import BloomFilter
+from openlcs.libs.bloom import get_swhid_filter_name
+from openlcs.libs.celery_helper import generate_priority_kwargs
+from openlcs.libs.compact import dump_package_data
+from openlcs.libs.compact import dump_scan_result
 from openlcs.libs.common import (
     get_component_name_version_combination,
+    get_mime_type,
     get_nvr_list_from_components,
     get_extension,
     remove_duplicates_from_list_by_key,
@@ -36,7 +50,13 @@ from openlcs.libs.common import (
 from openlcs.libs.constants import (
     EXTENDED_REQUEST_TIMEOUT,
     PARENT_COMPONENT_TYPES,
-    RS_TYPES
+    RS_TYPES,
+    SCAN_CLAIM_POLL_INTERVAL,
+    SCAN_CLAIM_PREFIX,
+    SCAN_SHARD_CONFIG_KEYS,
+    SCAN_SHARD_POLL_INTERVAL,
+    SCAN_SHARD_PREFIX,
+    SCAN_WAITING_PREFIX
 )
 from openlcs.libs.corgi import CorgiConnector
 from openlcs.libs.distgit import get_distgit_sources
@@ -45,6 +65,9 @@ from openlcs.libs.encrypt_decrypt import encrypt_with_secret_key
 from openlcs.libs.exceptions import TaskResubmissionException
 from openlcs.libs.kojiconnector import KojiConnector
 from openlcs.libs.logger import get_task_logger
+from openlcs.libs.hash_cache import HashCache
+from openlcs.libs.hash_cache import get_hash_cache_path
+from openlcs.libs.manifest import SourceManifest
 from openlcs.libs.metadata import CargoMeta
 from openlcs.libs.metadata import GolangMeta
 from openlcs.libs.metadata import NpmMeta
@@ -53,11 +76,13 @@ from openlcs.libs.parsers import sha256sum
 from openlcs.libs.redis import generate_lock_key
 from openlcs.libs.redis import RedisClient
 from openlcs.libs.scanner import BaseScanner
+from openlcs.libs.scanner import CombinedScanner
 from openlcs.libs.scanner import LicenseScanner
 from openlcs.libs.scanner import CopyrightScanner
 from openlcs.libs.sc_handler import SourceContainerHandler
-from openlcs.libs.swh_tools import get_swhids_with_paths
+from openlcs.libs.unpack import KnownFiles
 from openlcs.libs.unpack import SP_EXTENSIONS
+from openlcs.libs.unpack import is_supported_archive
 from openlcs.libs.unpack import UnpackArchive
 from openlcs.libs.confluence import ConfluenceClient
 from openlcs.utils.common import DateEncoder
@@ -634,6 +659,58 @@ def download_component_source(context, engine):
             raise RuntimeError(err_msg) from None
 
 
+def get_hash_cache(config):
+    """
+    Get the node-local file hash cache on local disk, None if it's disabled
+    or the cache directory is unavailable.
+    """
+    max_entries = config.get('HASH_CACHE_MAX_ENTRIES', 0)
+    cache_dir = config.get('HASH_CACHE_DIR')
+    if not max_entries or not cache_dir:
+        return None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError:
+        return None
+    cache_path = get_hash_cache_path(cache_dir)
+    return HashCache(cache_path, max_entries=max_entries)
+
+
+def build_source_manifest(context, engine, src_dir, manifest=None):
+    """
+    Build the manifest of the source directory with the hash cache, or
+    refresh the given manifest of the same source at another root.
+    """
+    hash_cache = get_hash_cache(context.get('config', {}))
+    if manifest is None:
+        manifest = SourceManifest(src_dir)
+    else:
+        manifest.rebase(src_dir)
+    manifest.hash_cache = hash_cache
+    try:
+        manifest.build()
+    finally:
+        manifest.hash_cache = None
+        if hash_cache is not None:
+            hash_cache.close()
+    if hash_cache is not None:
+        engine.logger.info(
+            f'Hash cache hits: {hash_cache.hits}, '
+            f'misses: {hash_cache.misses}, errors: {hash_cache.errors}.')
+    return manifest
+
+
+def get_source_manifest_checksum(context, engine, src_dir):
+    """
+    Build the manifest of a directory source, returns the source checksum.
+    The manifest is reused while deduplicating source, so that files are
+    not read again.
+    """
+    manifest = build_source_manifest(context, engine, src_dir)
+    context['source_manifest'] = manifest
+    return manifest.checksum
+
+
 def get_source_metadata(context, engine):
     """
     Get package metadata(upstream url, declared license) after source archive
@@ -653,16 +730,19 @@ def get_source_metadata(context, engine):
             (component.get("type") == "MAVEN" and
              context.get('provenance') == 'sync_corgi'):
         source_name = get_component_name_version_combination(component)
-        source_checksum = dirhash(src_filepath, "sha256")
+        source_checksum = get_source_manifest_checksum(
+            context, engine, src_filepath)
     elif context.get('source_url') and is_src_dir:
         if nvr is not None:
             source_name = f"{nvr}"
         else:
             source_name = component.get("nvr")
-        source_checksum = dirhash(src_filepath, "sha256")
+        source_checksum = get_source_manifest_checksum(
+            context, engine, src_filepath)
     elif is_metadata_component_source(src_filepath):
         source_name = f"{nvr}-metadata"
-        source_checksum = dirhash(src_filepath, "sha256")
+        source_checksum = get_source_manifest_checksum(
+            context, engine, src_filepath)
     else:
         source_name = os.path.basename(src_filepath)
         source_checksum = sha256sum(src_filepath)
@@ -804,11 +884,19 @@ def check_source_status(context, engine):
 
 
 def get_scanner(context, engine):
-    # 'scanner' param could be added as an input when multiple scanners.
-    # Default is scancode.
+    """
+    Get the scanner backend and the detector used for scanning.
+    Default is scancode cli.
+
+    @requires: `config`, configuration from hub server.
+    @feeds: `scanner`, scanner backend, e.g. 'scancode', 'scancode_api'.
+    @feeds: `detector`, scanner together with its version.
+    """
     config = context.get('config')
+    scanner = config.get('SCANNER', 'scancode')
     base_scanner = BaseScanner(config=config)
-    base_scanner.get_scanner_version()
+    base_scanner.get_scanner_version(scanner)
+    context['scanner'] = scanner
     context['detector'] = base_scanner.detector
 
 
@@ -882,15 +970,78 @@ def check_source_scan_status(context, engine):
     context['source_scanned'] = source_scanned
 
 
+def get_source_size(path):
+    """
+    Get the size of the source archive, or total size of files in the
+    source directory.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.lstat(os.path.join(root, fn)).st_size
+               for root, _, files in os.walk(path) for fn in files)
+
+
+def select_scratch_dir(context, engine):
+    """
+    Select the scratch directory for the working tree of the source, e.g.
+    tmpfs or local SSD, by the expected unpacked size, i.e. the source size
+    multiplied by `SCRATCH_SIZE_RATIO`. Tiers in `SCRATCH_TIERS` are tried
+    in order, the first one the source fits into with enough free space is
+    used.
+
+    Returns None if no tier fits, or the source must stay on shared
+    storage, i.e. container sources used by child tasks, and shared remote
+    sources, which are unpacked in place.
+    """
+    config = context.get('config')
+    scratch_tiers = config.get('SCRATCH_TIERS')
+    tmp_src_filepath = context.get('tmp_src_filepath')
+    if not scratch_tiers or not tmp_src_filepath or \
+            not os.path.exists(tmp_src_filepath):
+        return None
+    if context.get('component_type') == 'OCI' and not context.get('parent'):
+        return None
+    if context.get('shared_remote_source'):
+        return None
+    ratio = config.get('SCRATCH_SIZE_RATIO', 1)
+    expected_size = get_source_size(tmp_src_filepath) * ratio
+    for tier in scratch_tiers:
+        tier_path = tier.get('path')
+        if expected_size > tier.get('max_size', 0):
+            continue
+        try:
+            os.makedirs(tier_path, exist_ok=True)
+            free_size = shutil.disk_usage(tier_path).free
+        except OSError as err:
+            engine.logger.warning(
+                f"Scratch directory {tier_path} unavailable: {err}")
+            continue
+        if expected_size < free_size:
+            engine.logger.info(f"Expected unpacked size {expected_size} "
+                               f"fits into scratch directory {tier_path}.")
+            return tier_path
+    return None
+
+
+def get_scratch_dir(context):
+    """
+    Directory for files staged within the task, on the same storage as the
+    source.
+    """
+    return context.get('scratch_dir') or context.get('tmp_root_dir')
+
+
 def prepare_dest_dir(context, engine):
     """
     Create destination directory based on config.
     For builds from brew/koji, if destination dir already exists,
-    remove it recursively and create new one.
+    remove it recursively and create new one. Sources are placed on scratch
+    storage instead if they fit into any scratch tier.
 
     @requires: `config`, configuration from hub server.
     @requires: `build`, meta info with the build.
     @feeds: `src_dest_dir`, destination dir where source will be placed.
+    @feeds: `scratch_dir`, scratch directory of the source, if selected.
     """
     config = context.get('config')
     build = context.get('build')
@@ -926,6 +1077,14 @@ def prepare_dest_dir(context, engine):
         metadata_dir = nvr + '-metadata'
         src_dir = os.path.join(dest_root, metadata_dir)
     else:
+        src_dir = None
+    scratch_dir = select_scratch_dir(context, engine)
+    if scratch_dir is not None:
+        # Scratch storage isn't partitioned by release, use unique names.
+        prefix = f'{os.path.basename(src_dir)}_' if src_dir else 'src_'
+        src_dir = tempfile.mkdtemp(prefix=prefix, dir=scratch_dir)
+        context['scratch_dir'] = scratch_dir
+    elif src_dir is None:
         src_dir = tempfile.mkdtemp(
             prefix='src_', dir=context.get('tmp_root_dir'))
     if os.path.exists(src_dir):
@@ -946,6 +1105,9 @@ def extract_source(context, engine):
 
     @requires(optional): `src_dest_dir`, destination source directory.
     @requires: `tmp_src_filepath`: absolute path to the archive.
+    @requires(optional): `known_files`, KnownFiles to skip writing files
+                         known.
+    @feeds: `source_manifest`, manifest of files hashed while extracted.
     """
     src_dest_dir = context.get('src_dest_dir', '/tmp')
     # FIXME: exception handling
@@ -955,31 +1117,96 @@ def extract_source(context, engine):
     if os.path.isdir(tmp_src_filepath):
         shutil.copytree(tmp_src_filepath, src_dest_dir, dirs_exist_ok=True)
     else:
-        ua = UnpackArchive(src_file=tmp_src_filepath, dest_dir=src_dest_dir)
+        ua = UnpackArchive(src_file=tmp_src_filepath, dest_dir=src_dest_dir,
+                           known_files=context.get('known_files'))
         ua.extract()
+        if ua.hashes:
+            # Files hashed while extracted are not read again in dedup.
+            context['source_manifest'] = SourceManifest(
+                src_dest_dir).add_hashes(ua.hashes)
     engine.logger.info("[EXTRACT SOURCE] Done")
 
 
+def splice_scanned_archives(context, engine, src_dir):
+    """
+    Reuse paths of nested archives already scanned as a source, instead of
+    unpacking and hashing them again. Such archives are removed from the
+    source, their paths are spliced under the archive path, the same as
+    the archive is unpacked in place.
+
+    @requires: `config`, configuration from hub server.
+    @feeds: `spliced_paths`, list of (path, swhid) of spliced archives.
+    """
+    spliced_paths = []
+    context['spliced_paths'] = spliced_paths
+    config = context.get('config', {})
+    if not config.get('NESTED_ARCHIVE_SPLICE_ENABLED', False):
+        return
+    archives = [os.path.join(root, fn)
+                for root, _, files in os.walk(src_dir) for fn in files
+                if is_supported_archive(fn)
+                and not os.path.islink(os.path.join(root, fn))]
+    for archive in archives:
+        data = {'checksum': sha256sum(archive),
+                'detector': context.get('detector'),
+                'license_scan': context.get('license_scan'),
+                'copyright_scan': context.get('copyright_scan')}
+        try:
+            response = get_data_using_post(context.get('client'),
+                                           '/scanned_source_paths/', data)
+        except RuntimeError as err:
+            engine.logger.warning(
+                f"Failed to get scanned source paths of {archive}: {err}")
+            continue
+        paths = response.get('paths')
+        if not paths:
+            continue
+        # Paths of an archive source are under the archive name.
+        prefix = response.get('source_name') + '/'
+        if not all(path.startswith(prefix) for path, _ in paths):
+            continue
+        rel_archive = os.path.relpath(archive, src_dir)
+        spliced_paths.extend(
+            (os.path.join(rel_archive, path[len(prefix):]), swhid)
+            for path, swhid in paths)
+        os.remove(archive)
+        engine.logger.info(f"Spliced {len(paths)} paths of scanned archive "
+                           f"{rel_archive}.")
+
+
 def unpack_source(context, engine):
     """
     Recursively unpack sources of given build/archive.
 
     @requires: 'src_dest_dir', destination directory.
     @feeds: 'None', archives will be recursively unpacked upon success.
+    @feeds: `source_manifest`, manifest with files known and not written.
     """
     prepare_dest_dir(context, engine)
     config = context.get('config')
 
     if not context.get('shared_remote_source'):
+        known_files = get_known_files(context, engine)
+        context['known_files'] = known_files
         extract_source(context, engine)
         src_dest_dir = context.get('src_dest_dir')
         engine.logger.info('[UNPACK SOURCE] Start to unpack source '
                            'archives...')
-        ua = UnpackArchive(config=config, dest_dir=src_dest_dir)
+        splice_scanned_archives(context, engine, src_dest_dir)
+        ua = UnpackArchive(config=config, dest_dir=src_dest_dir,
+                           known_files=known_files)
         unpack_errors = ua.unpack_archives()
         if unpack_errors:
             err_msg = "---- %s" % "\n".join(unpack_errors)
             engine.logger.warning(err_msg)
+        if known_files is not None and known_files.skipped:
+            manifest = context.get('source_manifest') or \
+                SourceManifest(src_dest_dir)
+            context['source_manifest'] = manifest.add_known(
+                known_files.skipped)
+            engine.logger.info(f"Skipped writing {len(known_files.skipped)} "
+                               f"files already scanned.")
+        del context['known_files']
         engine.logger.info("[UNPACK SOURCE] Done")
     else:
         source_file_path = context['tmp_src_filepath']
@@ -1044,6 +1271,216 @@ def get_source_files_paths(source_dir):
     return path_list
 
 
+def get_swhid_filter(context, engine, kind, detector=None):
+    """
+    Get the swhid filter published by hub. Filters are cached under the
+    temporary root directory, and downloaded again only if changed.
+    Returns None if the filter is not available.
+    """
+    cache_dir = os.path.join(context.get('tmp_root_dir'), 'swhid_filter')
+    os.makedirs(cache_dir, exist_ok=True)
+    name = get_swhid_filter_name(kind, detector)
+    file_path = os.path.join(cache_dir, name)
+    etag_path = file_path + '.etag'
+    headers = {}
+    if os.path.exists(file_path) and os.path.exists(etag_path):
+        with open(etag_path, encoding='utf-8') as f:
+            headers['If-None-Match'] = f.read().strip()
+    try:
+        response = context.get('client').get(
+            '/swhid_filters/', params={'kind': kind, 'detector': detector},
+            headers=headers)
+        if response.status_code == HTTPStatus.NOT_MODIFIED:
+            return BloomFilter.load(file_path)
+        response.raise_for_status()
+        bloom_filter = BloomFilter.from_bytes(response.content)
+        # Filter is written ahead of its ETag, so a stale ETag never
+        # matches a newer filter.
+        bloom_filter.dump(file_path)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(response.headers.get('ETag', ''))
+        os.replace(tmp_path, etag_path)
+        return bloom_filter
+    except (RequestException, OSError, ValueError) as err:
+        engine.logger.warning(f'Failed to get swhid filter {name}: {err}')
+    return None
+
+
+def get_swhid_filters(context, engine):
+    """
+    Get the swhid filters required by the scans, None if any of them is
+    not available.
+    """
+    kinds = [kind for kind, required in [
+        ('license', context.get('license_scan')),
+        ('copyright', context.get('copyright_scan'))] if required]
+    filters = []
+    for kind in kinds or ['file']:
+        detector = context.get('detector') if kind != 'file' else None
+        bloom_filter = get_swhid_filter(context, engine, kind, detector)
+        if bloom_filter is None:
+            return None
+        filters.append(bloom_filter)
+    return filters
+
+
+def filter_possible_duplicates(context, engine, swhids):
+    """
+    Get swhids possibly duplicate, i.e., in all the swhid filters required
+    by the scans. Swhids not in the filters are new, or scanned after the
+    filters were published, and will be scanned.
+    """
+    filters = get_swhid_filters(context, engine)
+    if filters is None:
+        return swhids
+    candidates = [swhid for swhid in swhids
+                  if all(swhid in f for f in filters)]
+    engine.logger.info(f'{len(candidates)} of {len(swhids)} files are '
+                       f'possibly duplicate in swhid filters.')
+    return candidates
+
+
+def get_duplicate_swhids(context, engine, swhids):
+    """
+    Get swhids of files already in db, and scanned if scan is required.
+    Swhids are checked in chunks concurrently, so that huge sources are not
+    checked in a single request.
+    """
+    config = context.get('config', {})
+    chunk_size = config.get('DEDUPLICATE_CHUNK_SIZE', 10000)
+    concurrency = config.get('DEDUPLICATE_CONCURRENCY', 4)
+    swhids = sorted(set(swhids))
+    if config.get('SWHID_FILTER_ENABLED', False):
+        swhids = filter_possible_duplicates(context, engine, swhids)
+    chunks = [swhids[i:i + chunk_size]
+              for i in range(0, len(swhids), chunk_size)]
+
+    def check_chunk(chunk):
+        data = {'swhids': chunk,
+                'detector': context.get('detector'),
+                'license_scan': context.get('license_scan'),
+                'copyright_scan': context.get('copyright_scan')}
+        response = get_data_using_post(context.get('client'),
+                                       '/check_duplicate_files/', data)
+        return response.get('duplicate_swhids') or []
+
+    if concurrency <= 1 or len(chunks) <= 1:
+        results = map(check_chunk, chunks)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(check_chunk, chunks))
+    return set(chain.from_iterable(results))
+
+
+def get_known_files(context, engine):
+    """
+    Get KnownFiles to skip writing files already scanned while extracting,
+    None if it's disabled. Files possibly known in the swhid filters are
+    confirmed with hub, files are written if failed to check them.
+    """
+    config = context.get('config', {})
+    if not config.get('SKIP_KNOWN_FILES_ENABLED', False):
+        return None
+    is_candidate = None
+    if config.get('SWHID_FILTER_ENABLED', False):
+        filters = get_swhid_filters(context, engine)
+        if filters is not None:
+            def is_candidate(swhid):
+                return all(swhid in f for f in filters)
+
+    def get_known(swhids):
+        try:
+            return get_duplicate_swhids(context, engine, swhids)
+        except RuntimeError as err:
+            engine.logger.warning(f"Failed to check known files: {err}")
+            return set()
+
+    return KnownFiles(get_known, is_candidate)
+
+
+def is_in_directories(path, directories):
+    """
+    Check if the relative path is under any of the directories.
+    """
+    parts = path.split(os.sep)
+    return any(os.sep.join(parts[:i]) in directories
+               for i in range(1, len(parts)))
+
+
+def get_parent_directories(paths):
+    """
+    Get all the parent directories of the relative paths, except the root.
+    """
+    directories = set()
+    for path in paths:
+        parts = path.split(os.sep)
+        directories.update(
+            os.sep.join(parts[:i]) for i in range(1, len(parts)))
+    return directories
+
+
+def deduplicate_directories(context, engine, manifest, src_dir):
+    """
+    Skip directories with all files scanned as a whole, they are removed
+    from the source, and paths of them are materialized by reference on hub.
+    Returns paths of the skipped directories.
+
+    Directories with spliced archives are neither skipped nor registered,
+    since spliced paths are not in the manifest, and so not in the hashes.
+
+    @requires(optional): `spliced_paths`, paths of spliced archives.
+    @feeds: `directory_swhids`, swhids of directories not skipped, which are
+             registered on hub once scanned.
+    """
+    context['directory_swhids'] = {}
+    config = context.get('config', {})
+    if not config.get('DIRECTORY_DEDUP_ENABLED', False):
+        return set()
+    spliced_dirs = get_parent_directories(
+        path for path, _ in context.get('spliced_paths') or [])
+    directory_swhids = {
+        directory: swhid
+        for directory, swhid in manifest.get_directory_swhids().items()
+        if directory not in spliced_dirs}
+    context['directory_swhids'] = directory_swhids
+    if not directory_swhids:
+        return set()
+    data = {'swhids': list(set(directory_swhids.values())),
+            'detector': context.get('detector'),
+            'license_scan': context.get('license_scan'),
+            'copyright_scan': context.get('copyright_scan')}
+    try:
+        response = get_data_using_post(context.get('client'),
+                                       '/check_duplicate_directories/', data)
+    except RuntimeError as err:
+        engine.logger.warning(f"Failed to check duplicate directories: {err}")
+        return set()
+    duplicate_swhids = set(response.get('duplicate_swhids') or [])
+
+    # Only the topmost duplicate directories are skipped.
+    skipped = set()
+    for directory in sorted(directory_swhids, key=lambda d: d.count(os.sep)):
+        if directory_swhids[directory] in duplicate_swhids and \
+                not is_in_directories(directory, skipped):
+            skipped.add(directory)
+    for directory in skipped:
+        # Directories with only files known are not written.
+        if os.path.isdir(os.path.join(src_dir, directory)):
+            shutil.rmtree(os.path.join(src_dir, directory))
+    context['directory_swhids'] = {
+        directory: swhid for directory, swhid in directory_swhids.items()
+        if directory not in skipped
+        and not is_in_directories(directory, skipped)}
+    context['source_info']['directories'] = [
+        {'path': directory, 'directory': directory_swhids[directory]}
+        for directory in sorted(skipped)]
+    if skipped:
+        engine.logger.info(f"Skipped {len(skipped)} directories with all "
+                           f"files scanned.")
+    return skipped
+
+
 def deduplicate_source(context, engine):
     """
     Exclude files that were already in db, and returns a subset of source
@@ -1054,15 +1491,30 @@ def deduplicate_source(context, engine):
     resource intensive.
 
     @requires: `src_dest_dir`,the archive unpack directory.
+    @requires(optional): `source_manifest`, manifest of directory source.
+    @requires(optional): `spliced_paths`, paths of spliced archives.
     @feeds: `swhids`, swhid list for files in the source.
+    @feeds: `directories`, directories skipped with all files scanned.
     @feeds: `paths`, path information list for files in the source.
     """
     engine.logger.info('[DEDUPLICATE SOURCE] Start to deduplicate source...')
     src_dest_dir = context.get("src_dest_dir")
     if src_dest_dir:
-        path_list = get_source_files_paths(src_dest_dir)
-        if path_list:
-            path_swhid_list = get_swhids_with_paths(path_list)
+        # Files unchanged after copied or unpacked are not read again.
+        manifest = build_source_manifest(
+            context, engine, src_dest_dir, context.get('source_manifest'))
+        engine.logger.info(
+            f'Reused hashes of {manifest.reused_count} files in source '
+            f'manifest, hashed {manifest.hashed_count} files.')
+        path_swhid_list = manifest.get_paths_with_swhids()
+        skipped_dirs = deduplicate_directories(
+            context, engine, manifest, src_dest_dir)
+        if skipped_dirs:
+            path_swhid_list = [
+                (path, swhid) for path, swhid in path_swhid_list
+                if not is_in_directories(
+                    os.path.relpath(path, src_dest_dir), skipped_dirs)]
+        if path_swhid_list:
             # Remove source root directory in path
             paths = [
                 os.path.relpath(item[0], src_dest_dir)
@@ -1075,18 +1527,15 @@ def deduplicate_source(context, engine):
 
             try:
                 # Deduplicate files.
-                data = {'swhids': swhids,
-                        'detector': context.get('detector'),
-                        'license_scan': context.get('license_scan'),
-                        'copyright_scan': context.get('copyright_scan')}
-                response = get_data_using_post(context.get('client'),
-                                               '/check_duplicate_files/', data)
-                duplicate_swhids = response.get('duplicate_swhids')
+                duplicate_swhids = get_duplicate_swhids(
+                    context, engine, swhids)
                 if duplicate_swhids:
-                    swhids = list(
-                        set(swhids).difference(set(duplicate_swhids)))
+                    swhids = list(set(swhids).difference(duplicate_swhids))
                     for path, swhid in path_swhid_list:
-                        if swhid in duplicate_swhids:
+                        # Files known are not written while extracted.
+                        if swhid in duplicate_swhids and \
+                                os.path.relpath(path, src_dest_dir) \
+                                not in manifest.known:
                             os.remove(path)
                 else:
                     swhids = list(set(swhids))
@@ -1095,10 +1544,12 @@ def deduplicate_source(context, engine):
                 # All the paths need to be stored. because even if file exist,
                 # that's not mean the path object exist.
                 # They are many-one relationship.
+                # Paths of spliced archives are with files already scanned.
+                spliced_paths = context.get('spliced_paths') or []
                 context['source_info']['paths'] = [{
                     "path": path,
                     "file": swhid
-                } for (path, swhid) in rel_path_swhids]
+                } for (path, swhid) in rel_path_swhids + list(spliced_paths)]
             except RuntimeError as err:
                 err_msg = f"Failed to check duplicate files. Reason: {err}"
                 engine.logger.error(err_msg)
@@ -1110,6 +1561,152 @@ def deduplicate_source(context, engine):
     engine.logger.info("[DEDUPLICATE SOURCE] Done")
 
 
+def stage_unique_files(context, engine):
+    """
+    Stage one representative file for each unseen swhid into a separate
+    scan directory, so that content duplicated across paths in the source
+    is only scanned once. Files are hard linked where possible.
+
+    @requires: `src_dest_dir`, the archive unpack directory.
+    @requires: `path_with_swhids`, relative paths with swhids of the source.
+    @feeds: `scan_dir`, directory with the staged files to be scanned.
+    @feeds: `staged_paths`, staged relative path to source relative path.
+    """
+    config = context.get('config')
+    if not config.get('SCAN_STAGING_ENABLED', False):
+        return
+    src_dest_dir = context.get('src_dest_dir')
+    path_with_swhids = context.get('path_with_swhids')
+    if not src_dest_dir or not path_with_swhids:
+        return
+    engine.logger.info('[STAGE FILES] Start to stage unique files...')
+    # Files already scanned have been removed while deduplicating source.
+    representatives = {}
+    path_count = 0
+    for path, swhid in path_with_swhids:
+        if os.path.exists(os.path.join(src_dest_dir, path)):
+            path_count += 1
+            representatives.setdefault(swhid, path)
+    if len(representatives) == path_count:
+        engine.logger.info('[STAGE FILES] No duplicate content, skipped.')
+        return
+
+    scan_dir = tempfile.mkdtemp(prefix='scan_',
+                                dir=get_scratch_dir(context))
+    staged_paths = {}
+    try:
+        for swhid, path in representatives.items():
+            # Keep the file name since some detections rely on it, e.g.,
+            # license texts in LICENSE/COPYING files.
+            staged_path = os.path.join(
+                swhid.rsplit(':', 1)[-1], os.path.basename(path))
+            dest = os.path.join(scan_dir, staged_path)
+            os.mkdir(os.path.dirname(dest))
+            src = os.path.join(src_dest_dir, path)
+            try:
+                os.link(src, dest)
+            except OSError:
+                shutil.copyfile(src, dest)
+            staged_paths[staged_path] = path
+    except OSError as err:
+        delete(scan_dir)
+        err_msg = f"Failed to stage files for scanning: {err}"
+        engine.logger.error(err_msg)
+        raise RuntimeError(err_msg) from None
+    context['scan_dir'] = scan_dir
+    context['staged_paths'] = staged_paths
+    engine.logger.info(f'[STAGE FILES] Staged {len(staged_paths)} unique '
+                       f'files out of {path_count} paths.')
+    engine.logger.info('[STAGE FILES] Done')
+
+
+def restore_staged_paths(context, licenses=None, copyrights=None,
+                         failed_paths=None):
+    """
+    Map scan result paths in the staged scan directory back to the source
+    paths. A single source path per swhid is enough, the result is applied
+    to all paths sharing the same file when saved in hub.
+    """
+    staged_paths = context.get('staged_paths')
+    if not staged_paths:
+        return
+    if licenses:
+        licenses[:] = [(staged_paths.get(lic[0], lic[0]),) + tuple(lic[1:])
+                       for lic in licenses]
+    if copyrights and copyrights.get('detail_copyrights'):
+        copyrights['detail_copyrights'] = {
+            staged_paths.get(path, path): value
+            for path, value in copyrights['detail_copyrights'].items()
+        }
+    if failed_paths:
+        failed_paths[:] = [staged_paths.get(path, path)
+                           for path in failed_paths]
+
+
+def get_scan_skip_reason(config, file_path, rel_path):
+    """
+    Get the reason why the file should be excluded from scanning, returns
+    None if the file should be scanned.
+    """
+    for pattern in config.get('SCAN_SKIP_PATH_PATTERNS', []):
+        if fnmatch.fnmatch(rel_path, pattern):
+            return 'path'
+    max_file_size = config.get('SCAN_MAX_FILE_SIZE')
+    if max_file_size and os.path.getsize(file_path) > max_file_size:
+        return 'size'
+    skip_mime_types = config.get('SCAN_SKIP_MIME_TYPES', [])
+    if skip_mime_types:
+        mime_type = get_mime_type(file_path)
+        # Type ends with '/' matches all its subtypes, e.g., 'image/'.
+        if mime_type and any(
+                mime_type.startswith(t) if t.endswith('/') else mime_type == t
+                for t in skip_mime_types):
+            return 'mime'
+    return None
+
+
+def classify_source_files(context, engine):
+    """
+    Exclude files unlikely to contain any license or copyright from
+    scanning, e.g., binaries, huge data files and generated files, according
+    to file size, mime type and path patterns configured. Excluded files are
+    left in place and reported as failed paths, so that they are never
+    marked as scanned.
+
+    @requires: `config`, configuration from hub.
+    @requires: `src_dest_dir`, source directory.
+    @requires(optional): `scan_dir`, staged directory to scan instead.
+    @requires(optional): `staged_paths`, staged path to source path.
+    @feeds: `scan_skipped_paths`, paths excluded from scanning, relative to
+            the directory to scan.
+    """
+    config = context.get('config')
+    src_dir = context.get('scan_dir') or context.get('src_dest_dir')
+    if not src_dir:
+        return
+    engine.logger.info('[CLASSIFY FILES] Start to classify files to scan...')
+    staged_paths = context.get('staged_paths') or {}
+    skipped = {}
+    skipped_bytes = 0
+    skipped_paths = []
+    for file_path in get_source_files_paths(src_dir):
+        scan_path = os.path.relpath(file_path, src_dir)
+        # Match path patterns against the source path of staged files.
+        rel_path = staged_paths.get(scan_path, scan_path)
+        reason = get_scan_skip_reason(config, file_path, rel_path)
+        if reason:
+            skipped[reason] = skipped.get(reason, 0) + 1
+            skipped_bytes += os.path.getsize(file_path)
+            skipped_paths.append(scan_path)
+    context['scan_skipped_paths'] = skipped_paths
+    engine.logger.info(
+        f'[CLASSIFY FILES] Skipped {sum(skipped.values())} files '
+        f'({skipped_bytes} bytes) from scanning, by path: '
+        f'{skipped.get("path", 0)}, by size: {skipped.get("size", 0)}, '
+        f'by mime type: {skipped.get("mime", 0)}.')
+    engine.logger.info('[CLASSIFY FILES] Done')
+
+
 def save_package_data(context, engine):
     """
     Equivalent of the former "post"/"post_adhoc", which sends/posts
@@ -1127,12 +1724,12 @@ def save_package_data(context, engine):
     # Post data file name instead of post context data
     fd, tmp_file_path = tempfile.mkstemp(prefix='send_package_',
                                          dir=context.get('post_dir'))
-    with os.fdopen(fd, 'w') as destination:
-        file_content = {
-            'source_info': context.get("source_info"),
-            'task_id': context.get('task_id')
-        }
-        json.dump(file_content, destination, cls=DateEncoder)
+    os.close(fd)
+    file_content = {
+        'source_info': context.get("source_info"),
+        'task_id': context.get('task_id')
+    }
+    dump_package_data(file_content, tmp_file_path, cls=DateEncoder)
     resp = cli.post(url, data={"file_path": tmp_file_path},
                     timeout=EXTENDED_REQUEST_TIMEOUT)
     context['client'] = cli
@@ -1149,36 +1746,273 @@ def save_package_data(context, engine):
     engine.logger.info("[SAVE PACKAGE] Done")
 
 
+def link_source_files(src_dir, paths, dest_root, prefix):
+    """
+    Link files under src_dir into a separate directory with the same
+    relative paths, so that scan results can be merged directly.
+    """
+    dest_dir = tempfile.mkdtemp(prefix=prefix, dir=dest_root)
+    for path in paths:
+        dest = os.path.join(dest_dir, path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        src = os.path.join(src_dir, path)
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+    return dest_dir
+
+
+def get_scan_checkpoint(context, license_scan_req, copyright_scan_req,
+                        shard=None):
+    """
+    Get the checkpoint file path of the source scan, it's unique for the
+    source, the detector, the scan types and the shard if sharded.
+    """
+    checkpoint_dir = os.path.join(
+        context.get('tmp_root_dir'), 'scan_checkpoints')
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    checksum = context.get("source_info").get("source").get("checksum")
+    scan_types = json.dumps([context.get('detector'), bool(license_scan_req),
+                             bool(copyright_scan_req)])
+    scan_key = hashlib.sha256(scan_types.encode('utf-8')).hexdigest()[:16]
+    if shard is not None:
+        scan_key = f'{scan_key}_{shard}'
+    return os.path.join(checkpoint_dir, f'{checksum}_{scan_key}.jsonl')
+
+
+def load_scan_checkpoint(checkpoint):
+    """
+    Load batch records from the checkpoint file, an incomplete record left
+    by a killed task is ignored.
+    """
+    records = []
+    if os.path.exists(checkpoint):
+        with open(checkpoint, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+    return records
+
+
+def save_scan_checkpoint(checkpoint, record):
+    with open(checkpoint, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def has_scan_exception(scan_result):
+    return any(scan_result[key]['has_exception']
+               for key in ['licenses', 'copyrights'] if key in scan_result)
+
+
+def bisect_failed_batch(context, engine, src_dir, paths, license_scan_req,
+                        copyright_scan_req):
+    """
+    Scan files of a failed batch again in halves, halves still failing are
+    split recursively until the files failing to scan are isolated, so a
+    single bad file costs about 2 * log2(n) scans instead of n. Files
+    failed to scan are recorded as per-file errors and don't affect other
+    files.
+    Returns the merged scan result and the failed paths.
+    """
+    config = context.get('config')
+    scan_results = []
+    failed_paths = []
+    # The whole batch is known to fail, start from its halves.
+    middle = len(paths) // 2
+    pending = [paths[middle:], paths[:middle]] if middle else [paths]
+    while pending:
+        chunk = pending.pop()
+        chunk_dir = link_source_files(
+            src_dir, chunk, get_scratch_dir(context), 'file_')
+        try:
+            scan_result = scan_source(
+                config, chunk_dir, engine.logger, license_scan_req,
+                copyright_scan_req, context.get('scanner', 'scancode'),
+                file_count=len(chunk))
+        finally:
+            delete(chunk_dir)
+        if not has_scan_exception(scan_result):
+            scan_results.append(scan_result)
+        elif len(chunk) > 1:
+            middle = len(chunk) // 2
+            pending.extend([chunk[middle:], chunk[:middle]])
+        else:
+            path = chunk[0]
+            failed_paths.append(path)
+            for key in ['licenses', 'copyrights']:
+                if key in scan_result:
+                    scan_result[key]['has_exception'] = False
+                    scan_result[key]['errors'] = [
+                        f"{path}: {err}" for err in scan_result[key]['errors']]
+            scan_results.append(scan_result)
+    return merge_scan_results(scan_results), failed_paths
+
+
+def scan_in_batches(context, engine, src_dir, checkpoint, license_scan_req,
+                    copyright_scan_req):
+    """
+    Scan files under src_dir in resumable batches of `SCAN_BATCH_SIZE`
+    files, result of each batch is persisted to the checkpoint file, so that
+    a rerun scan continues from the last finished batch. A failed batch is
+    bisected to isolate the files failing to scan, only those are excluded
+    from the result.
+    Returns the scan result with failed paths relative to src_dir.
+    """
+    config = context.get('config')
+    skipped_paths = set(context.get('scan_skipped_paths') or [])
+    files = [os.path.relpath(path, src_dir)
+             for path in get_source_files_paths(src_dir)]
+    paths = sorted(path for path in files if path not in skipped_paths)
+    path_set = set(paths)
+    scan_results = []
+    failed_paths = []
+    scanned_paths = set()
+    for record in load_scan_checkpoint(checkpoint):
+        # Files of the source may change, e.g., deduplicated by other scans
+        # meanwhile, such batches need to be scanned again.
+        if not path_set.issuperset(record['paths']):
+            continue
+        scan_results.append(record['scan_result'])
+        failed_paths.extend(record['failed_paths'])
+        scanned_paths.update(record['paths'])
+    pending_paths = [path for path in paths if path not in scanned_paths]
+    if scanned_paths:
+        engine.logger.info(f"Resumed scanning from checkpoint, "
+                           f"{len(scanned_paths)} files already scanned.")
+
+    batch_size = config.get('SCAN_BATCH_SIZE') or len(pending_paths) or 1
+    for i in range(0, len(pending_paths), batch_size):
+        batch = pending_paths[i:i + batch_size]
+        if len(batch) == len(files):
+            batch_dir = src_dir
+        else:
+            batch_dir = link_source_files(
+                src_dir, batch, get_scratch_dir(context), 'batch_')
+        try:
+            scan_result = scan_source(
+                config, batch_dir, engine.logger, license_scan_req,
+                copyright_scan_req, context.get('scanner', 'scancode'),
+                file_count=len(batch))
+            batch_failed_paths = []
+            if has_scan_exception(scan_result):
+                engine.logger.warning(
+                    f"Failed to scan batch of {len(batch)} files, bisect it "
+                    f"to find the files failing to scan.")
+                scan_result, batch_failed_paths = bisect_failed_batch(
+                    context, engine, batch_dir, batch, license_scan_req,
+                    copyright_scan_req)
+        finally:
+            if batch_dir != src_dir:
+                delete(batch_dir)
+        save_scan_checkpoint(checkpoint, {
+            'paths': batch,
+            'scan_result': scan_result,
+            'failed_paths': batch_failed_paths,
+        })
+        scan_results.append(scan_result)
+        failed_paths.extend(batch_failed_paths)
+
+    if not paths:
+        # Scan an empty directory for the detector and an empty result,
+        # files skipped from scanning are left out.
+        empty_dir = tempfile.mkdtemp(prefix='batch_',
+                                     dir=get_scratch_dir(context))
+        try:
+            scan_results.append(scan_source(
+                config, empty_dir, engine.logger, license_scan_req,
+                copyright_scan_req, context.get('scanner', 'scancode'),
+                file_count=0))
+        finally:
+            delete(empty_dir)
+    scan_result = merge_scan_results(scan_results)
+    scan_result['failed_paths'] = failed_paths
+    if failed_paths:
+        engine.logger.warning(f"Failed to scan {len(failed_paths)} files.")
+    return scan_result
+
+
+def batched_scan(context, engine, license_scan_req, copyright_scan_req):
+    """
+    Scan the source in resumable batches, see `scan_in_batches`.
+    Returns the scan result without source and path information.
+    """
+    src_dir = context.get('scan_dir') or context.get('src_dest_dir')
+    checkpoint = get_scan_checkpoint(
+        context, license_scan_req, copyright_scan_req)
+    context['scan_checkpoints'] = [checkpoint]
+    scan_result = scan_in_batches(context, engine, src_dir, checkpoint,
+                                  license_scan_req, copyright_scan_req)
+    # Files excluded from scanning are never marked as scanned.
+    scan_result['failed_paths'].extend(
+        context.get('scan_skipped_paths') or [])
+    restore_staged_paths(
+        context,
+        licenses=scan_result.get('licenses', {}).get('data'),
+        copyrights=scan_result.get('copyrights', {}).get('data'),
+        failed_paths=scan_result['failed_paths'])
+    return scan_result
+
+
+def update_scan_result(context, scan_result):
+    """
+    Update `scan_result` in context with the given scan result together with
+    source and path information.
+    """
+    result = context.get('scan_result', {})
+    if "source_checksum" not in result:
+        result["source_checksum"] = context.get("source_info").get(
+            "source").get("checksum")
+    failed_paths = result.get('failed_paths', [])
+    failed_paths.extend(path for path in scan_result.pop('failed_paths', [])
+                        if path not in failed_paths)
+    result.update(scan_result)
+    if 'licenses' in scan_result:
+        result["license_scan"] = context.get('license_scan')
+    if 'copyrights' in scan_result:
+        result["copyright_scan"] = context.get('copyright_scan')
+    result.update({
+        "path_with_swhids": context.get('path_with_swhids'),
+        "failed_paths": failed_paths,
+    })
+    context['scan_result'] = result
+
+
+def get_scanned_directories(context, failed_paths):
+    """
+    Get directories of the source with all files scanned, to be registered
+    on hub. Directories with files failed or skipped to scan are excluded.
+    """
+    failed_dirs = set()
+    for path in failed_paths:
+        parts = path.split(os.sep)
+        failed_dirs.update(os.sep.join(parts[:i])
+                           for i in range(1, len(parts)))
+    return {
+        directory: swhid
+        for directory, swhid in context.get('directory_swhids', {}).items()
+        if directory not in failed_dirs}
+
+
 def license_scan(context, engine):
     """
     Scan license under a given directory.
 
     @requires: `src_dest_dir`, source directory.
+    @requires(optional): `scan_dir`, staged directory to scan instead.
     @requires: `config`, configuration from hub.
     @feeds: `scan_result`, scan result updated with license scan data.
     """
-    src_dir = context.get('src_dest_dir')
-    config = context.get('config')
-    # Scanner could be provided when multiple scanners supported in the future.
     engine.logger.info("[SCAN LICENSE] Start to scan source licenses...")
-    scanner = LicenseScanner(
-            config=config, src_dir=src_dir, logger=engine.logger)
-    (detector, licenses, errors, has_exception) = scanner.scan()
+    scan_result = batched_scan(context, engine, True, False)
     engine.logger.info("[SCAN LICENSE] Done")
-    scan_result = {
-        "source_checksum": context.get("source_info").get("source").get(
-            "checksum")}
-    scan_result.update({
-        "license_detector": detector,
-        "license_scan": context.get('license_scan'),
-        "path_with_swhids": context.get('path_with_swhids'),
-        "licenses": {
-            "data": licenses,
-            "errors": errors,
-            "has_exception": has_exception
-        }
-    })
-    context['scan_result'] = scan_result
+    # Scan result of license scan always starts from scratch.
+    context.pop('scan_result', None)
+    update_scan_result(context, scan_result)
 
 
 def copyright_scan(context, engine):
@@ -1186,33 +2020,509 @@ def copyright_scan(context, engine):
     Scan copyright under a given directory.
 
     @requires: `src_dest_dir`, destination directory.
+    @requires(optional): `scan_dir`, staged directory to scan instead.
     @requires: `config`, configurations from Hub.
-    @feeds: `copyrights`, raw copyrights findings.
-    @feeds: `copyright_errors`, copyrights errors findings.
-    @feeds: `copyright_exception`, exception during copyright scanning.
+    @feeds: `scan_result`, scan result updated with copyright scan data.
     """
-    src_dir = context.get('src_dest_dir')
-    config = context.get('config')
     engine.logger.info("[SCAN COPYRIGHT] Start to scan copyrights...")
-    scanner = CopyrightScanner(
-            config=config, src_dir=src_dir, logger=engine.logger)
-    (detector, copyrights, errors, has_exception) = scanner.scan()
+    scan_result = batched_scan(context, engine, False, True)
     engine.logger.info("[SCAN COPYRIGHT] Done")
-    scan_result = context.get('scan_result', {})
-    if "source_checksum" not in scan_result:
-        scan_result["source_checksum"] = context.get("source_info").get(
-            "source").get("checksum")
-    scan_result.update({
-        "copyright_detector": detector,
-        "copyright_scan": context.get('copyright_scan'),
-        "path_with_swhids": context.get('path_with_swhids'),
-        "copyrights": {
-            "data": copyrights,
-            "errors": errors,
-            "has_exception": has_exception
+    update_scan_result(context, scan_result)
+
+
+def license_copyright_scan(context, engine):
+    """
+    Scan license and copyright under a given directory in a single pass.
+
+    @requires: `src_dest_dir`, source directory.
+    @requires(optional): `scan_dir`, staged directory to scan instead.
+    @requires: `config`, configuration from hub.
+    @feeds: `scan_result`, scan result updated with license and copyright
+            scan data.
+    """
+    engine.logger.info("[SCAN LICENSE/COPYRIGHT] Start to scan source "
+                       "licenses and copyrights...")
+    scan_result = batched_scan(context, engine, True, True)
+    engine.logger.info("[SCAN LICENSE/COPYRIGHT] Done")
+    context.pop('scan_result', None)
+    update_scan_result(context, scan_result)
+
+
+def scan_source(config, src_dir, logger, license_scan_req,
+                copyright_scan_req, scanner='scancode', file_count=None):
+    """
+    Scan license and/or copyright under a given directory, returns the
+    scan result without source and path information.
+    """
+    load = {
+        'file_count': file_count,
+        'running_tasks': redis_client.get_running_tasks(socket.gethostname())
+    }
+    scan_result = {}
+    if license_scan_req and copyright_scan_req:
+        (detector, licenses, copyrights, errors, has_exception) = \
+            CombinedScanner(config=config, src_dir=src_dir, logger=logger,
+                            **load).scan(scanner)
+        scan_result.update({
+            "license_detector": detector,
+            "licenses": {
+                "data": licenses,
+                "errors": errors,
+                "has_exception": has_exception
+            },
+            "copyright_detector": detector,
+            "copyrights": {
+                "data": copyrights,
+                "errors": errors,
+                "has_exception": has_exception
+            }
+        })
+    elif license_scan_req:
+        (detector, licenses, errors, has_exception) = LicenseScanner(
+            config=config, src_dir=src_dir, logger=logger, **load
+        ).scan(scanner)
+        scan_result.update({
+            "license_detector": detector,
+            "licenses": {
+                "data": licenses,
+                "errors": errors,
+                "has_exception": has_exception
+            }
+        })
+    elif copyright_scan_req:
+        (detector, copyrights, errors, has_exception) = CopyrightScanner(
+            config=config, src_dir=src_dir, logger=logger, **load
+        ).scan(scanner)
+        scan_result.update({
+            "copyright_detector": detector,
+            "copyrights": {
+                "data": copyrights,
+                "errors": errors,
+                "has_exception": has_exception
+            }
+        })
+    return scan_result
+
+
+def merge_scan_results(scan_results):
+    """
+    Merge scan results of shards into one.
+    """
+    merged = {}
+    for scan_result in scan_results:
+        for key in ['license_detector', 'copyright_detector']:
+            if key in scan_result:
+                merged[key] = scan_result[key]
+        if 'licenses' in scan_result:
+            licenses = merged.setdefault('licenses', {
+                "data": [], "errors": [], "has_exception": False})
+            licenses['data'].extend(
+                tuple(lic) for lic in scan_result['licenses']['data'])
+            licenses['errors'].extend(scan_result['licenses']['errors'])
+            licenses['has_exception'] |= \
+                scan_result['licenses']['has_exception']
+        if 'copyrights' in scan_result:
+            copyrights = merged.setdefault('copyrights', {
+                "data": {"summary_copyrights": [], "detail_copyrights": {}},
+                "errors": [],
+                "has_exception": False})
+            data = scan_result['copyrights']['data']
+            summary = copyrights['data']['summary_copyrights']
+            summary.extend(c for c in data.get('summary_copyrights', [])
+                           if c not in summary)
+            copyrights['data']['detail_copyrights'].update(
+                data.get('detail_copyrights', {}))
+            copyrights['errors'].extend(scan_result['copyrights']['errors'])
+            copyrights['has_exception'] |= \
+                scan_result['copyrights']['has_exception']
+    # License and copyright share the same errors in case of combined scan.
+    if 'licenses' in merged and 'copyrights' in merged:
+        merged['copyrights']['errors'] = merged['licenses']['errors']
+    # Any exception in shards fails the whole scan, same as a single scan.
+    for key, empty in [('licenses', []), ('copyrights', {})]:
+        if key in merged and merged[key]['has_exception']:
+            merged[key]['data'] = empty
+    return merged
+
+
+def partition_scan_shards(src_dir, shard_count, skipped_paths=()):
+    """
+    Partition files under src_dir into size-balanced shards, files skipped
+    from scanning are excluded. Returns a list of relative path lists.
+    """
+    skipped_paths = set(skipped_paths)
+    files = []
+    for path in get_source_files_paths(src_dir):
+        rel_path = os.path.relpath(path, src_dir)
+        if rel_path not in skipped_paths:
+            files.append((os.path.getsize(path), rel_path))
+    # Assign the largest file to the least loaded shard each time.
+    shards = [(0, i, []) for i in range(shard_count)]
+    for size, path in sorted(files, reverse=True):
+        total, i, paths = heapq.heappop(shards)
+        paths.append(path)
+        heapq.heappush(shards, (total + size, i, paths))
+    return [paths for _, _, paths in sorted(shards, key=lambda x: x[1])
+            if paths]
+
+
+def plan_scan_shards(context, engine):
+    """
+    Plan sharded scanning for very large sources, the source is split into
+    size-balanced shards when it has more files than `SCAN_SHARD_THRESHOLD`.
+
+    @requires: `config`, configuration from hub.
+    @requires: `src_dest_dir`, source directory.
+    @requires(optional): `scan_dir`, staged directory to scan instead.
+    @requires(optional): `scan_skipped_paths`, paths excluded from scanning.
+    @feeds: `scan_shards`, relative path lists of shards, if sharded.
+    """
+    config = context.get('config')
+    threshold = config.get('SCAN_SHARD_THRESHOLD')
+    if not threshold:
+        return
+    src_dir = context.get('scan_dir') or context.get('src_dest_dir')
+    skipped_paths = context.get('scan_skipped_paths') or []
+    file_count = len(get_source_files_paths(src_dir)) - len(skipped_paths)
+    if file_count <= threshold:
+        return
+    shard_count = -(-file_count // threshold)
+    engine.logger.info(f'[PLAN SHARDS] Start to split {file_count} files '
+                       f'into {shard_count} shards...')
+    context['scan_shards'] = partition_scan_shards(
+        src_dir, shard_count, skipped_paths)
+    engine.logger.info('[PLAN SHARDS] Done')
+
+
+def get_scan_shard_config(config):
+    """
+    Get the config needed to scan a shard, so that the whole config isn't
+    sent through the broker for each shard task.
+    """
+    return {key: value for key, value in config.items()
+            if key.startswith('SCANCODE_') or key in SCAN_SHARD_CONFIG_KEYS}
+
+
+def scan_shard_dir(context, engine, shard_dir, checkpoint):
+    """
+    Scan files of the shard in batches, the result is written into the shard
+    directory, for the parent task to merge.
+    """
+    scan_result = scan_in_batches(
+        context, engine, shard_dir, checkpoint,
+        context.get('license_scan_req'), context.get('copyright_scan_req'))
+    fd, tmp_file_path = tempfile.mkstemp(dir=shard_dir, suffix='.json')
+    with os.fdopen(fd, 'w') as destination:
+        json.dump(scan_result, destination)
+    # Rename is atomic, parent task only sees the completed result.
+    os.rename(tmp_file_path, os.path.join(shard_dir, 'scan_result.json'))
+    return scan_result
+
+
+def scan_shard(context, engine):
+    """
+    Scan a shard of a very large source, the shard is either scanned by this
+    task or its parent task, depends on which one claims it first.
+
+    @requires: `config`, configuration needed to scan the shard.
+    @requires: `shard_dir`, directory of the shard on shared storage.
+    @requires: `scan_checkpoint`, checkpoint file of the shard scan.
+    @requires: `license_scan_req`, bool, whether to scan license.
+    @requires: `copyright_scan_req`, bool, whether to scan copyright.
+    """
+    config = context.get('config')
+    engine.logger = get_task_logger(
+        config.get("LOGGER_DIR"), context.get('task_id'))
+    shard_dir = context.get('shard_dir')
+    claim_key = SCAN_SHARD_PREFIX + shard_dir
+    if not redis_client.claim_key(claim_key, context.get('task_id')):
+        engine.logger.info(f"Shard {shard_dir} already claimed, skipped.")
+        return
+    engine.logger.info(f"[SCAN SHARD] Start to scan shard {shard_dir}...")
+    scan_shard_dir(context, engine, shard_dir, context.get('scan_checkpoint'))
+    engine.logger.info("[SCAN SHARD] Done")
+
+
+def wait_scan_shard(context, engine, shard_dir, task_id, checkpoint):
+    """
+    Wait for the scan result of a shard task. In case the shard task hasn't
+    started yet, scan the shard in this task instead, so that the parent
+    tasks wouldn't wait for shard tasks queued behind them. The shard task
+    is treated as lost if it finishes without a result, or doesn't finish
+    within `SCAN_SHARD_TIMEOUT`.
+    """
+    config = context.get('config')
+    result_file = os.path.join(shard_dir, 'scan_result.json')
+    if redis_client.claim_key(SCAN_SHARD_PREFIX + shard_dir,
+                              context.get('task_id')):
+        app.control.revoke(task_id)
+        engine.logger.info(f"Scanning shard {shard_dir} of task {task_id} "
+                           f"in place...")
+        return scan_shard_dir(context, engine, shard_dir, checkpoint)
+    deadline = time.time() + config.get('SCAN_SHARD_TIMEOUT',
+                                        task_time_limit)
+    while not os.path.exists(result_file):
+        state = app.AsyncResult(task_id).state
+        # The result is written before the task finishes, check it again.
+        if state in states.READY_STATES and not os.path.exists(result_file):
+            err_msg = (f"Failed to scan shard {shard_dir} in task {task_id}, "
+                       f"task state: {state}.")
+            engine.logger.error(err_msg)
+            raise RuntimeError(err_msg)
+        if time.time() > deadline:
+            app.control.revoke(task_id, terminate=True)
+            err_msg = (f"Timed out waiting for shard {shard_dir} in task "
+                       f"{task_id}, task state: {state}.")
+            engine.logger.error(err_msg)
+            raise RuntimeError(err_msg)
+        time.sleep(SCAN_SHARD_POLL_INTERVAL)
+    with open(result_file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def sharded_scan(context, engine):
+    """
+    Scan a very large source in shards. Each shard except the first one is
+    dispatched as a separate task, the first one is scanned in this task.
+    Shards are scanned in resumable batches the same as unsharded sources,
+    results of all shards are merged into one `scan_result`.
+
+    @requires: `scan_shards`, relative path lists of shards.
+    @requires: `src_dest_dir`, source directory.
+    @requires(optional): `scan_dir`, staged directory to scan instead.
+    @requires: `config`, configuration from hub.
+    @feeds: `scan_result`, scan result of the source.
+    @feeds: `shard_dirs`, shard directories, cleaned up after the task.
+    @feeds: `scan_checkpoints`, checkpoint files of shards.
+    """
+    src_dir = context.get('scan_dir') or context.get('src_dest_dir')
+    license_scan_req = context.get('license_scan_req')
+    copyright_scan_req = context.get('copyright_scan_req')
+    scan_shards = context.get('scan_shards')
+    engine.logger.info(f"[SHARDED SCAN] Start to scan source in "
+                       f"{len(scan_shards)} shards...")
+    context['shard_dirs'] = shard_dirs = []
+    context['scan_checkpoints'] = checkpoints = [
+        get_scan_checkpoint(context, license_scan_req, copyright_scan_req,
+                            shard=i)
+        for i in range(len(scan_shards))]
+    shard_tasks = []
+    try:
+        # Shards scanned by other tasks are on shared storage, the first
+        # one scanned in this task is on the same storage as the source.
+        for i, paths in enumerate(scan_shards):
+            dest_root = get_scratch_dir(context) if i == 0 \
+                else context.get('tmp_root_dir')
+            shard_dirs.append(link_source_files(
+                src_dir, paths, dest_root, 'shard_'))
+    except OSError as err:
+        err_msg = f"Failed to stage files for sharded scanning: {err}"
+        engine.logger.error(err_msg)
+        raise RuntimeError(err_msg) from None
+    shard_config = get_scan_shard_config(context.get('config'))
+    for shard_dir, paths, checkpoint in zip(
+            shard_dirs[1:], scan_shards[1:], checkpoints[1:]):
+        shard_context = {
+            'config': shard_config,
+            'shard_dir': shard_dir,
+            'scan_checkpoint': checkpoint,
+            'tmp_root_dir': context.get('tmp_root_dir'),
+            'license_scan_req': license_scan_req,
+            'copyright_scan_req': copyright_scan_req,
+            'scanner': context.get('scanner', 'scancode'),
         }
-    })
-    context['scan_result'] = scan_result
+        shard_task = app.send_task('flow.tasks.flow_scan_shard',
+                                   [shard_context],
+                                   **generate_priority_kwargs('high'))
+        engine.logger.info(f"-- Dispatched shard {shard_dir} with "
+                           f"{len(paths)} files to task {shard_task.id}")
+        shard_tasks.append((shard_dir, shard_task.id, checkpoint))
+
+    scan_results = [scan_shard_dir(context, engine, shard_dirs[0],
+                                   checkpoints[0])]
+    for shard_dir, task_id, checkpoint in shard_tasks:
+        scan_results.append(wait_scan_shard(
+            context, engine, shard_dir, task_id, checkpoint))
+
+    failed_paths = list(chain.from_iterable(
+        result.pop('failed_paths', []) for result in scan_results))
+    failed_paths.extend(context.get('scan_skipped_paths') or [])
+    scan_result = merge_scan_results(scan_results)
+    scan_result['failed_paths'] = failed_paths
+    restore_staged_paths(
+        context,
+        licenses=scan_result.get('licenses', {}).get('data'),
+        copyrights=scan_result.get('copyrights', {}).get('data'),
+        failed_paths=failed_paths)
+    context.pop('scan_result', None)
+    update_scan_result(context, scan_result)
+    engine.logger.info("[SHARDED SCAN] Done")
+
+
+def get_scan_claim_key(context, swhid):
+    """
+    Get the claim key of the file for the detector and the scan types.
+    """
+    return "{}{}:{:d}{:d}:{}".format(
+        SCAN_CLAIM_PREFIX, context.get('detector'),
+        bool(context.get('license_scan')),
+        bool(context.get('copyright_scan')), swhid)
+
+
+def claim_source_files(context, engine):
+    """
+    Claim files unseen in db for scanning, so that files shared by tasks
+    running at the same time are only scanned by one of them. Files claimed
+    by other tasks are moved aside, and the scan results of them will be
+    reused once saved by the other tasks.
+
+    @requires: `config`, configuration from hub.
+    @requires: `src_dest_dir`, the archive unpack directory.
+    @requires: `source_info`, swhids of files unseen in db.
+    @requires: `path_with_swhids`, relative paths with swhids of the source.
+    @feeds: `scan_claim_keys`, claim keys owned by this task.
+    @feeds: `deferred_swhids`, swhids of files claimed by other tasks.
+    @feeds: `deferred_dir`, directory with files claimed by other tasks.
+    """
+    config = context.get('config')
+    if not config.get('SCAN_CLAIM_TIMEOUT'):
+        return
+    swhids = context.get('source_info', {}).get('swhids')
+    if not swhids:
+        return
+    engine.logger.info('[CLAIM FILES] Start to claim files for scanning...')
+    keys = [get_scan_claim_key(context, swhid) for swhid in swhids]
+    claimed = redis_client.claim_keys(keys, context.get('task_id'))
+    context['scan_claim_keys'] = [
+        key for key, is_claimed in zip(keys, claimed) if is_claimed]
+    deferred_swhids = set(
+        swhid for swhid, is_claimed in zip(swhids, claimed)
+        if not is_claimed)
+    if deferred_swhids:
+        src_dest_dir = context.get('src_dest_dir')
+        deferred_dir = tempfile.mkdtemp(prefix='deferred_',
+                                        dir=get_scratch_dir(context))
+        context['deferred_dir'] = deferred_dir
+        for path, swhid in context.get('path_with_swhids'):
+            if swhid in deferred_swhids:
+                dest = os.path.join(deferred_dir, path)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.move(os.path.join(src_dest_dir, path), dest)
+        context['deferred_swhids'] = list(deferred_swhids)
+    engine.logger.info(f'[CLAIM FILES] Claimed '
+                       f'{len(context["scan_claim_keys"])} files, '
+                       f'{len(deferred_swhids)} files are being scanned by '
+                       f'other tasks.')
+    engine.logger.info('[CLAIM FILES] Done')
+
+
+def wait_claimed_files(context, engine, swhids):
+    """
+    Wait until files claimed by other tasks are released, or the tasks
+    claimed them are finished, or `SCAN_CLAIM_TIMEOUT` exceeded.
+
+    Tasks waiting for files of others themselves are not waited for, so
+    that tasks never wait for each other, their files are scanned again
+    instead.
+    """
+    config = context.get('config')
+    timeout = config.get('SCAN_CLAIM_TIMEOUT')
+    deadline = time.time() + timeout
+    keys = [get_scan_claim_key(context, swhid) for swhid in swhids]
+    task_id = context.get('task_id')
+    waiting_key = SCAN_WAITING_PREFIX + task_id
+    redis_client.claim_key(waiting_key, task_id, expire=timeout)
+    try:
+        while time.time() < deadline:
+            owners = list(set(filter(None,
+                                     redis_client.get_key_owners(keys))))
+            waiting = redis_client.get_key_owners(
+                [SCAN_WAITING_PREFIX + owner for owner in owners])
+            running_owners = [
+                owner for owner, is_waiting in zip(owners, waiting)
+                if not is_waiting and
+                app.AsyncResult(owner).state not in states.READY_STATES]
+            if not running_owners:
+                return
+            engine.logger.info(f"Waiting for files being scanned by "
+                               f"{len(running_owners)} other tasks...")
+            time.sleep(SCAN_CLAIM_POLL_INTERVAL)
+        engine.logger.warning("Timed out waiting for files being scanned by "
+                              "other tasks.")
+    finally:
+        redis_client.release_keys([waiting_key], task_id)
+
+
+def scan_deferred_files(context, engine):
+    """
+    Reuse scan results of files claimed by other tasks. Files whose scan
+    results are not saved by the other tasks are scanned in this task.
+
+    @requires: `deferred_swhids`, swhids of files claimed by other tasks.
+    @requires: `deferred_dir`, directory with files claimed by other tasks.
+    @requires: `scan_result`, scan result of files claimed by this task.
+    @feeds: `scan_result`, updated with results of files scanned here.
+    """
+    deferred_swhids = context.get('deferred_swhids')
+    if not deferred_swhids or 'scan_result' not in context:
+        return
+    engine.logger.info('[SCAN DEFERRED FILES] Start to check files scanned '
+                       'by other tasks...')
+    wait_claimed_files(context, engine, deferred_swhids)
+    try:
+        data = {'swhids': deferred_swhids,
+                'detector': context.get('detector'),
+                'license_scan': context.get('license_scan'),
+                'copyright_scan': context.get('copyright_scan')}
+        response = get_data_using_post(context.get('client'),
+                                       '/check_duplicate_files/', data)
+    except RuntimeError as err:
+        err_msg = f"Failed to check duplicate files. Reason: {err}"
+        engine.logger.error(err_msg)
+        raise RuntimeError(err_msg) from None
+    leftover_swhids = set(deferred_swhids).difference(
+        response.get('duplicate_swhids') or [])
+    # One path for each file is enough to scan.
+    deferred_dir = context.get('deferred_dir')
+    config = context.get('config')
+    scan_result = context.get('scan_result')
+    leftover_paths = {}
+    skipped_swhids = set()
+    for path, swhid in context.get('path_with_swhids'):
+        if swhid in leftover_swhids and swhid not in leftover_paths and \
+                swhid not in skipped_swhids:
+            file_path = os.path.join(deferred_dir, path)
+            if get_scan_skip_reason(config, file_path, path):
+                # Never marked as scanned, same as other skipped files.
+                skipped_swhids.add(swhid)
+                scan_result.setdefault('failed_paths', []).append(path)
+            else:
+                leftover_paths[swhid] = path
+    engine.logger.info(f'Reused scan results of '
+                       f'{len(deferred_swhids) - len(leftover_swhids)} files, '
+                       f'{len(leftover_paths)} files left to scan.')
+    if leftover_paths:
+        paths = list(leftover_paths.values())
+        scan_dir = link_source_files(
+            deferred_dir, paths, get_scratch_dir(context), 'leftover_')
+        try:
+            leftover_result = scan_source(
+                config, scan_dir, engine.logger,
+                context.get('license_scan_req'),
+                context.get('copyright_scan_req'),
+                context.get('scanner', 'scancode'), file_count=len(paths))
+        finally:
+            delete(scan_dir)
+        if has_scan_exception(leftover_result):
+            scan_result.setdefault('failed_paths', []).extend(paths)
+        else:
+            scan_result.update(merge_scan_results([
+                {key: scan_result[key] for key in [
+                    'license_detector', 'licenses',
+                    'copyright_detector', 'copyrights'
+                ] if key in scan_result},
+                leftover_result]))
+    engine.logger.info('[SCAN DEFERRED FILES] Done')
 
 
 def save_scan_result(context, engine):
@@ -1232,11 +2542,16 @@ def save_scan_result(context, engine):
     engine.logger.info(f"[SAVE RESULT] Start to send {component_nvr} scan "
                        f"result to hub for further processing...")
 
+    scan_result = context.get("scan_result")
+    # Failed paths are complete only once files deferred to other tasks are
+    # scanned, directories are decided afterwards.
+    scan_result['directories'] = get_scanned_directories(
+        context, scan_result.get('failed_paths', []))
     fd, tmp_file_path = tempfile.mkstemp(prefix='scan_result_',
                                          dir=context.get('post_dir'))
+    os.close(fd)
     try:
-        with os.fdopen(fd, 'w') as destination:
-            json.dump(context.get("scan_result"), destination, cls=DateEncoder)
+        dump_scan_result(scan_result, tmp_file_path, cls=DateEncoder)
     except Exception as e:
         err_msg = f"Failed to create scan result file: {e}"
         engine.logger.error(err_msg)
@@ -1252,6 +2567,10 @@ def save_scan_result(context, engine):
         raise RuntimeError(err_msg) from None
     finally:
         os.remove(tmp_file_path)
+    # Scan result saved, no need to resume scanning any more.
+    for scan_checkpoint in context.get('scan_checkpoints', []):
+        if os.path.exists(scan_checkpoint):
+            os.remove(scan_checkpoint)
     engine.logger.info("[SAVE RESULT] Done")
 
 
@@ -1736,15 +3055,34 @@ flow_default = [
                                         [
                                             unpack_source,
                                             deduplicate_source,
+                                            claim_source_files,
+                                            stage_unique_files,
+                                            classify_source_files,
                                             save_package_data,
-                                            IF(
-                                                lambda o, e: o.get('license_scan_req'), # noqa
-                                                license_scan,
-                                            ),
-                                            IF(
-                                                lambda o, e: o.get('copyright_scan_req'), # noqa
-                                                copyright_scan,
+                                            plan_scan_shards,
+                                            IF_ELSE(
+                                                lambda o, e: o.get('scan_shards'), # noqa
+                                                # Scan very large source in
+                                                # shards across tasks.
+                                                sharded_scan,
+                                                # Scan license and copyright
+                                                # in one pass if both needed.
+                                                IF_ELSE(
+                                                    lambda o, e: o.get('license_scan_req') and o.get('copyright_scan_req'), # noqa
+                                                    license_copyright_scan,
+                                                    [
+                                                        IF(
+                                                            lambda o, e: o.get('license_scan_req'), # noqa
+                                                            license_scan,
+                                                        ),
+                                                        IF(
+                                                            lambda o, e: o.get('copyright_scan_req'), # noqa
+                                                            copyright_scan,
+                                                        ),
+                                                    ]
+                                                ),
                                             ),
+                                            scan_deferred_files,
                                             save_scan_result,
                                         ],
                                     ),
@@ -1764,13 +3102,19 @@ flow_default = [
 
 flow_retry = [
     get_config,
-    IF(
-        lambda o, e: o.get('license_scan'),
-        license_scan,
-    ),
-    IF(
-        lambda o, e: o.get('copyright_scan'),
-        copyright_scan,
+    IF_ELSE(
+        lambda o, e: o.get('license_scan') and o.get('copyright_scan'),
+        license_copyright_scan,
+        [
+            IF(
+                lambda o, e: o.get('license_scan'),
+                license_scan,
+            ),
+            IF(
+                lambda o, e: o.get('copyright_scan'),
+                copyright_scan,
+            ),
+        ]
     ),
     save_scan_result,
 ]
@@ -1933,6 +3277,22 @@ def trigger_corgi_components_imports(context, engine):
             engine.logger.info("The collected components have been scanned.")
 
 
+def publish_swhid_filters(context, engine):
+    """
+    Have hub rebuild the swhid filters published to workers, the filters
+    are rebuilt in the background of hub.
+    """
+    engine.logger.info("[PUBLISH SWHID FILTERS] Start to publish swhid "
+                       "filters...")
+    try:
+        get_data_using_post(context.get('client'), '/swhid_filters/', {})
+    except RuntimeError as err:
+        err_msg = f"Failed to publish swhid filters. Reason: {err}"
+        engine.logger.error(err_msg)
+        raise RuntimeError(err_msg) from None
+    engine.logger.info("[PUBLISH SWHID FILTERS] Done")
+
+
 def clear_unused_resource_source(context, engine):
     """
     Clear unused shared remote source file
@@ -2053,6 +3413,10 @@ process_collected_components = [
 ]
 
 
+flow_scan_shard = [
+    scan_shard,
+]
+
 flow_collect_components_for_subscription = [
     get_config,
     populate_components_generator,
@@ -2081,6 +3445,10 @@ flow_publish_confluence = [
     get_config,
     publish_confluence
 ]
+flow_publish_swhid_filters = [
+    get_config,
+    publish_swhid_filters
+]
 
 
 def register_task_flow(name, flow, **kwargs):
@@ -2113,6 +3481,7 @@ def register_task_flow(name, flow, **kwargs):
 
 register_task_flow('flow.tasks.flow_default', flow_default)
 register_task_flow('flow.tasks.flow_retry', flow_retry)
+register_task_flow('flow.tasks.flow_scan_shard', flow_scan_shard)
 register_task_flow('flow.tasks.flow_get_active_subscriptions',
                    flow_get_active_subscriptions)
 register_task_flow('flow.tasks.flow_collect_components_for_subscription',
@@ -2123,3 +3492,5 @@ register_task_flow('flow.tasks.flow_rescan_missing_components',
                    flow_rescan_missing_components)
 register_task_flow('flow.tasks.flow_publish_confluence',
                    flow_publish_confluence)
+register_task_flow('flow.tasks.flow_publish_swhid_filters',
+                   flow_publish_swhid_filters)
@@ -1,11 +1,27 @@
 import unittest
+from openlcsd.flow.tests.test_batched_scan import TestBatchedScan
+from openlcsd.flow.tests.test_claim_source_files import TestClaimSourceFiles
+from openlcsd.flow.tests.test_classify_source_files import \
+    TestClassifySourceFiles
 from openlcsd.flow.tests.test_deduplicate_source import TestDeduplicateSource
 from openlcsd.flow.tests.test_repack_source import TestRepackSource
+from openlcsd.flow.tests.test_scratch_tiers import TestScratchTiers
+from openlcsd.flow.tests.test_sharded_scan import TestShardedScan
+from openlcsd.flow.tests.test_splice_scanned_archives import \
+    TestSpliceScannedArchives
+from openlcsd.flow.tests.test_stage_unique_files import TestStageUniqueFiles
 
 suite = unittest.TestSuite()
 # Add all flow test modules here
 suite.addTest(unittest.makeSuite(TestDeduplicateSource))
 suite.addTest(unittest.makeSuite(TestRepackSource))
+suite.addTest(unittest.makeSuite(TestStageUniqueFiles))
+suite.addTest(unittest.makeSuite(TestShardedScan))
+suite.addTest(unittest.makeSuite(TestBatchedScan))
+suite.addTest(unittest.makeSuite(TestClassifySourceFiles))
+suite.addTest(unittest.makeSuite(TestClaimSourceFiles))
+suite.addTest(unittest.makeSuite(TestSpliceScannedArchives))
+suite.addTest(unittest.makeSuite(TestScratchTiers))
 
 runner = unittest.TextTestRunner()
 runner.run(suite)
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from unittest import TestCase
+
+from openlcsd.flow import tasks
+
+
+def fake_scan_source(config, src_dir, logger, license_scan_req,
+                     copyright_scan_req, scanner='scancode', file_count=None):
+    paths = sorted(os.path.relpath(path, src_dir)
+                   for path in tasks.get_source_files_paths(src_dir))
+    has_exception = 'bad' in paths
+    return {
+        "license_detector": "scancode 31.2.4",
+        "licenses": {
+            "data": [] if has_exception else [
+                (path, 'MIT', 100.0, 1, 1, False, 'mit.RULE')
+                for path in paths],
+            "errors": ["killed"] if has_exception else [],
+            "has_exception": has_exception
+        }
+    }
+
+
+class TestBatchedScan(TestCase):
+
+    def setUp(self) -> None:
+        self.src_dest_dir = tempfile.mkdtemp()
+        self.tmp_root_dir = tempfile.mkdtemp()
+        for path in ['a', 'b', 'bad', 'c']:
+            with open(os.path.join(self.src_dest_dir, path), 'w',
+                      encoding='utf-8') as f:
+                f.write(path)
+        self.context = {
+            "config": {"SCAN_BATCH_SIZE": 2},
+            "detector": "scancode 31.2.4",
+            "src_dest_dir": self.src_dest_dir,
+            "tmp_root_dir": self.tmp_root_dir,
+            "source_info": {"source": {"checksum": "checksum"}},
+        }
+        self.engine = mock.Mock()
+
+    @mock.patch.object(tasks, 'scan_source', side_effect=fake_scan_source)
+    def test_batched_scan(self, mock_scan_source):
+        scan_result = tasks.batched_scan(self.context, self.engine,
+                                         True, False)
+        # The failed batch is scanned again in halves.
+        self.assertEqual(mock_scan_source.call_count, 4)
+        self.assertEqual(scan_result['failed_paths'], ['bad'])
+        licenses = scan_result['licenses']
+        self.assertFalse(licenses['has_exception'])
+        self.assertEqual(sorted(lic[0] for lic in licenses['data']),
+                         ['a', 'b', 'c'])
+        self.assertEqual(licenses['errors'], ['bad: killed'])
+
+        # Resume from checkpoint without scanning again.
+        mock_scan_source.reset_mock()
+        resumed = tasks.batched_scan(self.context, self.engine, True, False)
+        mock_scan_source.assert_not_called()
+        self.assertEqual(resumed['failed_paths'], ['bad'])
+        self.assertEqual(sorted(resumed['licenses']['data']),
+                         sorted(licenses['data']))
+
+    @mock.patch.object(tasks, 'scan_source', side_effect=fake_scan_source)
+    def test_bisect_failed_batch(self, mock_scan_source):
+        paths = ['bad'] + [f'file{i:02d}' for i in range(31)]
+        for path in paths:
+            with open(os.path.join(self.src_dest_dir, path), 'w',
+                      encoding='utf-8') as f:
+                f.write(path)
+        scan_result, failed_paths = tasks.bisect_failed_batch(
+            self.context, self.engine, self.src_dest_dir, paths, True, False)
+        self.assertEqual(failed_paths, ['bad'])
+        # Two scans per level, instead of one scan per file.
+        self.assertEqual(mock_scan_source.call_count, 10)
+        self.assertEqual(sorted(lic[0] for lic in scan_result['licenses'][
+            'data']), paths[1:])
+        self.assertEqual(scan_result['licenses']['errors'], ['bad: killed'])
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dest_dir)
+        shutil.rmtree(self.tmp_root_dir)
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from unittest import TestCase
+
+from openlcsd.flow import tasks
+
+
+class TestClaimSourceFiles(TestCase):
+
+    def setUp(self) -> None:
+        self.src_dest_dir = tempfile.mkdtemp()
+        self.tmp_root_dir = tempfile.mkdtemp()
+        self.path_with_swhids = [
+            ('mine', 'swh:1:cnt:1111'),
+            ('reused', 'swh:1:cnt:2222'),
+            ('leftover', 'swh:1:cnt:3333'),
+        ]
+        for path, _ in self.path_with_swhids:
+            with open(os.path.join(self.src_dest_dir, path), 'w',
+                      encoding='utf-8') as f:
+                f.write(path)
+        self.context = {
+            "config": {"SCAN_CLAIM_TIMEOUT": 60},
+            "task_id": "task-1",
+            "detector": "scancode 31.2.4",
+            "license_scan": True,
+            "license_scan_req": True,
+            "src_dest_dir": self.src_dest_dir,
+            "tmp_root_dir": self.tmp_root_dir,
+            "path_with_swhids": self.path_with_swhids,
+            "source_info": {
+                "swhids": [swhid for _, swhid in self.path_with_swhids]},
+        }
+        self.engine = mock.Mock()
+
+    @mock.patch.object(tasks, 'scan_source')
+    @mock.patch.object(tasks, 'get_data_using_post')
+    @mock.patch.object(tasks, 'redis_client')
+    def test_claim_source_files(self, mock_redis_client,
+                                mock_get_data_using_post, mock_scan_source):
+        mock_redis_client.claim_keys.return_value = [True, False, False]
+        tasks.claim_source_files(self.context, self.engine)
+        self.assertEqual(self.context['scan_claim_keys'], [
+            'SCAN_CLAIM_scancode 31.2.4:10:swh:1:cnt:1111'])
+        self.assertEqual(sorted(self.context['deferred_swhids']),
+                         ['swh:1:cnt:2222', 'swh:1:cnt:3333'])
+        # Files claimed by other tasks are moved out of source to scan.
+        self.assertEqual(os.listdir(self.src_dest_dir), ['mine'])
+
+        # Other task finished, but only saved result of one file.
+        mock_redis_client.get_key_owners.return_value = [None, None]
+        mock_get_data_using_post.return_value = {
+            "duplicate_swhids": ['swh:1:cnt:2222']}
+        mock_scan_source.return_value = {
+            "license_detector": "scancode 31.2.4",
+            "licenses": {
+                "data": [('leftover', 'MIT', 100.0, 1, 1, False, 'mit.RULE')],
+                "errors": [],
+                "has_exception": False
+            }
+        }
+        self.context['scan_result'] = {
+            "license_detector": "scancode 31.2.4",
+            "licenses": {
+                "data": [('mine', 'MIT', 100.0, 1, 1, False, 'mit.RULE')],
+                "errors": [],
+                "has_exception": False
+            },
+            "failed_paths": [],
+        }
+        tasks.scan_deferred_files(self.context, self.engine)
+        self.assertEqual(mock_scan_source.call_args[1]['file_count'], 1)
+        licenses = self.context['scan_result']['licenses']['data']
+        self.assertEqual([lic[0] for lic in licenses], ['mine', 'leftover'])
+
+    @mock.patch.object(tasks, 'time')
+    @mock.patch.object(tasks, 'app')
+    @mock.patch.object(tasks, 'redis_client')
+    def test_wait_claimed_files(self, mock_redis_client, mock_app,
+                                mock_time):
+        mock_time.time.return_value = 0
+        mock_app.AsyncResult.return_value.state = 'STARTED'
+        swhids = ['swh:1:cnt:2222', 'swh:1:cnt:3333']
+        # The owner is waiting for files of others itself, not waited for.
+        mock_redis_client.get_key_owners.side_effect = [
+            ['task-2', 'task-2'], ['task-2']]
+        tasks.wait_claimed_files(self.context, self.engine, swhids)
+        mock_time.sleep.assert_not_called()
+        mock_redis_client.get_key_owners.assert_called_with(
+            ['SCAN_WAITING_task-2'])
+        # Mark of this task waiting is removed once done.
+        mock_redis_client.claim_key.assert_called_once_with(
+            'SCAN_WAITING_task-1', 'task-1', expire=60)
+        mock_redis_client.release_keys.assert_called_once_with(
+            ['SCAN_WAITING_task-1'], 'task-1')
+
+        # The owner is still scanning.
+        mock_redis_client.get_key_owners.side_effect = [
+            ['task-2', None], [None], [None, None], []]
+        tasks.wait_claimed_files(self.context, self.engine, swhids)
+        mock_time.sleep.assert_called_once()
+
+    @mock.patch.object(tasks, 'dump_scan_result')
+    def test_save_scan_result_directories(self, mock_dump_scan_result):
+        self.context.update({
+            "client": mock.Mock(),
+            "package_nvr": "foo-1.0-1",
+            "post_dir": self.tmp_root_dir,
+            "directory_swhids": {"a": "swh:1:dir:a", "b": "swh:1:dir:b"},
+            # Deferred file failed to scan after the scan result updated.
+            "scan_result": {"failed_paths": ["b/leftover"]},
+        })
+        tasks.save_scan_result(self.context, self.engine)
+        scan_result = mock_dump_scan_result.call_args[0][0]
+        self.assertEqual(scan_result['directories'], {"a": "swh:1:dir:a"})
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dest_dir)
+        shutil.rmtree(self.tmp_root_dir)
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from unittest import TestCase
+
+from openlcsd.flow import tasks
+
+
+class TestClassifySourceFiles(TestCase):
+
+    def setUp(self) -> None:
+        self.src_dest_dir = tempfile.mkdtemp()
+        files = {
+            'LICENSE': b'MIT License',
+            'main.c': b'int main() {}',
+            'logo.png': b'\x89PNG\r\n\x1a\n' + b'\x00' * 16,
+            'dist/app.min.js': b'var a=1;',
+            'data.bin': b'\x00' * 2048,
+        }
+        for path, content in files.items():
+            file_path = os.path.join(self.src_dest_dir, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(content)
+        self.context = {
+            "config": {
+                "SCAN_MAX_FILE_SIZE": 1024,
+                "SCAN_SKIP_MIME_TYPES": ['image/png'],
+                "SCAN_SKIP_PATH_PATTERNS": ['*.min.js'],
+            },
+            "src_dest_dir": self.src_dest_dir,
+        }
+        self.engine = mock.Mock()
+
+    def test_classify_source_files(self):
+        tasks.classify_source_files(self.context, self.engine)
+        self.assertEqual(sorted(self.context['scan_skipped_paths']),
+                         ['data.bin', 'dist/app.min.js', 'logo.png'])
+        # Skipped files are left in the source.
+        self.assertEqual(len(tasks.get_source_files_paths(
+            self.src_dest_dir)), 5)
+        self.engine.logger.info.assert_any_call(
+            '[CLASSIFY FILES] Skipped 3 files (2080 bytes) from scanning, '
+            'by path: 1, by size: 1, by mime type: 1.')
+
+    @mock.patch.object(tasks, 'scan_source')
+    def test_skipped_files_not_scanned(self, mock_scan_source):
+        tmp_root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_root_dir)
+        scanned = []
+
+        def fake_scan_source(config, src_dir, *args, **kwargs):
+            scanned.extend(
+                os.path.relpath(path, src_dir)
+                for path in tasks.get_source_files_paths(src_dir))
+            return {
+                "license_detector": "scancode 31.2.4",
+                "licenses": {"data": [], "errors": [],
+                             "has_exception": False}
+            }
+
+        mock_scan_source.side_effect = fake_scan_source
+        self.context.update({
+            "detector": "scancode 31.2.4",
+            "tmp_root_dir": tmp_root_dir,
+            "source_info": {"source": {"checksum": "checksum"}},
+        })
+        tasks.classify_source_files(self.context, self.engine)
+        scan_result = tasks.batched_scan(self.context, self.engine,
+                                         True, False)
+        self.assertEqual(sorted(scanned), ['LICENSE', 'main.c'])
+        self.assertEqual(sorted(scan_result['failed_paths']),
+                         ['data.bin', 'dist/app.min.js', 'logo.png'])
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dest_dir)
@@ -5,6 +5,7 @@ from unittest import mock
 from unittest import TestCase
 
 
+from openlcs.libs.bloom import BloomFilter
 from openlcsd.flow import tasks
 
 
@@ -64,5 +65,123 @@ class TestDeduplicateSource(TestCase):
         ]
         self.assertCountEqual(context_source_paths,  source_paths)
 
+    @mock.patch.object(tasks, 'get_data_using_post')
+    def test_deduplicate_source_in_chunks(self, mock_get_data_using_post):
+        duplicate_swhid = "swh:1:cnt:c0de67c68fac3a78be782a7197f4072d8f2c8668"
+        mock_get_data_using_post.side_effect = lambda client, url, data: {
+            "duplicate_swhids": [
+                swhid for swhid in data['swhids']
+                if swhid == duplicate_swhid]}
+        self.context['config'] = {
+            'DEDUPLICATE_CHUNK_SIZE': 1,
+            'DEDUPLICATE_CONCURRENCY': 2,
+        }
+        tasks.deduplicate_source(self.context, self.engine)
+
+        self.assertEqual(mock_get_data_using_post.call_count, 2)
+        assert self.context['source_info']['swhids'] == [
+            "swh:1:cnt:cc81ecacefe341bcb52cde42a7cd4a8f82058862"
+        ]
+
+    @mock.patch.object(tasks, 'get_data_using_post')
+    def test_deduplicate_source_with_filter(self, mock_get_data_using_post):
+        duplicate_swhid = "swh:1:cnt:c0de67c68fac3a78be782a7197f4072d8f2c8668"
+        bloom_filter = BloomFilter.for_capacity(1)
+        bloom_filter.add(duplicate_swhid)
+        client = mock.Mock()
+        client.get.return_value = mock.Mock(
+            status_code=200, content=bloom_filter.to_bytes(),
+            headers={'ETag': '"1"'})
+        mock_get_data_using_post.return_value = {
+            "duplicate_swhids": [duplicate_swhid]}
+        self.context.update({
+            'config': {'SWHID_FILTER_ENABLED': True},
+            'tmp_root_dir': self.src_dest_dir,
+            'client': client,
+            'license_scan': True,
+        })
+        tasks.deduplicate_source(self.context, self.engine)
+
+        # Only swhids in the filter are checked with hub.
+        data = mock_get_data_using_post.call_args[0][2]
+        self.assertEqual(data['swhids'], [duplicate_swhid])
+        assert self.context['source_info']['swhids'] == [
+            "swh:1:cnt:cc81ecacefe341bcb52cde42a7cd4a8f82058862"
+        ]
+
+    @mock.patch.object(tasks, 'get_data_using_post')
+    def test_deduplicate_directories(self, mock_get_data_using_post):
+        vendor_dir = os.path.join(self.src_dest_dir, 'vendor', 'foo')
+        os.makedirs(os.path.join(vendor_dir, 'sub'))
+        for path in ['a.c', 'sub/b.c']:
+            with open(os.path.join(vendor_dir, path), 'w') as f:
+                f.write(path)
+
+        def check_duplicate(client, url, data):
+            if url == '/check_duplicate_directories/':
+                return {"duplicate_swhids": [
+                    swhid for swhid in data['swhids']
+                    if swhid == directory_swhid]}
+            return {"duplicate_swhids": []}
+        mock_get_data_using_post.side_effect = check_duplicate
+        manifest = tasks.SourceManifest(self.src_dest_dir).build()
+        directory_swhid = manifest.get_directory_swhids()['vendor/foo']
+        self.context['config'] = {'DIRECTORY_DEDUP_ENABLED': True}
+        tasks.deduplicate_source(self.context, self.engine)
+
+        # Files under the duplicate directory are skipped as a whole.
+        self.assertFalse(os.path.exists(vendor_dir))
+        self.assertEqual(self.context['source_info']['directories'], [
+            {'path': 'vendor/foo', 'directory': directory_swhid}])
+        self.assertCountEqual(
+            [p['path'] for p in self.context['source_info']['paths']],
+            self.paths)
+        self.assertNotIn('vendor/foo', self.context['directory_swhids'])
+        self.assertIn('vendor', self.context['directory_swhids'])
+
+    @mock.patch.object(tasks, 'get_data_using_post')
+    def test_deduplicate_directories_with_splices(self,
+                                                  mock_get_data_using_post):
+        vendor_dir = os.path.join(self.src_dest_dir, 'vendor', 'foo')
+        os.makedirs(vendor_dir)
+        with open(os.path.join(vendor_dir, 'a.c'), 'w') as f:
+            f.write('a.c')
+        spliced_path = ('vendor/foo/bar.tar.gz/bar/b.c',
+                        'swh:1:cnt:e69de29bb2d1d6434b8b29ae775ad8c2e48c5391')
+        self.context.update({
+            'config': {'DIRECTORY_DEDUP_ENABLED': True},
+            'spliced_paths': [spliced_path],
+        })
+        # Hashes of directories with splices miss the spliced paths, they
+        # would be duplicates of the same directories without the archive.
+        mock_get_data_using_post.side_effect = \
+            lambda client, url, data: {"duplicate_swhids": data['swhids']}
+        tasks.deduplicate_source(self.context, self.engine)
+
+        self.assertTrue(os.path.isdir(vendor_dir))
+        self.assertFalse(self.context['source_info'].get('directories'))
+        self.assertEqual(self.context['directory_swhids'], {})
+        paths = [p['path'] for p in self.context['source_info']['paths']]
+        self.assertEqual(paths.count(spliced_path[0]), 1)
+        self.assertIn('vendor/foo/a.c', paths)
+
+    @mock.patch.object(tasks, 'get_data_using_post')
+    def test_deduplicate_source_with_known_files(self,
+                                                 mock_get_data_using_post):
+        known_swhid = "swh:1:cnt:c0de67c68fac3a78be782a7197f4072d8f2c8668"
+        mock_get_data_using_post.return_value = {
+            "duplicate_swhids": [known_swhid]}
+        # Known files are recorded in the manifest only.
+        self.context['source_manifest'] = tasks.SourceManifest(
+            self.src_dest_dir).add_known(
+                {os.path.join('known', 'a.txt'): (known_swhid, 'sha256')})
+        tasks.deduplicate_source(self.context, self.engine)
+
+        self.assertEqual(self.context['source_info']['swhids'], [
+            "swh:1:cnt:cc81ecacefe341bcb52cde42a7cd4a8f82058862"])
+        self.assertIn({"file": known_swhid,
+                       "path": os.path.join('known', 'a.txt')},
+                      self.context['source_info']['paths'])
+
     def tearDown(self) -> None:
         shutil.rmtree(self.src_dest_dir)
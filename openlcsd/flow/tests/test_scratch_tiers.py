@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from unittest import TestCase
+
+from openlcsd.flow import tasks
+
+
+class TestScratchTiers(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tmp_root_dir = os.path.join(self.tmp_dir, 'shared')
+        os.mkdir(self.tmp_root_dir)
+        self.tmpfs_dir = os.path.join(self.tmp_dir, 'tmpfs')
+        self.ssd_dir = os.path.join(self.tmp_dir, 'ssd')
+        self.src_file = os.path.join(self.tmp_dir, 'foo-1.0-1.src.rpm')
+        with open(self.src_file, 'wb') as f:
+            f.write(b'0' * 100)
+        self.context = {
+            'config': {
+                'SCRATCH_TIERS': [
+                    {'path': self.tmpfs_dir, 'max_size': 1000},
+                    {'path': self.ssd_dir, 'max_size': 10000}],
+                'SCRATCH_SIZE_RATIO': 4,
+            },
+            'tmp_root_dir': self.tmp_root_dir,
+            'tmp_src_filepath': self.src_file,
+            'component_type': 'RPM',
+            'component': {'nvr': 'foo-1.0-1'},
+        }
+        self.engine = mock.Mock()
+
+    def test_prepare_dest_dir_on_scratch(self):
+        tasks.prepare_dest_dir(self.context, self.engine)
+        src_dest_dir = self.context['src_dest_dir']
+        self.assertEqual(self.context['scratch_dir'], self.tmpfs_dir)
+        self.assertEqual(os.path.dirname(src_dest_dir), self.tmpfs_dir)
+        self.assertTrue(
+            os.path.basename(src_dest_dir).startswith('foo-1.0-1_'))
+        self.assertEqual(tasks.get_scratch_dir(self.context), self.tmpfs_dir)
+
+    def test_select_scratch_dir(self):
+        # 400 bytes expected
+        self.assertEqual(
+            tasks.select_scratch_dir(self.context, self.engine),
+            self.tmpfs_dir)
+        self.context['config']['SCRATCH_SIZE_RATIO'] = 50
+        self.assertEqual(
+            tasks.select_scratch_dir(self.context, self.engine),
+            self.ssd_dir)
+        self.context['config']['SCRATCH_SIZE_RATIO'] = 200
+        self.assertIsNone(
+            tasks.select_scratch_dir(self.context, self.engine))
+
+    def test_container_source_on_shared_storage(self):
+        # Container sources are used by child tasks.
+        self.context['component_type'] = 'OCI'
+        self.assertIsNone(
+            tasks.select_scratch_dir(self.context, self.engine))
+        self.context['parent'] = 'foo-container-1.0-1'
+        self.assertEqual(
+            tasks.select_scratch_dir(self.context, self.engine),
+            self.tmpfs_dir)
+
+    @mock.patch.object(tasks, 'get_source_size')
+    def test_shared_remote_source_on_shared_storage(self,
+                                                    mock_get_source_size):
+        # Shared remote sources are unpacked in place, without sizing.
+        self.context['shared_remote_source'] = True
+        self.assertIsNone(
+            tasks.select_scratch_dir(self.context, self.engine))
+        mock_get_source_size.assert_not_called()
+
+    def test_prepare_dest_dir_without_scratch(self):
+        self.context['config'] = {}
+        tasks.prepare_dest_dir(self.context, self.engine)
+        self.assertEqual(self.context['src_dest_dir'],
+                         os.path.join(self.tmp_root_dir, 'foo-1.0-1'))
+        self.assertNotIn('scratch_dir', self.context)
+        self.assertEqual(tasks.get_scratch_dir(self.context),
+                         self.tmp_root_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
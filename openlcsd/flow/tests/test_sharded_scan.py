@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from unittest import TestCase
+
+from openlcsd.flow import tasks
+
+
+def fake_scan_source(config, src_dir, logger, license_scan_req,
+                     copyright_scan_req, scanner='scancode', file_count=None):
+    paths = sorted(os.path.relpath(path, src_dir)
+                   for path in tasks.get_source_files_paths(src_dir))
+    has_exception = 'b/tiny' in paths
+    return {
+        "license_detector": "scancode 31.2.4",
+        "licenses": {
+            "data": [] if has_exception else [
+                (path, 'MIT', 100.0, 1, 1, False, 'mit.RULE')
+                for path in paths],
+            "errors": ["killed"] if has_exception else [],
+            "has_exception": has_exception
+        }
+    }
+
+
+class TestShardedScan(TestCase):
+
+    def setUp(self) -> None:
+        self.src_dir = tempfile.mkdtemp()
+        self.sizes = {'a/big': 60, 'a/medium': 40, 'b/small': 20,
+                      'b/tiny': 10, 'c': 30}
+        for path, size in self.sizes.items():
+            file_path = os.path.join(self.src_dir, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write('x' * size)
+
+    def test_partition_scan_shards(self):
+        shards = tasks.partition_scan_shards(self.src_dir, 2)
+        self.assertEqual(len(shards), 2)
+        self.assertEqual(sorted(sum(shards, [])), sorted(self.sizes))
+        totals = [sum(self.sizes[p] for p in paths) for paths in shards]
+        self.assertEqual(sorted(totals), [80, 80])
+        # No empty shards for a few files.
+        self.assertEqual(
+            len(tasks.partition_scan_shards(self.src_dir, 10)), 5)
+
+    def test_merge_scan_results(self):
+        scan_results = [{
+            "license_detector": "scancode 31.2.4",
+            "licenses": {
+                "data": [["a/big", "MIT", 100.0, 1, 2, False, "mit_1.RULE"]],
+                "errors": [],
+                "has_exception": False
+            },
+            "copyright_detector": "scancode 31.2.4",
+            "copyrights": {
+                "data": {
+                    "summary_copyrights": ["Copyright Foo"],
+                    "detail_copyrights": {"a/big": [{"copyright": "Foo"}]}
+                },
+                "errors": [],
+                "has_exception": False
+            }
+        }, {
+            "license_detector": "scancode 31.2.4",
+            "licenses": {
+                "data": [["c", "MIT", 100.0, 1, 2, False, "mit_1.RULE"]],
+                "errors": ["c: error"],
+                "has_exception": False
+            },
+            "copyright_detector": "scancode 31.2.4",
+            "copyrights": {
+                "data": {
+                    "summary_copyrights": ["Copyright Foo", "Copyright Bar"],
+                    "detail_copyrights": {"c": [{"copyright": "Bar"}]}
+                },
+                "errors": ["c: error"],
+                "has_exception": False
+            }
+        }]
+        merged = tasks.merge_scan_results(scan_results)
+        self.assertEqual([lic[0] for lic in merged['licenses']['data']],
+                         ['a/big', 'c'])
+        self.assertEqual(merged['licenses']['errors'], ['c: error'])
+        self.assertEqual(merged['copyrights']['data'], {
+            "summary_copyrights": ["Copyright Foo", "Copyright Bar"],
+            "detail_copyrights": {"a/big": [{"copyright": "Foo"}],
+                                  "c": [{"copyright": "Bar"}]}
+        })
+
+        # Exception in any shard fails the whole scan.
+        scan_results[1]['licenses']['has_exception'] = True
+        merged = tasks.merge_scan_results(scan_results)
+        self.assertTrue(merged['licenses']['has_exception'])
+        self.assertEqual(merged['licenses']['data'], [])
+
+    @mock.patch.object(tasks, 'scan_source', side_effect=fake_scan_source)
+    @mock.patch.object(tasks, 'redis_client')
+    @mock.patch.object(tasks, 'app')
+    def test_sharded_scan(self, mock_app, mock_redis_client,
+                          mock_scan_source):
+        tmp_root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_root_dir)
+        mock_app.send_task.return_value = mock.Mock(id='shard-task')
+        # Shard tasks haven't started, shards are scanned in place.
+        mock_redis_client.claim_key.return_value = True
+        context = {
+            "config": {"SCAN_BATCH_SIZE": 10, "SCANCODE_PROCESSES": 2,
+                       "LICENSE_DIR": "/licenses"},
+            "detector": "scancode 31.2.4",
+            "license_scan": True,
+            "license_scan_req": True,
+            "src_dest_dir": self.src_dir,
+            "tmp_root_dir": tmp_root_dir,
+            "source_info": {"source": {"checksum": "checksum"}},
+            "path_with_swhids": [(path, 'swh:1:cnt:' + path)
+                                 for path in self.sizes],
+            "directory_swhids": {"a": "swh:1:dir:a", "b": "swh:1:dir:b"},
+            "scan_shards": tasks.partition_scan_shards(self.src_dir, 2),
+        }
+        tasks.sharded_scan(context, mock.Mock())
+        # Only the config needed to scan is sent to shard tasks.
+        shard_context = mock_app.send_task.call_args[0][1][0]
+        self.assertEqual(shard_context['config'], {
+            "SCAN_BATCH_SIZE": 10, "SCANCODE_PROCESSES": 2})
+        self.assertEqual(len(context['scan_checkpoints']), 2)
+        scan_result = context['scan_result']
+        self.assertEqual(scan_result['failed_paths'], ['b/tiny'])
+        self.assertEqual(
+            sorted(lic[0] for lic in scan_result['licenses']['data']),
+            ['a/big', 'a/medium', 'b/small', 'c'])
+        self.assertEqual(tasks.get_scanned_directories(
+            context, scan_result['failed_paths']), {"a": "swh:1:dir:a"})
+        self.assertEqual(scan_result['source_checksum'], 'checksum')
+
+    @mock.patch.object(tasks, 'redis_client')
+    @mock.patch.object(tasks, 'app')
+    def test_wait_scan_shard_lost(self, mock_app, mock_redis_client):
+        mock_redis_client.claim_key.return_value = False
+        # Shard task finished without a result.
+        mock_app.AsyncResult.return_value.state = 'SUCCESS'
+        context = {"config": {}, "task_id": "task-1"}
+        with self.assertRaises(RuntimeError):
+            tasks.wait_scan_shard(context, mock.Mock(), self.src_dir,
+                                  'shard-task', 'checkpoint')
+
+        # Shard task never finishes.
+        mock_app.AsyncResult.return_value.state = 'PENDING'
+        context['config']['SCAN_SHARD_TIMEOUT'] = -1
+        with self.assertRaises(RuntimeError):
+            tasks.wait_scan_shard(context, mock.Mock(), self.src_dir,
+                                  'shard-task', 'checkpoint')
+        mock_app.control.revoke.assert_called_once_with(
+            'shard-task', terminate=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from unittest import TestCase
+
+from openlcsd.flow import tasks
+
+
+class TestSpliceScannedArchives(TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.mkdtemp()
+        for name in ['foo-1.0.tar.gz', 'bar-2.0.tar.gz', 'foo.spec']:
+            with open(os.path.join(self.src_dir, name), 'w') as f:
+                f.write(name)
+        self.context = {
+            'config': {'NESTED_ARCHIVE_SPLICE_ENABLED': True},
+            'detector': 'scancode-toolkit 32.0.8',
+            'license_scan': True,
+            'copyright_scan': True,
+        }
+        self.engine = mock.Mock()
+        self.foo_checksum = tasks.sha256sum(
+            os.path.join(self.src_dir, 'foo-1.0.tar.gz'))
+
+    @mock.patch.object(tasks, 'get_data_using_post')
+    def test_splice_scanned_archives(self, mock_get_data_using_post):
+        def get_paths(client, url, data):
+            if data['checksum'] == self.foo_checksum:
+                return {'source_name': 'foo.tar.gz', 'paths': [
+                    ['foo.tar.gz/foo-1.0/a.c', 'swh:1:cnt:a'],
+                    ['foo.tar.gz/foo-1.0/b.c', 'swh:1:cnt:b']]}
+            return {'source_name': None, 'paths': None}
+        mock_get_data_using_post.side_effect = get_paths
+        tasks.splice_scanned_archives(self.context, self.engine, self.src_dir)
+
+        # Only archives are checked with hub.
+        self.assertEqual(mock_get_data_using_post.call_count, 2)
+        self.assertCountEqual(self.context['spliced_paths'], [
+            ('foo-1.0.tar.gz/foo-1.0/a.c', 'swh:1:cnt:a'),
+            ('foo-1.0.tar.gz/foo-1.0/b.c', 'swh:1:cnt:b')])
+        self.assertCountEqual(os.listdir(self.src_dir),
+                              ['bar-2.0.tar.gz', 'foo.spec'])
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dir)
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+from unittest import TestCase
+
+from openlcsd.flow import tasks
+
+
+class TestStageUniqueFiles(TestCase):
+
+    def setUp(self) -> None:
+        self.src_dest_dir = tempfile.mkdtemp()
+        self.tmp_root_dir = tempfile.mkdtemp()
+        # Two paths share the same content, the third one is unique.
+        self.path_with_swhids = [
+            ('a/LICENSE', 'swh:1:cnt:1111'),
+            ('b/LICENSE', 'swh:1:cnt:1111'),
+            ('b/main.c', 'swh:1:cnt:2222'),
+        ]
+        for path, swhid in self.path_with_swhids:
+            file_path = os.path.join(self.src_dest_dir, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(swhid)
+        self.context = {
+            "config": {"SCAN_STAGING_ENABLED": True},
+            "src_dest_dir": self.src_dest_dir,
+            "tmp_root_dir": self.tmp_root_dir,
+            "path_with_swhids": self.path_with_swhids,
+        }
+        self.engine = mock.Mock()
+
+    def test_stage_unique_files(self):
+        tasks.stage_unique_files(self.context, self.engine)
+        scan_dir = self.context['scan_dir']
+        staged_paths = self.context['staged_paths']
+        self.assertEqual(staged_paths, {
+            '1111/LICENSE': 'a/LICENSE',
+            '2222/main.c': 'b/main.c',
+        })
+        for staged_path in staged_paths:
+            self.assertTrue(
+                os.path.isfile(os.path.join(scan_dir, staged_path)))
+
+        licenses = [('1111/LICENSE', 'MIT', 100.0, 1, 20, True, 'mit.LICENSE')]
+        copyrights = {
+            'summary_copyrights': ['Copyright test'],
+            'detail_copyrights': {'2222/main.c': [{'value': 'test'}]}
+        }
+        tasks.restore_staged_paths(self.context, licenses, copyrights)
+        self.assertEqual(licenses[0][0], 'a/LICENSE')
+        self.assertEqual(
+            list(copyrights['detail_copyrights'].keys()), ['b/main.c'])
+
+    def test_stage_skipped_without_duplicates(self):
+        os.remove(os.path.join(self.src_dest_dir, 'b/LICENSE'))
+        tasks.stage_unique_files(self.context, self.engine)
+        self.assertNotIn('scan_dir', self.context)
+
+    def tearDown(self):
+        shutil.rmtree(self.src_dest_dir)
+        shutil.rmtree(self.tmp_root_dir)